@@ -0,0 +1,245 @@
+"""Price-alert matching engine with batched notification delivery"""
+import asyncio
+import bisect
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+ALERT_SINK = os.getenv("ALERT_SINK", "log")
+ALERT_FLUSH_INTERVAL = float(os.getenv("ALERT_FLUSH_INTERVAL", "2.0"))
+ALERT_BATCH_SIZE = 1000
+# Fired alerts held for delivery; past this, new ones are handed back to be re-armed
+ALERT_MAX_PENDING = int(os.getenv("ALERT_MAX_PENDING", "100000"))
+# Failed deliveries of one batch before it is handed back; retries back off exponentially
+ALERT_MAX_ATTEMPTS = int(os.getenv("ALERT_MAX_ATTEMPTS", "5"))
+ALERT_MAX_BACKOFF = 60.0
+
+ACTIVE = "active"
+TRIGGERED = "triggered"
+
+
+@dataclass
+class Alert:
+    id: int
+    user_email: str
+    drug: str
+    drug_name: str
+    target_price: float
+    status: str = ACTIVE
+    triggered_price: Optional[float] = None
+    triggered_pharmacy_id: Optional[int] = None
+    triggered_at: Optional[float] = None
+
+
+class AlertSink(ABC):
+    """Where triggered-alert notifications go; subclasses deliver one batch at a time"""
+
+    @abstractmethod
+    async def deliver(self, notifications: List[dict]):
+        ...
+
+
+class LogSink(AlertSink):
+    async def deliver(self, notifications: List[dict]):
+        for n in notifications:
+            print(f"Price alert {n['id']}: {n['drug_name']} at {n['triggered_price']} "
+                  f"(target {n['target_price']}) for {n['user_email']}")
+
+
+class FileSink(AlertSink):
+    """Appends one JSON line per notification"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, lines: str):
+        with open(self.path, "a") as f:
+            f.write(lines)
+
+    async def deliver(self, notifications: List[dict]):
+        lines = "".join(json.dumps(n) + "\n" for n in notifications)
+        await asyncio.to_thread(self._write, lines)
+
+
+def create_sink(spec: str = ALERT_SINK) -> AlertSink:
+    if spec.startswith("file:"):
+        return FileSink(spec[len("file:"):])
+    if spec == "log":
+        return LogSink()
+    raise ValueError(f"Unknown ALERT_SINK: {spec}")
+
+
+class AlertBook:
+    """
+    Active alerts per drug, kept as parallel lists sorted by target price.
+    Fired alerts leave the book; their history lives in the database.
+
+    An alert fires when a price at or below its target is seen. Those are
+    exactly the alerts from `bisect_left(targets, price)` to the end, so a
+    price observation costs O(log n) plus the alerts it fires, and firing is
+    a single slice truncation.
+    """
+
+    def __init__(self):
+        self._targets: Dict[str, List[float]] = {}
+        self._ids: Dict[str, List[int]] = {}
+        self.alerts: Dict[int, Alert] = {}
+
+    def __len__(self) -> int:
+        return len(self.alerts)
+
+    def drugs(self) -> List[str]:
+        return list(self._targets)
+
+    def add(self, alert: Alert):
+        self.alerts[alert.id] = alert
+        targets = self._targets.setdefault(alert.drug, [])
+        ids = self._ids.setdefault(alert.drug, [])
+        # Ties keep creation order so ids stay aligned with targets
+        i = bisect.bisect_right(targets, alert.target_price)
+        targets.insert(i, alert.target_price)
+        ids.insert(i, alert.id)
+
+    def observe(self, drug: str, price: float, pharmacy_id: Optional[int] = None) -> List[Alert]:
+        """Fire every active alert on `drug` whose target is at or above `price`"""
+        targets = self._targets.get(drug)
+        if not targets or targets[-1] < price:
+            return []
+        i = bisect.bisect_left(targets, price)
+        fired_ids = self._ids[drug][i:]
+        del targets[i:]
+        del self._ids[drug][i:]
+        if not targets:
+            del self._targets[drug]
+            del self._ids[drug]
+        now = time.time()
+        fired = []
+        for alert_id in fired_ids:
+            alert = self.alerts.pop(alert_id)
+            alert.status = TRIGGERED
+            alert.triggered_price = price
+            alert.triggered_pharmacy_id = pharmacy_id
+            alert.triggered_at = now
+            fired.append(alert)
+        return fired
+
+
+class AlertNotifier:
+    """
+    Collects fired alerts and hands them to the sink in batches from a
+    background task. `on_flush` persists an alert's triggered state only
+    once the sink has taken it; until then the alert is still active in
+    the database.
+
+    Alerts the notifier cannot deliver go to `on_drop` to be re-armed:
+    those past ALERT_MAX_PENDING, and batches the sink has refused
+    ALERT_MAX_ATTEMPTS times in a row.
+    """
+
+    def __init__(self, sink: AlertSink, on_flush=None, on_drop=None, flush_interval: float = ALERT_FLUSH_INTERVAL,
+                 max_pending: int = ALERT_MAX_PENDING, max_attempts: int = ALERT_MAX_ATTEMPTS):
+        self.sink = sink
+        self.on_flush = on_flush
+        self.on_drop = on_drop
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._pending: List[Alert] = []
+        # Delivered but not yet persisted
+        self._unsaved: List[Alert] = []
+        self._attempts = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.delivered = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def enqueue(self, alerts: List[Alert]):
+        if not alerts:
+            return
+        room = max(0, self.max_pending - len(self._pending) - len(self._unsaved))
+        if len(alerts) > room:
+            self._drop(alerts[room:])
+            alerts = alerts[:room]
+        self._pending.extend(alerts)
+        if self._wake is not None and len(self._pending) >= ALERT_BATCH_SIZE:
+            self._wake.set()
+
+    def _drop(self, alerts: List[Alert]):
+        self.dropped += len(alerts)
+        if self.on_drop is not None:
+            self.on_drop(alerts)
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Signalled rather than cancelled, since wait_for can swallow a cancel
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            # A pass that failed waits longer before the next, up to ALERT_MAX_BACKOFF
+            delay = min(ALERT_MAX_BACKOFF, self.flush_interval * 2 ** self._attempts)
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                self.failures += 1
+                print(f"Alert delivery failed: {e}")
+
+    async def flush(self):
+        while self._pending:
+            batch = self._pending[:ALERT_BATCH_SIZE]
+            try:
+                await self.sink.deliver([asdict(alert) for alert in batch])
+            except Exception:
+                self._attempts += 1
+                if self._attempts < self.max_attempts:
+                    raise
+                print(f"Alert delivery failed {self._attempts} times; re-arming {len(batch)} alerts")
+                self._attempts = 0
+                del self._pending[:len(batch)]
+                self._drop(batch)
+                continue
+            self._attempts = 0
+            del self._pending[:len(batch)]
+            self._unsaved.extend(batch)
+            self.delivered += len(batch)
+        while self._unsaved:
+            batch = self._unsaved[:ALERT_BATCH_SIZE]
+            if self.on_flush is not None:
+                # A failure leaves the batch for the next pass; the sink is not asked again
+                await self.on_flush(batch)
+            del self._unsaved[:len(batch)]
+
+    def unpersisted(self) -> Dict[int, Alert]:
+        """Alerts fired here whose triggered state is not in the database yet, by id"""
+        return {alert.id: alert for alert in self._pending + self._unsaved}
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "unsaved": len(self._unsaved),
+            "delivered": self.delivered,
+            "failures": self.failures,
+            "dropped": self.dropped
+        }
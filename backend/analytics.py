@@ -0,0 +1,312 @@
+"""Streaming search analytics for the admin dashboard"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+from storage import Repository
+
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "1.0"))
+ANALYTICS_BUFFER_SIZE = int(os.getenv("ANALYTICS_BUFFER_SIZE", "100000"))
+TOP_K = 10
+SKETCH_CAPACITY = 200
+ACTIVE_USER_WINDOW = 24 * 3600
+
+# (created_at, drug_key, savings or None, lat, lng, client)
+SearchEvent = Tuple[float, str, Optional[float], Optional[float], Optional[float], str]
+
+
+class RollingCounter:
+    """Event count over a sliding window, kept as a ring of per-bucket counts with a running total"""
+
+    def __init__(self, window_seconds: int, bucket_seconds: int = 60):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = [0] * (window_seconds // bucket_seconds)
+        self.total = 0
+        self._bucket = 0
+
+    def _advance(self, now: float):
+        bucket = int(now // self.bucket_seconds)
+        steps = min(bucket - self._bucket, len(self.buckets))
+        for i in range(1, steps + 1):
+            slot = (self._bucket + i) % len(self.buckets)
+            self.total -= self.buckets[slot]
+            self.buckets[slot] = 0
+        self._bucket = max(self._bucket, bucket)
+
+    def add(self, now: float, count: int = 1):
+        self._advance(now)
+        self.buckets[self._bucket % len(self.buckets)] += count
+        self.total += count
+
+    def value(self, now: float) -> int:
+        self._advance(now)
+        return self.total
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitters: at most `capacity` counters. A new item
+    evicts the smallest counter and inherits its count as the error bound,
+    so any item with true frequency above N / capacity is always tracked.
+    """
+
+    def __init__(self, capacity: int = SKETCH_CAPACITY):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+
+    def add(self, item: str, count: int = 1) -> Optional[str]:
+        """Count `item`; returns the item it evicted, if any"""
+        if item in self.counts:
+            self.counts[item] += count
+            return None
+        if len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+            return None
+        victim = min(self.counts, key=self.counts.__getitem__)
+        floor = self.counts.pop(victim)
+        del self.errors[victim]
+        self.counts[item] = floor + count
+        self.errors[item] = floor
+        return victim
+
+    def top(self, k: int) -> List[Tuple[str, int]]:
+        return sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+
+class P2Quantile:
+    """Jain & Chlamtac P² estimator: one quantile in O(1) memory with five markers"""
+
+    def __init__(self, p: float):
+        self.p = p
+        self.heights: List[float] = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float):
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                candidate = self._parabolic(i, step)
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                q[i] = candidate
+                n[i] += step
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self) -> Optional[float]:
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            ordered = sorted(self.heights)
+            return ordered[min(len(ordered) - 1, int(self.p * len(ordered)))]
+        return self.heights[2]
+
+
+class SavingsStats:
+    """Welford running mean/variance plus streaming median and p90"""
+
+    __slots__ = ("n", "mean", "m2", "total", "p50", "p90")
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.total = 0.0
+        self.p50 = P2Quantile(0.5)
+        self.p90 = P2Quantile(0.9)
+
+    def add(self, x: float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.total += x
+        self.p50.add(x)
+        self.p90.add(x)
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+
+class SearchAnalytics:
+    """
+    Request handlers `record` into a deque, which is safe to append to from
+    the threadpool without a lock. A background task drains it, folds the
+    events into the aggregates, writes them to `searches` with one
+    executemany, and rebuilds the dashboard snapshot, so reads are a dict
+    lookup no matter how many searches have been stored.
+
+    Memory stays bounded: savings are kept only for the drugs the sketch
+    tracks, and clients are held in last-seen order so the ones outside
+    ACTIVE_USER_WINDOW expire from the front.
+    """
+
+    def __init__(self, repository: Repository, flush_interval: float = ANALYTICS_FLUSH_INTERVAL,
+                 buffer_size: int = ANALYTICS_BUFFER_SIZE):
+        self.repository = repository
+        self.flush_interval = flush_interval
+        self._events: deque = deque(maxlen=buffer_size)
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.total_searches = 0
+        self.last_hour = RollingCounter(3600)
+        self.last_day = RollingCounter(24 * 3600)
+        self.drugs = SpaceSaving()
+        self.savings: Dict[str, SavingsStats] = {}
+        self.overall = SavingsStats()
+        self._clients: "OrderedDict[str, float]" = OrderedDict()
+        self.dropped = 0
+        self.snapshot: dict = self._build_snapshot(time.time())
+
+    def record(self, drug: str, savings: Optional[float] = None, lat: Optional[float] = None,
+               lng: Optional[float] = None, client: str = ""):
+        events = self._events
+        if len(events) == events.maxlen:
+            self.dropped += 1
+        events.append((time.time(), drug, savings, lat, lng, client))
+
+    async def load(self):
+        """Seed counts and mean savings from stored searches (one GROUP BY at startup)"""
+        self.total_searches = 0
+        self.drugs = SpaceSaving()
+        self.savings = {}
+        self.overall = SavingsStats()
+        rows = await self.repository.search_totals()
+        for row in rows:
+            count = int(row["searches"])
+            self.total_searches += count
+            self._count_drug(row["drug_key"], count)
+            if row["priced"]:
+                stats = self.savings.setdefault(row["drug_key"], SavingsStats())
+                stats.n = int(row["priced"])
+                stats.mean = float(row["avg_savings"])
+                stats.total = stats.mean * stats.n
+        self.overall.n = sum(int(row["priced"] or 0) for row in rows)
+        self.overall.total = sum(float(row["avg_savings"]) * int(row["priced"]) for row in rows if row["priced"])
+        self.overall.mean = self.overall.total / self.overall.n if self.overall.n else 0.0
+        self.snapshot = self._build_snapshot(time.time())
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Signalled rather than cancelled, so a flush in progress finishes writing what it folded
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Analytics flush failed: {e}")
+
+    def _drain(self) -> List[SearchEvent]:
+        events = self._events
+        return [events.popleft() for _ in range(len(events))]
+
+    async def flush(self):
+        batch = self._drain()
+        if not batch:
+            return
+        for created_at, drug, savings, _, _, client in batch:
+            self.total_searches += 1
+            self.last_hour.add(created_at)
+            self.last_day.add(created_at)
+            self._count_drug(drug)
+            if client:
+                self._clients[client] = created_at
+                self._clients.move_to_end(client)
+            if savings is not None:
+                self.savings.setdefault(drug, SavingsStats()).add(savings)
+                self.overall.add(savings)
+        self.snapshot = self._build_snapshot(time.time())
+        await self.repository.insert_searches([(drug, savings, lat, lng) for _, drug, savings, lat, lng, _ in batch])
+
+    def _count_drug(self, drug: str, count: int = 1):
+        evicted = self.drugs.add(drug, count)
+        if evicted is not None:
+            self.savings.pop(evicted, None)
+
+    def _expire_clients(self, now: float):
+        """Forget clients not seen within ACTIVE_USER_WINDOW; costs only the clients removed"""
+        cutoff = now - ACTIVE_USER_WINDOW
+        clients = self._clients
+        while clients and next(iter(clients.values())) < cutoff:
+            clients.popitem(last=False)
+
+    def _build_snapshot(self, now: float) -> dict:
+        self._expire_clients(now)
+        most_searched = []
+        for drug, count in self.drugs.top(TOP_K):
+            stats = self.savings.get(drug)
+            most_searched.append({
+                "drug": drug,
+                "count": count,
+                "avg_savings_inr": round(stats.mean, 2) if stats else 0.0,
+                "p50_savings_inr": round(stats.p50.value(), 2) if stats and stats.p50.value() is not None else None,
+                "p90_savings_inr": round(stats.p90.value(), 2) if stats and stats.p90.value() is not None else None
+            })
+        return {
+            "total_searches": self.total_searches,
+            "searches_last_hour": self.last_hour.value(now),
+            "searches_last_24h": self.last_day.value(now),
+            "active_users": len(self._clients),
+            "total_savings_inr": round(self.overall.total, 2),
+            "avg_savings_per_search": round(self.overall.mean, 2),
+            "most_searched": most_searched
+        }
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._events),
+            "dropped": self.dropped,
+            "tracked_drugs": len(self.drugs.counts),
+            "active_clients": len(self._clients)
+        }
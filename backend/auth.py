@@ -0,0 +1,153 @@
+"""Password hashing, signed access tokens and the auth dependencies for protected routes"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+SECRET_KEY = os.getenv("SECRET_KEY", "")
+TOKEN_TTL = int(os.getenv("TOKEN_TTL", str(12 * 3600)))
+CLAIMS_CACHE_SIZE = 10000
+# Values from the example configs; anyone who has read them could sign tokens
+PLACEHOLDER_SECRETS = {"change-me", "your_secret_key_for_jwt_tokens"}
+
+# scrypt at N=2^14, r=8 costs ~16 MiB and tens of milliseconds per hash
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+HASH_PREFIX = "scrypt"
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=64 * 1024 * 1024, dklen=32)
+
+
+def hash_password_sync(password: str) -> str:
+    salt = secrets.token_bytes(16)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{HASH_PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+# Checked against when there is no stored hash; no password derives an all-zero digest
+DUMMY_HASH = f"{HASH_PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(bytes(16))}${_b64encode(bytes(32))}"
+
+
+def _verify_hash(password: str, stored: str) -> bool:
+    _, n, r, p, salt, digest = stored.split("$")
+    return hmac.compare_digest(_scrypt(password, _b64decode(salt), int(n), int(r), int(p)), _b64decode(digest))
+
+
+def verify_password_sync(password: str, stored: Optional[str]) -> bool:
+    if not stored or not is_hashed(stored):
+        # Unknown user or no hash: do the same scrypt work, so response time does not reveal which emails exist
+        _verify_hash(password, DUMMY_HASH)
+        return False
+    return _verify_hash(password, stored)
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(HASH_PREFIX + "$")
+
+
+async def hash_password(password: str) -> str:
+    """KDF work runs in the threadpool so logins never stall the event loop"""
+    return await asyncio.to_thread(hash_password_sync, password)
+
+
+async def verify_password(password: str, stored: Optional[str]) -> bool:
+    return await asyncio.to_thread(verify_password_sync, password, stored)
+
+
+class TokenError(Exception):
+    pass
+
+
+class TokenSigner:
+    """
+    Stateless HMAC-SHA256 tokens: base64url(JSON claims) "." base64url(MAC).
+    Verified claims are kept in a bounded LRU keyed by the token string, so a
+    repeat request costs a dict lookup and an expiry check.
+    """
+
+    def __init__(self, secret: str = SECRET_KEY, ttl: int = TOKEN_TTL, cache_size: int = CLAIMS_CACHE_SIZE):
+        if not secret:
+            print("SECRET_KEY is not set; using a random key, so tokens will not survive a restart")
+            secret = secrets.token_hex(32)
+        elif secret in PLACEHOLDER_SECRETS:
+            raise ValueError("SECRET_KEY is the example placeholder; set a random one, e.g. `openssl rand -hex 32`")
+        self._key = secret.encode()
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._claims: "OrderedDict[str, dict]" = OrderedDict()
+
+    def _mac(self, payload: str) -> str:
+        return _b64encode(hmac.new(self._key, payload.encode(), hashlib.sha256).digest())
+
+    def issue(self, email: str, role: str, name: Optional[str] = None) -> str:
+        now = int(time.time())
+        claims = {"sub": email, "role": role, "name": name, "iat": now, "exp": now + self.ttl}
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        return f"{payload}.{self._mac(payload)}"
+
+    def verify(self, token: str) -> dict:
+        claims = self._claims.get(token)
+        if claims is None:
+            payload, _, mac = token.partition(".")
+            # As bytes: compare_digest rejects str with non-ASCII characters, which clients can send
+            if not mac or not hmac.compare_digest(mac.encode(), self._mac(payload).encode()):
+                raise TokenError("Invalid token")
+            try:
+                claims = json.loads(_b64decode(payload))
+            except ValueError:
+                raise TokenError("Invalid token")
+            self._claims[token] = claims
+            if len(self._claims) > self.cache_size:
+                self._claims.popitem(last=False)
+        else:
+            self._claims.move_to_end(token)
+        if claims["exp"] < time.time():
+            self._claims.pop(token, None)
+            raise TokenError("Token expired")
+        return claims
+
+
+token_signer = TokenSigner()
+
+
+async def require_user(authorization: Optional[str] = Header(None)) -> dict:
+    """Claims of the bearer token; async so it runs inline rather than in the threadpool"""
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return token_signer.verify(authorization[len("Bearer "):])
+    except TokenError as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+
+
+async def optional_user(authorization: Optional[str] = Header(None)) -> Optional[dict]:
+    """Claims of the bearer token, or None without one; a bad token is still a 401"""
+    if authorization is None:
+        return None
+    return await require_user(authorization)
+
+
+async def require_admin(authorization: Optional[str] = Header(None)) -> dict:
+    claims = await require_user(authorization)
+    if claims["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return claims
@@ -0,0 +1,328 @@
+"""
+Latency and throughput benchmark for the MedFinder API on a synthetic catalogue.
+
+By default requests go straight into the ASGI app in-process. `--uvicorn`
+instead starts a local uvicorn server on the same dataset and drives it
+over HTTP; add `--workers N` to serve it with serve.py's multi-worker mode
+and compare throughput across worker counts. Results are written as JSON; pass `--baseline` with an earlier
+results file to print per-endpoint deltas.
+
+    cd backend
+    python benchmarks/bench_api.py --pharmacies 10000 --drugs 50000 --output bench.json
+    python benchmarks/bench_api.py --baseline bench.json --output bench-new.json
+    python benchmarks/bench_api.py --workers 4 --endpoints compare_prices --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+CITIES = {
+    "Delhi": (28.61, 77.21),
+    "Mumbai": (19.08, 72.88),
+    "Bangalore": (12.97, 77.59),
+    "Chennai": (13.08, 80.27),
+    "Kolkata": (22.57, 88.36),
+    "Hyderabad": (17.39, 78.49),
+    "Pune": (18.52, 73.86),
+    "Ahmedabad": (23.02, 72.57),
+}
+CHAINS = ["Apollo Pharmacy", "MedPlus", "Netmeds", "Wellness Forever", "Guardian", "Frank Ross", "Jan Aushadhi"]
+SYLLABLES = ["ka", "lo", "mi", "ra", "te", "vo", "zi", "pa", "nu", "de", "sa", "fo", "gu", "ly", "xe", "bra", "cor", "den"]
+SUFFIXES = ["pril", "statin", "olol", "formin", "cillin", "azole", "sartan", "mab", "dipine", "tidine", "prazole", "vir"]
+ENDPOINTS = ["parse_drug", "compare_prices", "nearby_pharmacies", "estimate_insurance", "report_stock", "report_price"]
+
+
+def synthetic_catalogue(n_pharmacies: int, n_drugs: int, seed: int = 42) -> Tuple[Dict[str, dict], List[dict]]:
+    rng = random.Random(seed)
+    drugs: Dict[str, dict] = {}
+    while len(drugs) < n_drugs:
+        stem = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        generic = stem + rng.choice(SUFFIXES)
+        if generic in drugs:
+            continue
+        drugs[generic] = {
+            "generic": generic,
+            "brand": stem.capitalize() + rng.choice(["ex", "ol", "in", "a"]),
+            "rxnorm": str(100000 + len(drugs)),
+            "atc": f"C{rng.randint(1, 99):02d}XX",
+            "synonyms": []
+        }
+    pharmacies = []
+    for i in range(n_pharmacies):
+        city = rng.choice(list(CITIES))
+        lat, lng = CITIES[city]
+        pharmacies.append({
+            "id": i + 1,
+            "name": f"{rng.choice(CHAINS)} #{i + 1}",
+            "city": city,
+            "area": f"Sector {rng.randint(1, 120)}",
+            "lat": round(lat + rng.uniform(-0.25, 0.25), 6),
+            "lng": round(lng + rng.uniform(-0.25, 0.25), 6),
+            "open": rng.random() > 0.1
+        })
+    return drugs, pharmacies
+
+
+def install_catalogue(drugs: Dict[str, dict], pharmacies: List[dict]):
+    """Make main seed an empty database with the synthetic catalogue"""
+    import main
+    main.MOCK_DRUGS.clear()
+    main.MOCK_DRUGS.update(drugs)
+    main.MOCK_PHARMACIES[:] = pharmacies
+    return main
+
+
+def request_factory(drugs: Dict[str, dict], pharmacies: List[dict], seed: int = 7) -> Dict[str, Callable[[], dict]]:
+    """Per endpoint, a function returning the kwargs of one randomized httpx request"""
+    rng = random.Random(seed)
+    names = list(drugs)
+    brands = [info["brand"] for info in drugs.values()]
+
+    def point():
+        pharmacy = rng.choice(pharmacies)
+        return pharmacy["lat"] + rng.uniform(-0.02, 0.02), pharmacy["lng"] + rng.uniform(-0.02, 0.02)
+
+    def parse_drug():
+        name = rng.choice(names) if rng.random() < 0.7 else rng.choice(brands)
+        return {"method": "POST", "url": "/api/drugs/parse", "json": {"drug_name": name, "strength": "10mg"}}
+
+    def compare_prices():
+        params = {"drug_name": rng.choice(names)}
+        if rng.random() < 0.5:
+            params["location"] = rng.choice(list(CITIES))
+        else:
+            params["lat"], params["lng"] = point()
+            params["radius_km"] = 5
+        return {"method": "GET", "url": "/api/prices/compare", "params": params}
+
+    def nearby_pharmacies():
+        lat, lng = point()
+        return {"method": "GET", "url": "/api/pharmacies/nearby", "params": {"lat": lat, "lng": lng, "k": 20}}
+
+    def estimate_insurance():
+        return {"method": "POST", "url": "/api/insurance/estimate", "params": {
+            "drug_name": rng.choice(names), "insurer": rng.choice(["Star Health", "CGHS", "Other"]),
+            "generic_price": round(rng.uniform(20, 500), 2), "tier": rng.randint(1, 4)
+        }}
+
+    def report_stock():
+        return {"method": "POST", "url": "/api/stock/report", "params": {
+            "pharmacy_id": rng.choice(pharmacies)["id"], "drug_name": rng.choice(names),
+            "in_stock": rng.random() < 0.8
+        }}
+
+    def report_price():
+        return {"method": "POST", "url": "/api/prices/report", "json": {
+            "pharmacy_id": rng.choice(pharmacies)["id"], "drug_name": rng.choice(names),
+            "price": round(rng.uniform(20, 500), 2)
+        }}
+
+    return {name: fn for name, fn in locals().items() if name in ENDPOINTS}
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = p / 100 * (len(sorted_values) - 1)
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+async def run_endpoint(client, make_request: Callable[[], dict], requests: int, concurrency: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        await client.request(**make_request())
+    pending = [make_request() for _ in range(requests)]
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+
+    async def worker():
+        while pending:
+            kwargs = pending.pop()
+            start = time.perf_counter()
+            response = await client.request(**kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())}
+    }
+
+
+async def run_suite(client, factories: Dict[str, Callable[[], dict]], endpoints: List[str],
+                    requests: int, concurrency: int, warmup: int) -> Dict[str, dict]:
+    results = {}
+    for name in endpoints:
+        results[name] = await run_endpoint(client, factories[name], requests, concurrency, warmup)
+        r = results[name]
+        print(f"{name:<20} {r['rps']:>9.1f} rps  p50 {r['p50_ms']:>8.2f}ms  p95 {r['p95_ms']:>8.2f}ms  "
+              f"p99 {r['p99_ms']:>8.2f}ms  {r['statuses']}")
+    return results
+
+
+async def bench_in_process(args, drugs, pharmacies) -> Dict[str, dict]:
+    import httpx
+    main = install_catalogue(drugs, pharmacies)
+    started = time.perf_counter()
+    await main.app.router.startup()
+    print(f"startup with {len(pharmacies)} pharmacies / {len(drugs)} drugs: {time.perf_counter() - started:.2f}s")
+    try:
+        transport = httpx.ASGITransport(app=main.app, client=("127.0.0.1", 50000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_suite(client, request_factory(drugs, pharmacies), args.endpoints,
+                                   args.requests, args.concurrency, args.warmup)
+    finally:
+        await main.app.router.shutdown()
+
+
+async def seed_database(drugs: Dict[str, dict], pharmacies: List[dict]):
+    """Seed the synthetic catalogue up front, since serve.py workers load whatever the database holds"""
+    main = install_catalogue(drugs, pharmacies)
+    await main.db.connect()
+    try:
+        await main.prepare_database()
+    finally:
+        await main.db.close()
+
+
+async def bench_uvicorn(args, drugs, pharmacies) -> Dict[str, dict]:
+    import httpx
+    if args.workers:
+        await seed_database(drugs, pharmacies)
+        command = [sys.executable, os.path.join(BACKEND_DIR, "serve.py"), "--host", "127.0.0.1",
+                   "--port", str(args.port), "--workers", str(args.workers)]
+    else:
+        command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port),
+                   "--pharmacies", str(args.pharmacies), "--drugs", str(args.drugs)]
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=os.environ.copy())
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            deadline = time.time() + 300
+            while True:
+                try:
+                    await client.get("/")
+                    break
+                except httpx.TransportError:
+                    if time.time() > deadline or server.poll() is not None:
+                        raise RuntimeError("uvicorn did not come up")
+                    await asyncio.sleep(0.5)
+            return await run_suite(client, request_factory(drugs, pharmacies), args.endpoints,
+                                   args.requests, args.concurrency, args.warmup)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def serve(args, drugs, pharmacies):
+    import uvicorn
+    main = install_catalogue(drugs, pharmacies)
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_deltas(results: Dict[str, dict], baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["endpoints"]
+    print(f"\nvs {baseline_path}")
+    for name, r in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        deltas = "  ".join(
+            f"{metric} {(r[metric] - old[metric]) / old[metric] * 100:+6.1f}%"
+            for metric in ("rps", "p50_ms", "p95_ms", "p99_ms") if old[metric]
+        )
+        print(f"{name:<20} {deltas}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pharmacies", type=int, default=10000)
+    parser.add_argument("--drugs", type=int, default=50000)
+    parser.add_argument("--requests", type=int, default=2000, help="measured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument("--uvicorn", action="store_true", help="drive a local uvicorn server over HTTP")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=0, help="serve with serve.py and this many workers (implies --uvicorn)")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    parser.add_argument("--openfda", action="store_true", help="let parse_drug call the real openFDA API")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    # Each run gets a fresh database, so main seeds it with the synthetic catalogue
+    if "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='medfinder-bench-')}/bench.db"
+    if not args.openfda:
+        # Refused connections fail fast and land in the label cache's error TTL
+        os.environ.setdefault("OPENFDA_BASE_URL", "http://127.0.0.1:9")
+    os.environ.setdefault("INGEST_QUEUE_SIZE", str(max(10000, 2 * args.requests)))
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+    drugs, pharmacies = synthetic_catalogue(args.pharmacies, args.drugs)
+    if args.serve:
+        serve(args, drugs, pharmacies)
+        return
+
+    args.uvicorn = args.uvicorn or args.workers > 0
+    runner = bench_uvicorn if args.uvicorn else bench_in_process
+    results = asyncio.run(runner(args, drugs, pharmacies))
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "mode": "uvicorn" if args.uvicorn else "in_process",
+        "workers": args.workers or 1,
+        "dataset": {"pharmacies": args.pharmacies, "drugs": args.drugs},
+        "requests_per_endpoint": args.requests,
+        "concurrency": args.concurrency,
+        "endpoints": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nwrote {args.output}")
+    if args.baseline:
+        print_deltas(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
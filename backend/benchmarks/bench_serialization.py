@@ -0,0 +1,91 @@
+"""
+Cost of building and serializing a compare_prices payload: the old dict
+rows through jsonable_encoder + json.dumps versus dataclass rows rendered
+by orjson. The middle column isolates the encoder from the row type.
+
+    cd backend && python benchmarks/bench_serialization.py [rows ...]
+"""
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.encoders import jsonable_encoder
+
+from responses import AIPrediction, PharmacyPrice, render_json
+
+
+def make_fields(n: int):
+    rng = random.Random(n)
+    fields = []
+    for i in range(n):
+        generic = round(rng.uniform(20, 400), 2)
+        fields.append(dict(
+            pharmacy_id=i + 1, pharmacy_name=f"Pharmacy {i + 1}", city="Mumbai", area="Andheri",
+            distance=round(rng.uniform(0, 25), 2), brand_price=round(generic * 3.5, 2), generic_price=generic,
+            savings_inr=round(generic * 2.5, 2), stock_status="in_stock", open_now=True,
+            lat=19.0 + rng.random(), lng=72.8 + rng.random(), rating=round(rng.uniform(3.5, 5), 1),
+            review_count=rng.randint(10, 3000),
+            predicted=round(generic * 0.88, 2), timestamp="2026-01-01T10:00:00"
+        ))
+    return fields
+
+
+def dict_rows(fields):
+    return [
+        {**{k: v for k, v in f.items() if k != "predicted"},
+         "ai_prediction": {"predicted_price": f["predicted"], "price_trend": "dropping",
+                           "best_time_to_buy": "Tuesday morning", "confidence": 0.87}}
+        for f in fields
+    ]
+
+
+def dataclass_rows(fields):
+    return [
+        PharmacyPrice(**{k: v for k, v in f.items() if k != "predicted"},
+                      ai_prediction=AIPrediction(f["predicted"], "dropping", "Tuesday morning", 0.87))
+        for f in fields
+    ]
+
+
+def payload(prices):
+    return {"success": True, "data": {"drug_name": "lisinopril", "location": "Mumbai",
+                                      "prices": prices, "total_pharmacies": len(prices)}}
+
+
+def stdlib_path(content) -> bytes:
+    # What JSONResponse did before: encoder walk, then json.dumps
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def old_path(fields) -> bytes:
+    return stdlib_path(payload(dict_rows(fields)))
+
+
+def dict_orjson_path(fields) -> bytes:
+    return render_json(payload(dict_rows(fields)))
+
+
+def new_path(fields) -> bytes:
+    return render_json(payload(dataclass_rows(fields)))
+
+
+def main(sizes):
+    print(f"{'rows':>6} {'dict+encoder+json':>20} {'dict+orjson':>14} {'dataclass+orjson':>18} {'speedup':>8}")
+    for n in sizes:
+        fields = make_fields(n)
+        assert json.loads(old_path(fields)) == json.loads(new_path(fields))
+        number = max(20, 20000 // n)
+        timings = [
+            min(timeit.repeat(lambda: fn(fields), number=number, repeat=5)) / number * 1e6
+            for fn in (old_path, dict_orjson_path, new_path)
+        ]
+        print(f"{n:>6} {timings[0]:>18.1f}us {timings[1]:>12.1f}us {timings[2]:>16.1f}us {timings[0] / timings[2]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [20, 200, 2000])
@@ -0,0 +1,144 @@
+"""
+Cold-start benchmark: how long a fresh worker takes from `python` to
+serving its first request on a synthetic catalogue.
+
+Every run is a new interpreter. It imports main, runs the startup hooks
+and sends one price comparison. Three scenarios are measured against the
+same seeded database:
+
+    database         snapshot disabled; rows loaded and the drug index built
+    snapshot_build   no snapshot on disk yet; built, then mapped
+    snapshot_mapped  snapshot already on disk; only mapped
+
+    cd backend
+    python benchmarks/bench_startup.py --pharmacies 10000 --drugs 50000 --output startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+from bench_api import git_revision, seed_database, synthetic_catalogue  # noqa: E402
+
+SCENARIOS = ["database", "snapshot_build", "snapshot_mapped"]
+
+
+def private_mb() -> float:
+    """Resident memory not shared with other processes (Linux only, else 0)"""
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return 0.0
+    kb = sum(int(fields[name].split()[0]) for name in ("Private_Clean", "Private_Dirty") if name in fields)
+    return round(kb / 1024, 1)
+
+
+def child(drug: str):
+    """One cold start; prints a JSON line of timings"""
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+
+    async def run() -> dict:
+        await main.app.router.startup()
+        ready = time.perf_counter()
+        import httpx
+        transport = httpx.ASGITransport(app=main.app, client=("127.0.0.1", 50000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            request_started = time.perf_counter()
+            response = await client.get("/api/prices/compare", params={"drug_name": drug, "location": "Delhi"})
+            response.raise_for_status()
+            first_request = time.perf_counter() - request_started
+        result = {
+            "import_s": imported - started,
+            "startup_s": ready - imported,
+            "ready_s": ready - started,
+            "first_request_ms": first_request * 1000,
+            "private_mb": private_mb(),
+        }
+        await main.app.router.shutdown()
+        return result
+
+    print(json.dumps(asyncio.run(run())))
+
+
+def cold_start(env: dict, drug: str) -> dict:
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), "--child", drug], cwd=BACKEND_DIR, env=env, text=True
+    )
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(runs: list) -> dict:
+    return {
+        metric: round(statistics.median(run[metric] for run in runs), 3)
+        for metric in ("import_s", "startup_s", "ready_s", "first_request_ms", "private_mb")
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pharmacies", type=int, default=10000)
+    parser.add_argument("--drugs", type=int, default=50000)
+    parser.add_argument("--runs", type=int, default=3, help="cold starts per scenario; the median is reported")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        child(args.child)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="medfinder-startup-")
+    database = os.path.join(workdir, "bench.db")
+    snapshot = os.path.join(workdir, "catalogue.snapshot")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    # Refused connections fail fast, so no run waits on the real openFDA API
+    os.environ.setdefault("OPENFDA_BASE_URL", "http://127.0.0.1:9")
+    drugs, pharmacies = synthetic_catalogue(args.pharmacies, args.drugs)
+    asyncio.run(seed_database(drugs, pharmacies))
+    drug = next(iter(drugs))
+
+    results = {}
+    for scenario in args.scenarios:
+        env = {**os.environ, "CATALOGUE_SNAPSHOT": "" if scenario == "database" else snapshot}
+        runs = []
+        for _ in range(args.runs):
+            if scenario == "snapshot_build" and os.path.exists(snapshot):
+                os.remove(snapshot)
+            runs.append(cold_start(env, drug))
+        results[scenario] = summarize(runs)
+        print(f"{scenario:<16} " + "  ".join(f"{metric} {value}" for metric, value in results[scenario].items()))
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "dataset": {"pharmacies": args.pharmacies, "drugs": args.drugs},
+        "runs": args.runs,
+        "snapshot_bytes": os.path.getsize(snapshot) if os.path.exists(snapshot) else None,
+        "scenarios": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nwrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""Multi-pattern and fuzzy drug name matching over the drug catalogue"""
+import re
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+GENERIC = "generic"
+BRAND = "brand"
+SYNONYM = "synonym"
+# Kind codes in a frozen index; GENERIC must stay 0
+KINDS = (GENERIC, BRAND, SYNONYM)
+
+Tables = Dict[str, Union[np.ndarray, List[str]]]
+
+WORD_RE = re.compile(r"[a-z][a-z0-9\-]{3,}")
+
+
+def trigrams(word: str) -> Set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton that accepts new patterns at any time.
+
+    Inserting only extends the trie; failure links are rebuilt lazily on
+    the next search, so a burst of writes pays for one BFS. Removed
+    patterns stay in the trie until `compact` and are skipped at match time.
+    """
+
+    def __init__(self, patterns: Iterable[str] = ()):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+        self._dict_link: List[int] = [0]
+        self._patterns: Set[str] = set()
+        self._dead = 0
+        self._dirty = False
+        for pattern in patterns:
+            self.add(pattern)
+
+    def __contains__(self, pattern: str) -> bool:
+        return pattern in self._patterns
+
+    def add(self, pattern: str):
+        if not pattern or pattern in self._patterns:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._dict_link.append(0)
+            node = nxt
+        if pattern not in self._out[node]:
+            self._out[node].append(pattern)
+        else:
+            self._dead -= 1
+        self._patterns.add(pattern)
+        self._dirty = True
+
+    def remove(self, pattern: str):
+        if pattern in self._patterns:
+            self._patterns.discard(pattern)
+            self._dead += 1
+            if self._dead > len(self._patterns):
+                self.compact()
+
+    def compact(self):
+        patterns = self._patterns
+        self.__init__(patterns)
+
+    def _build(self):
+        queue = deque()
+        for node in self._goto[0].values():
+            self._fail[node] = 0
+            self._dict_link[node] = 0
+            queue.append(node)
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                # Nearest suffix state that ends a pattern
+                f = self._fail[child]
+                self._dict_link[child] = f if self._out[f] else self._dict_link[f]
+        self._dirty = False
+
+    def search(self, text: str) -> List[Tuple[int, str]]:
+        """(end_index, pattern) for every live pattern occurring in `text`"""
+        if self._dirty:
+            self._build()
+        goto, fail, out, dict_link = self._goto, self._fail, self._out, self._dict_link
+        live = self._patterns
+        node = 0
+        found = []
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = node if out[node] else dict_link[node]
+            while hit:
+                for pattern in out[hit]:
+                    if pattern in live:
+                        found.append((i, pattern))
+                hit = dict_link[hit]
+        return found
+
+    def freeze(self, pattern_ids: Dict[str, int]) -> Tables:
+        """
+        The automaton as flat arrays: each node's edges are a sorted run of
+        `edge_char` code points (with their target in `edge_node`) starting
+        at `edge_start[node]`, and `node_name` is the id of the pattern the
+        node ends, or -1.
+        """
+        if self._dead:
+            self.compact()
+        if self._dirty:
+            self._build()
+        counts = np.fromiter((len(edges) for edges in self._goto), dtype=np.int64, count=len(self._goto))
+        edge_start = np.zeros(len(self._goto) + 1, dtype=np.int64)
+        np.cumsum(counts, out=edge_start[1:])
+        chars = []
+        nodes = []
+        for edges in self._goto:
+            for ch in sorted(edges):
+                chars.append(ord(ch))
+                nodes.append(edges[ch])
+        node_name = np.fromiter(
+            (pattern_ids[out[0]] if out else -1 for out in self._out), dtype=np.int32, count=len(self._out)
+        )
+        return {
+            "edge_start": edge_start,
+            "edge_char": np.array(chars, dtype=np.int32),
+            "edge_node": np.array(nodes, dtype=np.int32),
+            "fail": np.array(self._fail, dtype=np.int32),
+            "dict_link": np.array(self._dict_link, dtype=np.int32),
+            "node_name": node_name,
+        }
+
+
+class FrozenDrugIndex:
+    """
+    Read-only drug index over flat arrays, as produced by `DrugIndex.freeze`
+    and mapped from the catalogue snapshot. Nothing is built per process:
+    the automaton is walked through memoryviews of the arrays, names and
+    keys are sorted string tables searched by bisection, and trigram
+    postings are CSR runs counted with NumPy.
+    """
+
+    def __init__(self, tables: Tables):
+        self.keys: Sequence[str] = tables["keys"]
+        self._sorted_keys: Sequence[str] = tables["sorted_keys"]
+        self._key_rank = memoryview(tables["key_rank"])
+        self.names: Sequence[str] = tables["names"]
+        self._name_length = np.asarray(tables["name_length"])
+        self._owner_start = memoryview(tables["owner_start"])
+        self._owner_key = memoryview(tables["owner_key"])
+        self._owner_kind = memoryview(tables["owner_kind"])
+        self._edge_start = memoryview(tables["edge_start"])
+        self._edge_char = memoryview(tables["edge_char"])
+        self._edge_node = memoryview(tables["edge_node"])
+        self._fail = memoryview(tables["fail"])
+        self._dict_link = memoryview(tables["dict_link"])
+        self._node_name = memoryview(tables["node_name"])
+        # Most characters of a text restart at the root, so its edges are worth one small dict
+        self._root = {
+            self._edge_char[i]: self._edge_node[i] for i in range(self._edge_start[0], self._edge_start[1])
+        }
+        self._grams: Sequence[str] = tables["grams"]
+        self._gram_start = memoryview(tables["gram_start"])
+        self._gram_name = np.asarray(tables["gram_name"])
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def position(self, key: str) -> Optional[int]:
+        """Catalogue order of `key`, or None"""
+        i = bisect_left(self._sorted_keys, key)
+        if i < len(self._sorted_keys) and self._sorted_keys[i] == key:
+            return self._key_rank[i]
+        return None
+
+    def search(self, text: str) -> List[int]:
+        """Ids of every name occurring in `text` (already lowercased)"""
+        edge_start, edge_char, edge_node = self._edge_start, self._edge_char, self._edge_node
+        fail, dict_link, node_name = self._fail, self._dict_link, self._node_name
+        root = self._root
+        node = 0
+        found = []
+        for ch in text:
+            code = ord(ch)
+            while node:
+                lo = edge_start[node]
+                hi = edge_start[node + 1]
+                i = bisect_left(edge_char, code, lo, hi)
+                if i < hi and edge_char[i] == code:
+                    node = edge_node[i]
+                    break
+                node = fail[node]
+            else:
+                node = root.get(code, 0)
+            hit = node if node_name[node] >= 0 else dict_link[node]
+            while hit:
+                found.append(node_name[hit])
+                hit = dict_link[hit]
+        return found
+
+    def owners(self, name_id: int) -> List[Tuple[int, str]]:
+        """(catalogue order, kind) of every key owning name `name_id`"""
+        return [
+            (self._owner_key[j], KINDS[self._owner_kind[j]])
+            for j in range(self._owner_start[name_id], self._owner_start[name_id + 1])
+        ]
+
+    def matches(self, text: str) -> List[Tuple[int, str, str]]:
+        """(catalogue order, key, kind) for every name found in `text`, in catalogue order"""
+        found: Dict[int, str] = {}
+        for name_id in self.search(text):
+            for order, kind in self.owners(name_id):
+                if found.get(order) != GENERIC:
+                    found[order] = kind
+        return [(order, self.keys[order], kind) for order, kind in sorted(found.items())]
+
+    def similar(self, grams: Set[str], min_similarity: float) -> List[Tuple[int, float]]:
+        """(name id, Dice similarity) for names sharing enough trigrams with `grams`"""
+        runs = []
+        for gram in grams:
+            i = bisect_left(self._grams, gram)
+            if i < len(self._grams) and self._grams[i] == gram:
+                runs.append(self._gram_name[self._gram_start[i]:self._gram_start[i + 1]])
+        if not runs:
+            return []
+        names, shared = np.unique(np.concatenate(runs), return_counts=True)
+        scores = 2 * shared / (len(grams) + self._name_length[names] + 1)
+        keep = scores >= min_similarity
+        return list(zip(names[keep].tolist(), scores[keep].tolist()))
+
+
+class DrugIndex:
+    """
+    Resolves free text (typed names, OCR output) to catalogue keys.
+
+    Exact lookups go through one Aho-Corasick pass over the text covering
+    every generic name, brand name and synonym. Misspellings fall back to a
+    trigram index scored by Dice similarity. Ties are broken by catalogue
+    order, matching the original first-match-wins loop.
+
+    With a `base` (a frozen index mapped from the catalogue snapshot) only
+    entries added or changed since the snapshot live in the mutable
+    structures. Base keys that were re-indexed or removed are shadowed and
+    their base names skipped, and base keys keep their catalogue order.
+    """
+
+    def __init__(self, drugs: Optional[Dict[str, dict]] = None, min_similarity: float = 0.5,
+                 base: Optional[FrozenDrugIndex] = None):
+        self.min_similarity = min_similarity
+        self._base = base
+        self._shadowed: Set[str] = set()
+        self._matcher = AhoCorasick()
+        # pattern -> {catalogue key: kind}
+        self._names: Dict[str, Dict[str, str]] = {}
+        self._trigrams: Dict[str, Set[str]] = {}
+        self._entries: Dict[str, List[Tuple[str, str]]] = {}
+        self._order: Dict[str, int] = {}
+        self._seq = len(base) if base is not None else 0
+        for key, info in (drugs or {}).items():
+            self.add(key, info)
+
+    @staticmethod
+    def _names_for(key: str, info: dict) -> List[Tuple[str, str]]:
+        names = [(key.lower(), GENERIC), (info["generic"].lower(), GENERIC), (info["brand"].lower(), BRAND)]
+        names += [(s.lower(), SYNONYM) for s in info.get("synonyms", [])]
+        return [(name.strip(), kind) for name, kind in names if name.strip()]
+
+    def add(self, key: str, info: dict):
+        """Index (or re-index) one catalogue entry"""
+        if key in self._entries:
+            self._unlink(key)
+        else:
+            position = self._base.position(key) if self._base is not None else None
+            if position is not None:
+                self._shadowed.add(key)
+                self._order[key] = position
+            else:
+                self._order[key] = self._seq
+                self._seq += 1
+        entries = self._names_for(key, info)
+        self._entries[key] = entries
+        for name, kind in entries:
+            owners = self._names.setdefault(name, {})
+            if owners.get(key) != GENERIC:
+                owners[key] = kind
+            self._matcher.add(name)
+            for gram in trigrams(name):
+                self._trigrams.setdefault(gram, set()).add(name)
+
+    def remove(self, key: str):
+        if key in self._entries:
+            self._unlink(key)
+            del self._entries[key]
+            del self._order[key]
+        elif self._base is not None and self._base.position(key) is not None:
+            self._shadowed.add(key)
+
+    def _unlink(self, key: str):
+        for name, _ in self._entries[key]:
+            owners = self._names.get(name)
+            if owners is None:
+                continue
+            owners.pop(key, None)
+            if not owners:
+                del self._names[name]
+                self._matcher.remove(name)
+                for gram in trigrams(name):
+                    names = self._trigrams.get(gram)
+                    if names is not None:
+                        names.discard(name)
+                        if not names:
+                            del self._trigrams[gram]
+
+    def matches(self, text: str) -> List[Tuple[str, str]]:
+        """(catalogue key, kind) for every name found in `text`, in catalogue order"""
+        text = text.lower()
+        found = {}
+        order = self._order
+        if self._base is not None:
+            order = dict(order)
+            for position, key, kind in self._base.matches(text):
+                if key not in self._shadowed:
+                    found[key] = kind
+                    order[key] = position
+        for _, name in self._matcher.search(text):
+            for key, kind in self._names.get(name, {}).items():
+                if found.get(key) != GENERIC:
+                    found[key] = kind
+        return sorted(found.items(), key=lambda item: order[item[0]])
+
+    def resolve(self, text: str) -> Optional[str]:
+        """First catalogue key whose generic, brand or synonym appears in `text`"""
+        found = self.matches(text)
+        return found[0][0] if found else None
+
+    def fuzzy(self, text: str) -> Optional[Tuple[str, str, float]]:
+        """Best (catalogue key, matched name, similarity) for a misspelled word in `text`"""
+        best = None
+        for word in set(WORD_RE.findall(text.lower())):
+            grams = trigrams(word)
+            counts: Dict[str, int] = {}
+            for gram in grams:
+                for name in self._trigrams.get(gram, ()):
+                    counts[name] = counts.get(name, 0) + 1
+            for name, shared in counts.items():
+                score = 2 * shared / (len(grams) + len(name) + 1)
+                if score < self.min_similarity:
+                    continue
+                key = min(self._names[name], key=self._order.__getitem__)
+                rank = (score, -self._order[key])
+                if best is None or rank > best[0]:
+                    best = (rank, key, name)
+            if self._base is None:
+                continue
+            for name_id, score in self._base.similar(grams, self.min_similarity):
+                owners = [
+                    (position, self._base.keys[position]) for position, _ in self._base.owners(name_id)
+                ]
+                owners = [(position, key) for position, key in owners if key not in self._shadowed]
+                if not owners:
+                    continue
+                position, key = min(owners)
+                rank = (score, -position)
+                if best is None or rank > best[0]:
+                    best = (rank, key, self._base.names[name_id])
+        if best is None:
+            return None
+        (score, _), key, name = best
+        return key, name, round(score, 3)
+
+    def freeze(self) -> Tables:
+        """Tables for `FrozenDrugIndex`; only meaningful for an index built without a base"""
+        keys = sorted(self._entries, key=self._order.__getitem__)
+        key_ids = {key: i for i, key in enumerate(keys)}
+        names = sorted(self._names)
+        name_ids = {name: i for i, name in enumerate(names)}
+        owner_start = [0]
+        owner_key = []
+        owner_kind = []
+        for name in names:
+            for key, kind in sorted(self._names[name].items(), key=lambda item: key_ids[item[0]]):
+                owner_key.append(key_ids[key])
+                owner_kind.append(KINDS.index(kind))
+            owner_start.append(len(owner_key))
+        grams = sorted(self._trigrams)
+        gram_start = [0]
+        gram_name = []
+        for gram in grams:
+            gram_name.extend(sorted(name_ids[name] for name in self._trigrams[gram]))
+            gram_start.append(len(gram_name))
+        sorted_keys = sorted(keys)
+        return {
+            "keys": keys,
+            "sorted_keys": sorted_keys,
+            "key_rank": np.array([key_ids[key] for key in sorted_keys], dtype=np.int32),
+            "names": names,
+            "name_length": np.array([len(name) for name in names], dtype=np.int32),
+            "owner_start": np.array(owner_start, dtype=np.int64),
+            "owner_key": np.array(owner_key, dtype=np.int32),
+            "owner_kind": np.array(owner_kind, dtype=np.int8),
+            "grams": grams,
+            "gram_start": np.array(gram_start, dtype=np.int64),
+            "gram_name": np.array(gram_name, dtype=np.int32),
+            **self._matcher.freeze(name_ids),
+        }
@@ -0,0 +1,224 @@
+"""Grid-based spatial index over the pharmacy catalogue"""
+import heapq
+import math
+import re
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+PLACE_TOKEN_RE = re.compile(r"\w+")
+
+
+def place_tokens(text: str) -> List[str]:
+    return PLACE_TOKEN_RE.findall(text.lower())
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance between two points in kilometres"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class PharmacyIndex:
+    """
+    Fixed-size lat/lng grid (roughly a geohash at `cell_deg` precision) with
+    a secondary index of the words in city and area names.
+
+    Pharmacies are stored by reference, so callers keep handing out the same
+    dicts they put in. `add`, `update` and `remove` touch only the affected
+    cells; nothing is rebuilt.
+    """
+
+    def __init__(self, pharmacies: Iterable[dict] = (), cell_deg: float = 0.1):
+        self.cell_deg = cell_deg
+        self._by_id: Dict[int, dict] = {}
+        self._cells: Dict[Tuple[int, int], Dict[int, dict]] = {}
+        # word of a city or area name -> pharmacy ids, plus the words in sorted order for prefix lookups
+        self._places: Dict[str, Set[int]] = {}
+        self._place_words: List[str] = []
+        self._names: Dict[str, Set[int]] = {}
+        for pharmacy in pharmacies:
+            self.add(pharmacy)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def get(self, pharmacy_id: int) -> Optional[dict]:
+        return self._by_id.get(pharmacy_id)
+
+    def all(self) -> List[dict]:
+        return sorted(self._by_id.values(), key=lambda p: p["id"])
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def _place_names(self, pharmacy: dict) -> Set[str]:
+        return set(place_tokens(pharmacy["city"])) | set(place_tokens(pharmacy["area"]))
+
+    def add(self, pharmacy: dict):
+        if pharmacy["id"] in self._by_id:
+            self.remove(pharmacy["id"])
+        self._by_id[pharmacy["id"]] = pharmacy
+        self._cells.setdefault(self._cell(pharmacy["lat"], pharmacy["lng"]), {})[pharmacy["id"]] = pharmacy
+        for name in self._place_names(pharmacy):
+            ids = self._places.get(name)
+            if ids is None:
+                ids = self._places[name] = set()
+                insort(self._place_words, name)
+            ids.add(pharmacy["id"])
+        self._names.setdefault(pharmacy["name"].lower(), set()).add(pharmacy["id"])
+
+    def update(self, pharmacy: dict):
+        self.add(pharmacy)
+
+    def remove(self, pharmacy_id: int) -> Optional[dict]:
+        pharmacy = self._by_id.pop(pharmacy_id, None)
+        if pharmacy is None:
+            return None
+        cell = self._cell(pharmacy["lat"], pharmacy["lng"])
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(pharmacy_id, None)
+            if not bucket:
+                del self._cells[cell]
+        for name in self._place_names(pharmacy):
+            ids = self._places.get(name)
+            if ids is not None:
+                ids.discard(pharmacy_id)
+                if not ids:
+                    del self._places[name]
+                    del self._place_words[bisect_left(self._place_words, name)]
+        ids = self._names.get(pharmacy["name"].lower())
+        if ids is not None:
+            ids.discard(pharmacy_id)
+            if not ids:
+                del self._names[pharmacy["name"].lower()]
+        return pharmacy
+
+    def by_name(self, name: str) -> List[dict]:
+        """Pharmacies with exactly this name (case-insensitive); chains have many"""
+        return [self._by_id[i] for i in sorted(self._names.get(name.lower().strip(), ()))]
+
+    def search_place(self, location: str) -> List[dict]:
+        """
+        Pharmacies whose city or area names have a word starting with each
+        word of `location` (case-insensitive), so "Mum" finds Mumbai and
+        "karol bagh" finds Karol Bagh. Each word is a bisect over the sorted
+        name words rather than a scan of every place.
+        """
+        ids: Optional[Set[int]] = None
+        for word in place_tokens(location):
+            matched: Set[int] = set()
+            i = bisect_left(self._place_words, word)
+            while i < len(self._place_words) and self._place_words[i].startswith(word):
+                matched |= self._places[self._place_words[i]]
+                i += 1
+            ids = matched if ids is None else ids & matched
+            if not ids:
+                return []
+        return [self._by_id[i] for i in sorted(ids or ())]
+
+    def nearest(
+        self,
+        lat: float,
+        lng: float,
+        radius_km: Optional[float] = None,
+        k: Optional[int] = None,
+    ) -> List[Tuple[float, dict]]:
+        """
+        (distance_km, pharmacy) pairs sorted by distance.
+
+        With `radius_km` only the cells overlapping the search circle are
+        visited. Without it, rings of cells are scanned outwards until the
+        k-th best distance is closer than anything an unscanned ring could hold.
+        """
+        if not self._by_id or (radius_km is None and k is None):
+            return []
+
+        center_i, center_j = self._cell(lat, lng)
+        cell_height_km = self.cell_deg * KM_PER_DEGREE
+
+        if radius_km is not None:
+            lat_span = math.ceil(radius_km / cell_height_km)
+            lng_span = math.ceil(radius_km / self._cell_width_km(lat, lat_span + 1))
+            if (2 * lat_span + 1) * (2 * lng_span + 1) > len(self._cells):
+                # Sparse grid: walking the occupied cells is cheaper than the window
+                cells = [
+                    bucket for (i, j), bucket in self._cells.items()
+                    if abs(i - center_i) <= lat_span and abs(j - center_j) <= lng_span
+                ]
+            else:
+                cells = [
+                    self._cells[(i, j)]
+                    for i in range(center_i - lat_span, center_i + lat_span + 1)
+                    for j in range(center_j - lng_span, center_j + lng_span + 1)
+                    if (i, j) in self._cells
+                ]
+            hits = []
+            for bucket in cells:
+                for pharmacy in bucket.values():
+                    distance = haversine_km(lat, lng, pharmacy["lat"], pharmacy["lng"])
+                    if distance <= radius_km:
+                        hits.append((distance, pharmacy["id"], pharmacy))
+            hits = heapq.nsmallest(k, hits) if k is not None else sorted(hits)
+            return [(d, p) for d, _, p in hits]
+
+        best: List[Tuple[float, int, dict]] = []  # max-heap via negated distance
+        seen = 0
+        ring = 0
+        while seen < len(self._by_id):
+            if (2 * ring + 1) ** 2 > len(self._cells):
+                # Rings now cost more than the occupied cells; finish with a scan
+                return self._nearest_scan(lat, lng, k)
+            for cell in self._ring_cells(center_i, center_j, ring):
+                for pharmacy in self._cells.get(cell, {}).values():
+                    seen += 1
+                    distance = haversine_km(lat, lng, pharmacy["lat"], pharmacy["lng"])
+                    item = (-distance, -pharmacy["id"], pharmacy)
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+            if len(best) == k and -best[0][0] <= ring * self._cell_width_km(lat, ring + 1):
+                break
+            ring += 1
+        return [(-d, p) for d, _, p in sorted(best, reverse=True)]
+
+    def _nearest_scan(self, lat: float, lng: float, k: int) -> List[Tuple[float, dict]]:
+        hits = (
+            (haversine_km(lat, lng, p["lat"], p["lng"]), p["id"], p)
+            for p in self._by_id.values()
+        )
+        return [(d, p) for d, _, p in heapq.nsmallest(k, hits)]
+
+    def _cell_width_km(self, lat: float, rings: int) -> float:
+        """Narrowest cell width within `rings` cells of `lat`; longitude shrinks towards the poles"""
+        widest_lat = min(abs(lat) + rings * self.cell_deg, 90.0)
+        return max(self.cell_deg * KM_PER_DEGREE * math.cos(math.radians(widest_lat)), 1e-6)
+
+    @staticmethod
+    def _ring_cells(center_i: int, center_j: int, ring: int):
+        if ring == 0:
+            yield (center_i, center_j)
+            return
+        for j in range(center_j - ring, center_j + ring + 1):
+            yield (center_i - ring, j)
+            yield (center_i + ring, j)
+        for i in range(center_i - ring + 1, center_i + ring):
+            yield (i, center_j - ring)
+            yield (i, center_j + ring)
+
+
+def centroid(pharmacies: List[dict]) -> Optional[Tuple[float, float]]:
+    """Mean position of a set of pharmacies, used as the origin for place searches"""
+    if not pharmacies:
+        return None
+    return (
+        sum(p["lat"] for p in pharmacies) / len(pharmacies),
+        sum(p["lng"] for p in pharmacies) / len(pharmacies),
+    )
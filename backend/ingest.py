@@ -0,0 +1,388 @@
+"""Write-behind ingestion of crowdsourced price and stock reports"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from storage import Repository
+from versions import AppliedRows
+
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "1.0"))
+# A failed batch write is retried this many times, with doubling delays, before it is dropped
+INGEST_RETRIES = int(os.getenv("INGEST_RETRIES", "3"))
+INGEST_RETRY_DELAY = 0.5
+# A report id still missing once a later row is this old was rolled back or deleted
+REPORT_SETTLE_SECONDS = float(os.getenv("REPORT_SETTLE_SECONDS", "10"))
+REPORT_DEDUPE_WINDOW = 10 * 60
+REPORT_HALF_LIFE = 7 * 24 * 3600
+# Largest price prices.generic_price (DECIMAL(10, 2)) can hold; a larger one would fail its whole batch
+MAX_REPORT_PRICE = 99999999.99
+# Weight of an anonymous report; signed-in reporters' reports weigh more
+ANONYMOUS_CONFIDENCE = 0.5
+
+PRICE = "price"
+STOCK = "stock"
+_STOP = object()
+
+
+class QueueFull(Exception):
+    """The ingestion queue is at capacity; callers should retry later"""
+
+
+@dataclass
+class Report:
+    """`reporter` is the signed-in user's email, or the client address for anonymous reports"""
+    kind: str
+    pharmacy_id: int
+    drug: str
+    value: float
+    confidence: float
+    reporter: str
+    reporter_email: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def dedupe_key(self) -> Tuple[str, str, int, str]:
+        return (self.reporter, self.kind, self.pharmacy_id, self.drug)
+
+
+class Aggregate:
+    """Trust-weighted mean with exponential time decay"""
+
+    __slots__ = ("weighted_sum", "weight", "updated_at", "reports", "signed_in")
+
+    def __init__(self):
+        self.weighted_sum = 0.0
+        self.weight = 0.0
+        self.updated_at = 0.0
+        self.reports = 0
+        self.signed_in = False
+
+    def add(self, value: float, weight: float, at: float):
+        if not weight > 0:
+            raise ValueError(f"Report weight must be positive, got {weight}")
+        if self.reports:
+            decay = 0.5 ** (max(0.0, at - self.updated_at) / REPORT_HALF_LIFE)
+            self.weighted_sum *= decay
+            self.weight *= decay
+        self.weighted_sum += value * weight
+        self.weight += weight
+        self.updated_at = max(self.updated_at, at)
+        self.reports += 1
+        self.signed_in = self.signed_in or weight > ANONYMOUS_CONFIDENCE
+
+    @property
+    def mean(self) -> float:
+        return self.weighted_sum / self.weight if self.weight else 0.0
+
+    @property
+    def corroborated(self) -> bool:
+        """Whether the mean may stand as a price: a signed-in report, or a second report backing an anonymous one"""
+        return self.signed_in or self.reports > 1
+
+
+def stock_label(probability: float) -> str:
+    if probability >= 0.7:
+        return "in_stock"
+    if probability >= 0.4:
+        return "low_stock"
+    return "out_of_stock"
+
+
+class ReportIngestor:
+    """
+    Report endpoints `submit` into a bounded queue and return at once; a
+    single consumer task drains it in batches. Each batch is deduplicated
+    per (reporter, kind, pharmacy, drug), keeping a reporter's first report
+    in the window, written in one transaction, and folded into the
+    in-memory aggregates. Subscribers are then told which cells changed;
+    a price cell counts once it is corroborated, so a single anonymous
+    report never sets a price.
+    A failed write is retried with freshly read ids, so only rows for a
+    drug or pharmacy deleted meanwhile are dropped, not the whole batch.
+
+    Rows are tagged with the repository's worker id. Other workers
+    `catch_up` on them by reading only rows past the position their
+    aggregates cover (see AppliedRows), so rows that commit out of id
+    order are still folded exactly once.
+    """
+
+    def __init__(self, repository: Repository, queue_size: int = INGEST_QUEUE_SIZE,
+                 batch_size: int = INGEST_BATCH_SIZE, flush_interval: float = INGEST_FLUSH_INTERVAL,
+                 retries: int = INGEST_RETRIES, retry_delay: float = INGEST_RETRY_DELAY):
+        self.repository = repository
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_seen: Dict[Tuple[str, str, int, str], float] = {}
+        self._drug_ids: Dict[str, int] = {}
+        self._pharmacy_ids: Set[int] = set()
+        self._user_ids: Dict[str, int] = {}
+        self._subscribers: List[Callable[[Dict[Tuple[int, str], float], Dict[Tuple[int, str], str]], None]] = []
+        self.prices: Dict[Tuple[int, str], Aggregate] = {}
+        self.stock: Dict[Tuple[int, str], Aggregate] = {}
+        self._lock = asyncio.Lock()
+        self._positions = {PRICE: AppliedRows(), STOCK: AppliedRows()}
+        self.metrics = {
+            "accepted": 0, "rejected": 0, "deduplicated": 0, "flushes": 0, "rows_written": 0,
+            "flush_errors": 0, "flush_retries": 0, "dropped": 0, "last_flush_ms": 0.0, "max_flush_ms": 0.0, "total_flush_ms": 0.0,
+        }
+
+    def subscribe(self, callback):
+        """callback(price_updates, stock_updates), keyed by (pharmacy_id, drug)"""
+        self._subscribers.append(callback)
+
+    def submit(self, report: Report):
+        # Checked one report at a time, so a bad one never reaches, and fails, a batch of good ones
+        if not 0 < report.confidence <= 1:
+            raise ValueError(f"Report confidence must be in (0, 1], got {report.confidence}")
+        if report.kind == PRICE and not 0 < report.value <= MAX_REPORT_PRICE:
+            raise ValueError(f"Reported price must be positive and at most {MAX_REPORT_PRICE}, got {report.value}")
+        if self._queue is None:
+            raise QueueFull("Ingestion is not running")
+        try:
+            self._queue.put_nowait(report)
+        except asyncio.QueueFull:
+            self.metrics["rejected"] += 1
+            raise QueueFull("Report queue is full")
+        self.metrics["accepted"] += 1
+
+    def stock_status(self, pharmacy_id: int, drug: str) -> str:
+        aggregate = self.stock.get((pharmacy_id, drug.lower()))
+        return stock_label(aggregate.mean) if aggregate else "unknown"
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop accepting reports and flush whatever is still queued"""
+        if self._task is None:
+            return
+        queue, self._queue = self._queue, None
+        # A sentinel rather than cancel(): wait_for can swallow a cancellation
+        # that races with a completed get(), leaving the consumer blocked.
+        await queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        stopping = False
+        while not stopping:
+            item = await queue.get()
+            stopping = item is _STOP
+            batch = [] if stopping else [item]
+            deadline = loop.time() + self.flush_interval
+            while not stopping and len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if not batch:
+                continue
+            try:
+                await self.flush(batch)
+            except Exception as e:
+                self.metrics["flush_errors"] += 1
+                print(f"Report flush failed: {e}")
+
+    def _dedupe(self, batch: List[Report]) -> List[Report]:
+        # In arrival order, so within a batch the first report wins, as it does across batches
+        fresh = []
+        for report in batch:
+            seen = self._last_seen.get(report.dedupe_key)
+            if seen is not None and report.created_at - seen < REPORT_DEDUPE_WINDOW:
+                continue
+            self._last_seen[report.dedupe_key] = report.created_at
+            fresh.append(report)
+        self.metrics["deduplicated"] += len(batch) - len(fresh)
+        if len(self._last_seen) > 10 * self.queue_size:
+            cutoff = time.time() - REPORT_DEDUPE_WINDOW
+            self._last_seen = {k: t for k, t in self._last_seen.items() if t >= cutoff}
+        return fresh
+
+    def forget_catalogue_ids(self):
+        """Drop cached drug and pharmacy ids after the catalogue changed; the next flush reads them afresh"""
+        self._drug_ids, self._pharmacy_ids = {}, set()
+
+    async def _ids(self, reports: List[Report]):
+        if any(r.drug not in self._drug_ids for r in reports):
+            rows = await self.repository.db.fetch("SELECT id, lookup_name FROM drugs")
+            self._drug_ids = {row["lookup_name"]: row["id"] for row in rows}
+        if any(r.pharmacy_id not in self._pharmacy_ids for r in reports):
+            self._pharmacy_ids = {row["id"] for row in await self.repository.db.fetch("SELECT id FROM pharmacies")}
+        if any(r.reporter_email and r.reporter_email not in self._user_ids for r in reports):
+            rows = await self.repository.db.fetch("SELECT id, email FROM users")
+            self._user_ids = {row["email"]: row["id"] for row in rows}
+
+    async def flush(self, batch: List[Report]):
+        start = time.perf_counter()
+        reports = self._dedupe(batch)
+        for attempt in range(self.retries + 1):
+            try:
+                price_rows, stock_rows, price_updates, stock_updates = await self._write(reports)
+                break
+            except Exception:
+                # Ids may have gone stale, e.g. a drug deleted and re-added under a new id
+                self._drug_ids, self._pharmacy_ids, self._user_ids = {}, set(), {}
+                if attempt == self.retries:
+                    self.metrics["dropped"] += len(reports)
+                    # Not stored, so a resubmission is not a duplicate
+                    for report in reports:
+                        if self._last_seen.get(report.dedupe_key) == report.created_at:
+                            del self._last_seen[report.dedupe_key]
+                    raise
+                self.metrics["flush_retries"] += 1
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+        for callback in self._subscribers:
+            callback(price_updates, stock_updates)
+
+        elapsed = (time.perf_counter() - start) * 1000
+        self.metrics["flushes"] += 1
+        self.metrics["rows_written"] += len(price_rows) + len(stock_rows)
+        self.metrics["last_flush_ms"] = elapsed
+        self.metrics["total_flush_ms"] += elapsed
+        self.metrics["max_flush_ms"] = max(self.metrics["max_flush_ms"], elapsed)
+
+    async def _write(self, reports: List[Report]):
+        """Store and fold one deduplicated batch; returns the rows written and the updates to publish"""
+        await self._ids(reports)
+        dropped = len(reports)
+        reports = [r for r in reports if r.drug in self._drug_ids and r.pharmacy_id in self._pharmacy_ids]
+        dropped -= len(reports)
+
+        price_rows = [
+            (self._drug_ids[r.drug], r.pharmacy_id, round(r.value, 2), "crowd", round(r.confidence, 2))
+            for r in reports if r.kind == PRICE
+        ]
+        stock_rows = [
+            (r.pharmacy_id, self._drug_ids[r.drug], bool(r.value), self._user_ids.get(r.reporter_email), round(r.confidence, 2))
+            for r in reports if r.kind == STOCK
+        ]
+        # Held from insert to fold so a concurrent `reload` never counts a batch twice
+        async with self._lock:
+            if price_rows or stock_rows:
+                await self.repository.insert_reports(price_rows, stock_rows, ingested_by=self.repository.worker_id)
+            self.metrics["dropped"] += dropped
+
+            price_cells = set()
+            stock_updates: Dict[Tuple[int, str], str] = {}
+            for report in reports:
+                cell = (report.pharmacy_id, report.drug)
+                aggregates = self.prices if report.kind == PRICE else self.stock
+                aggregate = aggregates.get(cell)
+                if aggregate is None:
+                    aggregate = aggregates[cell] = Aggregate()
+                aggregate.add(report.value, report.confidence, report.created_at)
+                if report.kind == PRICE:
+                    price_cells.add(cell)
+                else:
+                    stock_updates[cell] = stock_label(aggregate.mean)
+
+        return price_rows, stock_rows, self.price_updates(price_cells), stock_updates
+
+    def price_updates(self, cells: Iterable[Tuple[int, str]]) -> Dict[Tuple[int, str], float]:
+        """Crowd prices for `cells`, leaving out those with only one anonymous report"""
+        return {cell: round(self.prices[cell].mean, 2) for cell in cells if self.prices[cell].corroborated}
+
+    def replay(self, kind: str, rows: List[Tuple[int, str, float, float, float]]) -> Set[Tuple[int, str]]:
+        """Fold stored (pharmacy_id, drug, value, confidence, created_at) rows into the aggregates; returns the cells touched"""
+        aggregates = self.prices if kind == PRICE else self.stock
+        cells = set()
+        for pharmacy_id, drug, value, confidence, created_at in rows:
+            # Rows stored before reports were validated may carry no weight or no price
+            if not 0 < confidence <= 1 or (kind == PRICE and not 0 < value <= MAX_REPORT_PRICE):
+                continue
+            cell = (pharmacy_id, drug)
+            aggregate = aggregates.get(cell)
+            if aggregate is None:
+                aggregate = aggregates[cell] = Aggregate()
+            aggregate.add(value, confidence, created_at)
+            cells.add(cell)
+        return cells
+
+    async def _apply(self, kind: str, since: float, skip_own: bool) -> Set[Tuple[int, str]]:
+        """Fold stored rows past this worker's position that it has not folded yet"""
+        position = self._positions[kind]
+        rows = await self.repository.reports_after(kind, position.through, since)
+        fresh = [
+            (pharmacy_id, drug, value, confidence, created_at)
+            for row_id, pharmacy_id, drug, value, confidence, created_at, ingested_by in rows
+            # This worker folded its own rows when it flushed them
+            if not position.is_loaded(row_id) and not (skip_own and ingested_by == self.repository.worker_id)
+        ]
+        position.loaded(row[0] for row in rows)
+        position.advance(((row[0], row[5], False) for row in rows), time.time() - REPORT_SETTLE_SECONDS)
+        return self.replay(kind, fresh)
+
+    async def reload(self, since: float) -> Tuple[Dict[Tuple[int, str], float], Dict[Tuple[int, str], str]]:
+        """
+        Rebuild every aggregate from reports stored since `since`, including
+        those other workers ingested. Returns (price_updates, stock_updates)
+        for all cells, in the shape subscribers receive.
+        """
+        async with self._lock:
+            self.prices.clear()
+            self.stock.clear()
+            for kind in (PRICE, STOCK):
+                self._positions[kind] = AppliedRows()
+                await self._apply(kind, since, skip_own=False)
+        return (
+            self.price_updates(self.prices),
+            {cell: stock_label(agg.mean) for cell, agg in self.stock.items()},
+        )
+
+    async def catch_up(self, since: float) -> Tuple[Dict[Tuple[int, str], float], Dict[Tuple[int, str], str]]:
+        """
+        Fold in reports other workers stored since the last reload or
+        catch-up. Returns updates for the changed cells only.
+        """
+        async with self._lock:
+            prices = await self._apply(PRICE, since, skip_own=True)
+            stock = await self._apply(STOCK, since, skip_own=True)
+            return (
+                self.price_updates(prices),
+                {cell: stock_label(self.stock[cell].mean) for cell in stock},
+            )
+
+    async def applied_price_id(self, since: float) -> int:
+        """Id up to which every stored price report is in this worker's aggregates"""
+        async with self._lock:
+            position = self._positions[PRICE]
+            rows = await self.repository.reports_after(PRICE, position.through, since)
+            # Under the lock, this worker's own rows are folded as soon as they are visible
+            return position.advance(
+                ((row[0], row[5], row[6] == self.repository.worker_id) for row in rows),
+                time.time() - REPORT_SETTLE_SECONDS
+            )
+
+    def stats(self) -> dict:
+        metrics = dict(self.metrics)
+        metrics["avg_flush_ms"] = round(metrics.pop("total_flush_ms") / metrics["flushes"], 2) if metrics["flushes"] else 0.0
+        metrics["last_flush_ms"] = round(metrics["last_flush_ms"], 2)
+        metrics["max_flush_ms"] = round(metrics["max_flush_ms"], 2)
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_capacity": self.queue_size,
+            "price_cells": len(self.prices),
+            "stock_cells": len(self.stock),
+            **metrics
+        }
@@ -0,0 +1,88 @@
+"""Table-driven insurer and tier copay rules with vectorized quoting"""
+import re
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_MULTIPLIER = 1.0
+# Copay for tiers missing from the table, as the hardcoded estimator had it
+DEFAULT_TIER_COPAY = 15.0
+# Column bounds: insurers.multiplier is DECIMAL(4, 2) and insurance_tiers.copay DECIMAL(10, 2)
+MAX_MULTIPLIER = 100.0
+MAX_COPAY = 99999999.99
+# Tiers index an array of copays, so the highest tier sizes it
+MAX_TIER = 100
+
+# Seed rows for an empty database
+SEED_TIERS = {1: 50.0, 2: 150.0, 3: 400.0, 4: 800.0}
+SEED_INSURERS = {
+    "Star Health": 0.8,
+    "HDFC ERGO": 0.8,
+    "ICICI Lombard": 0.8,
+    "CGHS": 0.5,
+    "ESI": 0.5,
+    "Ayushman Bharat": 0.5,
+}
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_insurer(name: str) -> str:
+    """'HDFC-Ergo ', 'hdfc ergo' and 'HDFC ERGO' all map to 'hdfc ergo'"""
+    return _NON_WORD.sub(" ", name.lower()).strip()
+
+
+class InsuranceTable:
+    """
+    Insurer multipliers keyed by normalized name, and tier copays in an
+    array indexed by tier, so a quote is one dict lookup plus array
+    arithmetic whether it covers one drug or a basket across pharmacies.
+    """
+
+    def __init__(self, insurers: Optional[Dict[str, float]] = None, tiers: Optional[Dict[int, float]] = None):
+        self.load(insurers or {}, tiers or {})
+
+    def load(self, insurers: Dict[str, float], tiers: Dict[int, float]):
+        self.multipliers = {normalize_insurer(name): float(m) for name, m in insurers.items()}
+        self._load_tiers(tiers)
+
+    def _load_tiers(self, tiers: Dict[int, float]):
+        self.tiers = {int(t): float(c) for t, c in tiers.items()}
+        copays = np.full(max(self.tiers, default=0) + 1, DEFAULT_TIER_COPAY)
+        for tier, copay in self.tiers.items():
+            copays[tier] = copay
+        # Built aside and swapped in whole, so readers never see a partial table
+        self._copays = copays
+
+    def set_insurer(self, name: str, multiplier: float):
+        self.multipliers[normalize_insurer(name)] = float(multiplier)
+
+    def set_tier(self, tier: int, copay: float):
+        tiers = dict(self.tiers)
+        tiers[int(tier)] = float(copay)
+        self._load_tiers(tiers)
+
+    def multiplier(self, insurer: str) -> float:
+        return self.multipliers.get(normalize_insurer(insurer), DEFAULT_MULTIPLIER)
+
+    def copays(self, insurer: str, tiers: Iterable[Optional[int]]) -> np.ndarray:
+        """Insurer-adjusted copay per tier, rounded like the single quote"""
+        copays = self._copays
+        tiers = np.fromiter((-1 if t is None else t for t in tiers), dtype=np.int64)
+        known = (tiers >= 0) & (tiers < len(copays))
+        base = np.where(known, copays[np.clip(tiers, 0, len(copays) - 1)], DEFAULT_TIER_COPAY)
+        return np.round(base * self.multiplier(insurer), 2)
+
+    def quote(self, insurer: str, tier: Optional[int], price: float) -> Tuple[float, float, float]:
+        """(copay, final_cost, out_of_pocket) for one drug"""
+        copay = float(self.copays(insurer, [tier])[0])
+        return copay, min(copay, price), max(0, price - copay)
+
+    def quote_matrix(self, insurer: str, tiers: Iterable[Optional[int]],
+                     prices: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Vectorized quote for prices[d, j] = price of drug d at pharmacy j.
+        Returns the per-drug copays plus final-cost and out-of-pocket matrices.
+        """
+        copays = self.copays(insurer, tiers)[:, None]
+        return copays[:, 0], np.minimum(copays, prices), np.maximum(0.0, prices - copays)
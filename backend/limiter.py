@@ -0,0 +1,230 @@
+"""Adaptive per-route concurrency limits, priority queueing and load shedding for expensive endpoints"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from auth import TokenError, token_signer
+from responses import FastJSONResponse
+
+LIMITER_ENABLED = os.getenv("LIMITER_ENABLED", "1") == "1"
+# Recent latency above this multiple of the route's baseline counts as congestion
+LATENCY_TOLERANCE = 2.0
+BACKOFF = 0.9
+# The baseline drops to any faster sample and otherwise drifts up by this weight per sample,
+# so a lasting shift in the route's latency is eventually accepted as normal
+BASELINE_SMOOTHING = 0.01
+RECENT_SMOOTHING = 0.2
+RETRY_AFTER_MAX = 30
+
+ADMIN, USER, ANONYMOUS = 0, 1, 2
+
+
+class RouteLimit(NamedTuple):
+    initial: int
+    min_limit: int
+    max_limit: int
+    queue_size: int
+    # Seconds a request may wait for a slot before it is shed
+    queue_timeout: float
+
+
+# Only the expensive routes; everything else is never queued or shed
+ROUTE_LIMITS = {
+    "/api/ocr/extract": RouteLimit(initial=4, min_limit=1, max_limit=32, queue_size=32, queue_timeout=10.0),
+    "/api/drugs/parse": RouteLimit(initial=32, min_limit=4, max_limit=256, queue_size=256, queue_timeout=2.0),
+    "/api/prescriptions/compare": RouteLimit(initial=16, min_limit=2, max_limit=128, queue_size=128, queue_timeout=2.0),
+}
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one route, driven by latency. Each finished
+    request updates a fast latency average (`recent`) and a near-minimum
+    (`baseline`) that stands for the route's unloaded latency. While
+    recent stays within LATENCY_TOLERANCE of the baseline and the limit is
+    in use, the limit grows by one per window of `limit` requests. Once
+    recent exceeds that, the limit is cut by BACKOFF, at most once per
+    window.
+
+    A request over the limit waits in a bounded heap ordered by priority,
+    then arrival. A freed slot goes straight to the best waiter, so
+    waiters never race new arrivals. When the heap is full, a
+    higher-priority arrival evicts the worst waiter; otherwise the arrival
+    itself is shed.
+    """
+
+    def __init__(self, config: RouteLimit):
+        self.config = config
+        self.limit = float(config.initial)
+        self.in_flight = 0
+        self.baseline = 0.0
+        self.recent = 0.0
+        self._cooldown = 0
+        # [priority, arrival, future]; the future resolves True with a slot or False when evicted
+        self._queue: List[list] = []
+        self._arrivals = itertools.count()
+        self.metrics = {"admitted": 0, "queued": 0, "shed": 0, "timeouts": 0, "increases": 0, "decreases": 0}
+
+    def try_acquire(self) -> bool:
+        if self.in_flight < int(self.limit) and not self._queue:
+            self.in_flight += 1
+            self.metrics["admitted"] += 1
+            return True
+        return False
+
+    async def acquire(self, priority: int) -> bool:
+        """Queue for a slot after `try_acquire` refused one; False if the request was shed"""
+        if len(self._queue) >= self.config.queue_size:
+            worst = max(self._queue)
+            if worst[0] <= priority:
+                self.metrics["shed"] += 1
+                return False
+            self._queue.remove(worst)
+            heapq.heapify(self._queue)
+            worst[2].set_result(False)
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._arrivals), future]
+        heapq.heappush(self._queue, entry)
+        self.metrics["queued"] += 1
+        try:
+            # asyncio.wait, unlike wait_for, never swallows a cancel or loses a slot granted at the deadline
+            await asyncio.wait({future}, timeout=self.config.queue_timeout)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.result():
+                self.release()
+            else:
+                self._forget(entry)
+            raise
+        if not future.done():
+            self._forget(entry)
+            self.metrics["timeouts"] += 1
+            return False
+        if not future.result():
+            self.metrics["shed"] += 1
+            return False
+        self.metrics["admitted"] += 1
+        return True
+
+    def _forget(self, entry: list):
+        if not entry[2].done():
+            entry[2].cancel()
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+
+    def release(self, latency: Optional[float] = None):
+        if latency is not None:
+            self._observe(latency)
+        self.in_flight -= 1
+        while self._queue and self.in_flight < int(self.limit):
+            _, _, future = heapq.heappop(self._queue)
+            self.in_flight += 1
+            future.set_result(True)
+
+    def _observe(self, latency: float):
+        if not self.baseline:
+            self.baseline = self.recent = latency
+        self.recent += RECENT_SMOOTHING * (latency - self.recent)
+        self.baseline = min(latency, self.baseline + BASELINE_SMOOTHING * (latency - self.baseline))
+        self._cooldown -= 1
+        if self.recent > LATENCY_TOLERANCE * self.baseline:
+            if self._cooldown <= 0 and self.limit > self.config.min_limit:
+                self.limit = max(float(self.config.min_limit), self.limit * BACKOFF)
+                self._cooldown = int(self.limit)
+                self.metrics["decreases"] += 1
+        elif (self._queue or self.in_flight >= self.limit / 2) and self.limit < self.config.max_limit:
+            self.limit = min(float(self.config.max_limit), self.limit + 1 / self.limit)
+            self.metrics["increases"] += 1
+
+    def retry_after(self) -> int:
+        """Seconds until the queue has likely drained, as a whole number for the Retry-After header"""
+        drain = (len(self._queue) + 1) * self.recent / max(1, int(self.limit))
+        return max(1, min(RETRY_AFTER_MAX, math.ceil(drain)))
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": len(self._queue),
+            "queue_size": self.config.queue_size,
+            "baseline_ms": round(self.baseline * 1000, 2),
+            "recent_ms": round(self.recent * 1000, 2),
+            **self.metrics
+        }
+
+
+def request_priority(scope) -> int:
+    """ADMIN, USER or ANONYMOUS from the bearer token, if any; only computed for requests that must wait"""
+    for name, value in scope["headers"]:
+        if name == b"authorization" and value.startswith(b"Bearer "):
+            try:
+                claims = token_signer.verify(value[len(b"Bearer "):].decode("latin-1"))
+            except TokenError:
+                return ANONYMOUS
+            return ADMIN if claims["role"] == "admin" else USER
+    return ANONYMOUS
+
+
+class LoadShedder:
+    """One AdaptiveLimiter per limited route path"""
+
+    def __init__(self, routes: Dict[str, RouteLimit] = ROUTE_LIMITS, enabled: bool = LIMITER_ENABLED):
+        self.enabled = enabled
+        self.limiters = {path: AdaptiveLimiter(config) for path, config in routes.items()}
+
+    def get(self, path: str) -> Optional[AdaptiveLimiter]:
+        return self.limiters.get(path) if self.enabled else None
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "routes": {path: limiter.stats() for path, limiter in self.limiters.items()}}
+
+    def totals(self) -> dict:
+        totals = {"in_flight": 0, "waiting": 0, "admitted": 0, "queued": 0, "shed": 0, "timeouts": 0}
+        for limiter in self.limiters.values():
+            stats = limiter.stats()
+            for key in totals:
+                totals[key] += stats[key]
+        return totals
+
+
+load_shedder = LoadShedder()
+
+
+class LoadShedMiddleware:
+    """
+    Pure ASGI middleware in front of the router. A request to a limited
+    path takes a slot from its route's limiter, waiting if it must, and
+    returns it when the response is done; the time holding the slot is
+    the latency sample. A shed request gets a 503 with Retry-After
+    without reaching the endpoint.
+    """
+
+    def __init__(self, app, shedder: LoadShedder = load_shedder):
+        self.app = app
+        self.shedder = shedder
+        self.endpoints: Optional[Dict[str, object]] = None
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.shedder.get(scope["path"]) if scope["type"] == "http" else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+        if not limiter.try_acquire() and not await limiter.acquire(request_priority(scope)):
+            if self.endpoints is None:
+                self.endpoints = {r.path: r.endpoint for r in scope["app"].routes if hasattr(r, "endpoint")}
+            # Lets MetricsMiddleware label the 503 with the route it was meant for
+            scope["endpoint"] = self.endpoints.get(scope["path"])
+            response = FastJSONResponse(
+                {"detail": "Server is busy, retry later"}, status_code=503,
+                headers={"Retry-After": str(limiter.retry_after())}
+            )
+            await response(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.perf_counter() - start)
@@ -1,16 +1,56 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Header
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Path, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import List, Optional
 import re
 from datetime import datetime
-import json
-import requests
-from functools import lru_cache
+from itertools import islice
+import asyncio
 import math
+import os
+import time
 
-app = FastAPI(title="MedFinder API")
+import numpy as np
 
+from analytics import SearchAnalytics
+from alerts import Alert, AlertBook, AlertNotifier, create_sink
+from auth import hash_password, is_hashed, optional_user, require_admin, require_user, token_signer, verify_password
+from drug_index import BRAND, DrugIndex
+from geo import PharmacyIndex, centroid, haversine_km, place_tokens
+from ingest import (
+    ANONYMOUS_CONFIDENCE, MAX_REPORT_PRICE, PRICE, REPORT_HALF_LIFE, STOCK, QueueFull, Report, ReportIngestor
+)
+from insurance import (
+    MAX_COPAY, MAX_MULTIPLIER, MAX_TIER, SEED_INSURERS, SEED_TIERS, InsuranceTable, normalize_insurer
+)
+from limiter import LoadShedMiddleware, load_shedder
+from metrics import PROFILE_SLOW_MS, MetricsMiddleware, profiler, registry, span
+from ocr import OCRUnavailable, UnreadableImage, UnsupportedImage, UploadTooLarge, ocr_pool, spool_upload
+from ocr_cache import ocr_cache
+from openfda import label_cache
+from pricing import PriceTable
+from response_cache import CachedBody, response_cache
+from responses import AIPrediction, FastJSONResponse, PharmacyPrice, render_json
+from snapshot import read_catalogue, snapshot_stats
+from storage import db, repository
+from streaming import (
+    MEDIA_TYPES, STREAM_CHUNK, STREAM_FIRST, STREAM_HEARTBEAT, STREAM_LIVE_SECONDS,
+    frame, heartbeat, next_update, update_hub
+)
+from sync import (
+    DELETE, SYNC_MAX_CHANGES, SYNC_MAX_DRUGS, SYNC_SETTLE_SECONDS, UPSERT, Cursor, Delta, accepts_gzip, drug_columns,
+    drug_names, encode_body, fold_changes, pharmacy_columns, price_columns, sync_response
+)
+from timeseries import BUY_ADVICE, TREND_LABELS, PriceForecaster
+from versions import AppliedRows, VersionWatcher
+
+app = FastAPI(title="MedFinder API", default_response_class=FastJSONResponse)
+
+# Innermost, so shed requests still get CORS headers and are counted by the metrics middleware
+app.add_middleware(LoadShedMiddleware, shedder=load_shedder)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -18,15 +58,21 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    """FastAPI's 422, rendered with orjson: the stock encoder raises on a NaN or inf input the error echoes back"""
+    return FastJSONResponse(status_code=422, content={"detail": jsonable_encoder(exc.errors())})
 
-# Users database with roles
+# Demo users, seeded into the users table on first start with their passwords scrypt-hashed
 USERS_DB = {
     "demo@medfinder.com": {"password": "demo123", "role": "user", "name": "Demo User"},
     "admin@medfinder.com": {"password": "admin123", "role": "admin", "name": "Admin User"},
     "user@medfinder.com": {"password": "user123", "role": "user", "name": "Regular User"},
 }
 
-# Mock Data for Demo
+# Demo catalogue, seeded into the database on first start and then loaded from it
 MOCK_DRUGS = {
     "lisinopril": {"generic": "lisinopril", "brand": "Prinivil", "rxnorm": "29046", "atc": "C09AA03"},
     "atorvastatin": {"generic": "atorvastatin", "brand": "Lipitor", "rxnorm": "83367", "atc": "C10AA05"},
@@ -64,6 +110,26 @@ MOCK_PHARMACIES = [
     {"id": 26, "name": "Netmeds", "city": "Pune", "area": "Wakad", "lat": 18.5974, "lng": 73.7898, "open": True},
 ]
 
+drug_index = DrugIndex(MOCK_DRUGS)
+pharmacy_index = PharmacyIndex(MOCK_PHARMACIES)
+price_forecaster = PriceForecaster(repository)
+price_table = PriceTable(MOCK_PHARMACIES, forecasts=price_forecaster.forecasts)
+report_ingestor = ReportIngestor(repository)
+alert_book = AlertBook()
+search_analytics = SearchAnalytics(repository)
+insurance_table = InsuranceTable()
+version_watcher = VersionWatcher(repository)
+# The change log rows this worker's catalogue covers, for capping sync cursors
+catalogue_changes = AppliedRows()
+
+DEFAULT_RADIUS_KM = 25.0
+DEFAULT_NEAREST_K = 10
+MAX_NEAREST_K = 1000
+# Half the Earth's circumference: every pharmacy is within it, and the bound also rejects inf
+MAX_RADIUS_KM = 20038.0
+# Set by serve.py once it has prepared the database and swept alerts, so its workers do neither again
+DATABASE_PREPARED = os.getenv("DATABASE_PREPARED") == "1"
+
 class LoginRequest(BaseModel):
     email: str
     password: str
@@ -73,36 +139,176 @@ class PrescriptionData(BaseModel):
     strength: Optional[str] = None
     dosage: Optional[str] = None
 
+class PrescriptionBatch(BaseModel):
+    drugs: List[PrescriptionData]
+    location: str = "Delhi"
+    lat: Optional[float] = Field(None, ge=-90, le=90)
+    lng: Optional[float] = Field(None, ge=-180, le=180)
+    radius_km: Optional[float] = Field(None, gt=0, le=MAX_RADIUS_KM)
+    k: Optional[int] = Field(None, ge=1, le=MAX_NEAREST_K)
+    generic: bool = True
+
+class InsuranceItem(BaseModel):
+    drug_name: str
+    tier: Optional[int] = 1
+
+class InsuranceBasket(BaseModel):
+    insurer: str
+    drugs: List[InsuranceItem]
+    location: str = "Delhi"
+    lat: Optional[float] = Field(None, ge=-90, le=90)
+    lng: Optional[float] = Field(None, ge=-180, le=180)
+    radius_km: Optional[float] = Field(None, gt=0, le=MAX_RADIUS_KM)
+    k: Optional[int] = Field(None, ge=1, le=MAX_NEAREST_K)
+    generic: bool = True
+
+class InsurerUpdate(BaseModel):
+    multiplier: float = Field(ge=0, lt=MAX_MULTIPLIER, allow_inf_nan=False)
+
+class TierUpdate(BaseModel):
+    copay: float = Field(ge=0, le=MAX_COPAY, allow_inf_nan=False)
+
 class MedicineCreate(BaseModel):
     drug_name: str
     generic_name: str
     brand_name: str
     rxnorm_id: str
     atc_code: str
+    synonyms: List[str] = []
+
+class PharmacyCreate(BaseModel):
+    name: str
+    city: str
+    area: str
+    lat: float
+    lng: float
+    open: bool = True
 
 class PriceReport(BaseModel):
-    pharmacy_name: str
+    pharmacy_name: Optional[str] = None
+    pharmacy_id: Optional[int] = None
     drug_name: str
-    price: float
-    user_trust_score: Optional[float] = 0.5
+    price: float = Field(gt=0, le=MAX_REPORT_PRICE, allow_inf_nan=False)
+
+def find_pharmacies(location: str, lat: Optional[float] = None, lng: Optional[float] = None,
+                    radius_km: Optional[float] = None, k: Optional[int] = None) -> List[tuple]:
+    """(distance_km, pharmacy) pairs sorted by distance from the search origin.
+
+    With coordinates the spatial index answers directly; otherwise pharmacies
+    are matched by city/area name and measured from the centre of the match.
+    A place that matches nothing gives every pharmacy, by id, with no
+    distance, since there is no meaningful origin to measure from.
+    """
+    if lat is not None and lng is not None:
+        hits = pharmacy_index.nearest(lat, lng, radius_km if radius_km is not None else DEFAULT_RADIUS_KM, k)
+        if not hits:
+            hits = pharmacy_index.nearest(lat, lng, k=k or DEFAULT_NEAREST_K)
+        return hits
+
+    matched = pharmacy_index.search_place(location)
+    if not matched:
+        hits = [(None, p) for p in pharmacy_index.all()]
+        return hits[:k] if k else hits
+    origin_lat, origin_lng = centroid(matched)
+    hits = sorted(
+        ((haversine_km(origin_lat, origin_lng, p["lat"], p["lng"]), p) for p in matched),
+        key=lambda hit: (hit[0], hit[1]["id"])
+    )
+    if radius_km is not None:
+        hits = [hit for hit in hits if hit[0] <= radius_km] or hits[:1]
+    return hits[:k] if k else hits
+
+def km(distance: Optional[float]) -> Optional[float]:
+    return round(distance, 2) if distance is not None else None
+
+def place_key(place: Optional[str]) -> Optional[str]:
+    """A place name as the place index reads it, so every spelling of one query shares a cache entry"""
+    return " ".join(place_tokens(place)).title() if place else place
+
+def coord_key(value: Optional[float]) -> Optional[float]:
+    """A coordinate to 4 decimals (about 11 m), so nearby clients share a cache entry"""
+    return round(value, 4) if value is not None else None
+
+def price_key(drug_name: str) -> Optional[str]:
+    """Catalogue key for a typed or OCR'd drug name, or None; brand names share their generic's row"""
+    key = drug_index.resolve(drug_name)
+    if key is None:
+        fuzzy = drug_index.fuzzy(drug_name)
+        if not fuzzy:
+            return None
+        key = fuzzy[0]
+    return key if key in MOCK_DRUGS else None
+
+def require_price_key(drug_name: str) -> str:
+    """price_key, or 404 so unknown names never reach the price table or cache keys"""
+    key = price_key(drug_name)
+    if key is None:
+        raise HTTPException(status_code=404, detail=f"Unknown drug: {drug_name}")
+    return key
+
+def stock_status(pharmacy_id: int, drug_key: str) -> str:
+    """Crowdsourced stock status, or "unknown" when nobody has reported it"""
+    return report_ingestor.stock_status(pharmacy_id, drug_key)
+
+def find_reported_pharmacy(pharmacy_id: Optional[int], pharmacy_name: Optional[str]) -> dict:
+    if pharmacy_id is not None:
+        pharmacy = pharmacy_index.get(pharmacy_id)
+        if pharmacy is None:
+            raise HTTPException(status_code=404, detail="Pharmacy not found")
+        return pharmacy
+    matches = pharmacy_index.by_name(pharmacy_name or "")
+    if not matches:
+        raise HTTPException(status_code=404, detail="Pharmacy not found")
+    if len(matches) > 1:
+        raise HTTPException(status_code=400, detail="Pharmacy name is ambiguous; pass pharmacy_id")
+    return matches[0]
+
+def reporter_identity(request: Request, user: Optional[dict]) -> str:
+    """Who a request counts as, for report deduplication and active-user analytics: the signed-in user, else the client"""
+    if user is not None:
+        return user["sub"]
+    return request.client.host if request.client else "anonymous"
+
+def report_confidence(user: Optional[dict]) -> float:
+    """Report weight from who is reporting: least when anonymous, most for admins; never taken from the client"""
+    if user is None:
+        return ANONYMOUS_CONFIDENCE
+    return 0.95 if user["role"] == "admin" else 0.75
 
-def verify_admin(user_email: str):
-    """Verify if user is admin"""
-    user = USERS_DB.get(user_email)
-    if not user or user["role"] != "admin":
-        raise HTTPException(status_code=403, detail="Admin access required")
-    return True
+def submit_report(report: Report):
+    """Queue a report for the write-behind consumer; must run on the event loop"""
+    try:
+        report_ingestor.submit(report)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def describe_drug(data: PrescriptionData, drug_info: dict, fda_data: dict) -> dict:
+    alternatives = list(islice((d["generic"] for d in MOCK_DRUGS.values() if d["generic"] != drug_info["generic"]), 3))
+    return {
+        "drug_name": data.drug_name,
+        "generic_name": drug_info["generic"],
+        "brand_name": drug_info["brand"],
+        "strength": data.strength,
+        "dosage": data.dosage,
+        "rxnorm_id": drug_info["rxnorm"],
+        "atc_code": drug_info["atc"],
+        "safe_alternatives": alternatives,
+        "fda_info": fda_data
+    }
 
 @app.get("/")
 def root():
     return {"message": "MedFinder API", "version": "2.0.0"}
 
 @app.post("/api/auth/login")
-def login(data: LoginRequest):
-    """Authenticate user and return role"""
-    user = USERS_DB.get(data.email)
+async def login(data: LoginRequest):
+    """Authenticate user and return role with a signed access token"""
+    user = await repository.get_user(data.email)
     
-    if not user or user["password"] != data.password:
+    # Verified even without a user, so unknown emails take as long as wrong passwords
+    if not await verify_password(data.password, user["password"] if user else None):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     return {
@@ -110,129 +316,205 @@ def login(data: LoginRequest):
         "data": {
             "email": data.email,
             "role": user["role"],
-            "name": user["name"]
+            "name": user["name"],
+            "access_token": token_signer.issue(data.email, user["role"], user["name"]),
+            "token_type": "bearer",
+            "expires_in": token_signer.ttl
         }
     }
 
 @app.post("/api/ocr/extract")
 async def extract_prescription(file: UploadFile = File(...)):
-    """Extract prescription details from uploaded image (simplified for demo)"""
+    """Extract prescription details from an uploaded image"""
     try:
-        # Simplified: return mock data for demo
-        drug_name = "Lisinopril"
-        strength = "10mg"
-        dosage = "Once daily"
-        
-        return {
-            "success": True,
-            "data": {
-                "drug_name": drug_name,
-                "strength": strength,
-                "dosage": dosage,
-                "raw_text": "Prescription: Lisinopril 10mg, Once daily",
-                "confidence": 0.85
-            }
-        }
+        path, digest = await spool_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    try:
+        cache_status = "hit"
+        result = await asyncio.to_thread(ocr_cache.get, digest)
+        if result is None:
+            # Only exact uploads are served from cache; near-duplicates are OCR'd and just counted
+            cache_status = "miss"
+            phash = await ocr_pool.dhash(path)
+            await asyncio.to_thread(ocr_cache.record_miss, phash)
+            result = await ocr_pool.run(path)
+            await asyncio.to_thread(ocr_cache.put, digest, result, phash)
+    except OCRUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"OCR unavailable: {str(e)}")
+    except UnsupportedImage as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except UnreadableImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OCR failed: {str(e)}")
+    finally:
+        os.unlink(path)
+    
+    text = result["text"]
+    return {
+        "success": True,
+        "data": {
+            "drug_name": extract_drug_name(text),
+            "strength": extract_strength(text),
+            "dosage": extract_dosage(text),
+            "raw_text": text,
+            "confidence": result["confidence"],
+            "cache": cache_status,
+            "timings": {stage: round(ms, 2) for stage, ms in result["timings"].items()}
+        }
+    }
+
+@app.get("/api/ocr/stats")
+def get_ocr_stats(admin: dict = Depends(require_admin)):
+    """OCR worker pool queue depth, per-stage timings and result cache counters"""
+    return {
+        "success": True,
+        "data": {**ocr_pool.stats(), "cache": ocr_cache.info()}
+    }
 
 @app.post("/api/drugs/parse")
-async def parse_drug(data: PrescriptionData):
+async def parse_drug(data: PrescriptionData, request: Request):
     """Parse and normalize drug information"""
-    drug_lower = data.drug_name.lower().strip()
-    
-    drug_info = None
-    for key, value in MOCK_DRUGS.items():
-        if key in drug_lower or value["brand"].lower() in drug_lower:
-            drug_info = value
-            break
-    
-    if not drug_info:
-        drug_info = MOCK_DRUGS["lisinopril"]
-    
+    with span("drug_resolution"):
+        drug_key = price_key(data.drug_name)
+    # Unmatched names are described as lisinopril, but not counted as searches for it
+    if drug_key is not None:
+        search_analytics.record(drug_key, client=reporter_identity(request, None))
+    drug_info = MOCK_DRUGS[drug_key or "lisinopril"]
     fda_data = await get_openfda_info(drug_info["generic"])
-    alternatives = [d["generic"] for d in MOCK_DRUGS.values() if d["generic"] != drug_info["generic"]][:3]
     
     return {
         "success": True,
-        "data": {
-            "drug_name": data.drug_name,
-            "generic_name": drug_info["generic"],
-            "brand_name": drug_info["brand"],
-            "strength": data.strength,
-            "dosage": data.dosage,
-            "rxnorm_id": drug_info["rxnorm"],
-            "atc_code": drug_info["atc"],
-            "safe_alternatives": alternatives,
-            "fda_info": fda_data
-        }
+        "data": describe_drug(data, drug_info, fda_data)
     }
 
-@app.get("/api/prices/compare")
-def compare_prices(drug_name: str, location: str = "Delhi", generic: bool = True):
-    """Get price comparison with INR savings and AI prediction"""
-    location_lower = location.lower()
-    filtered_pharmacies = [
-        p for p in MOCK_PHARMACIES 
-        if location_lower in p["city"].lower() or location_lower in p["area"].lower()
-    ]
+@app.post("/api/prescriptions/compare")
+async def compare_prescription(batch: PrescriptionBatch):
+    """Parse every drug on a prescription and price the whole basket per pharmacy"""
+    if not batch.drugs:
+        raise HTTPException(status_code=400, detail="Prescription has no drugs")
     
-    if not filtered_pharmacies:
-        filtered_pharmacies = MOCK_PHARMACIES
-    
-    prices = []
-    
-    for pharmacy in filtered_pharmacies:
-        base_price = 80
-        city_multiplier = 1.0
-        if pharmacy["city"] == "Mumbai":
-            city_multiplier = 1.2
-        elif pharmacy["city"] == "Bangalore":
-            city_multiplier = 0.9
-        elif pharmacy["city"] == "Chennai":
-            city_multiplier = 0.85
-        elif pharmacy["city"] == "Pune":
-            city_multiplier = 0.95
-        
-        generic_price = round(base_price * city_multiplier + (pharmacy["id"] * 15), 2)
-        brand_price = round(generic_price * 3.5, 2) if not generic else None
-        savings_inr = round(brand_price - generic_price, 2) if brand_price else 0
-        
-        # AI Price Prediction
-        predicted_drop = round(generic_price * 0.12, 2)  # 12% predicted drop
-        price_trend = "dropping" if pharmacy["id"] % 3 == 0 else "stable"
-        
-        # Pharmacy Rating
-        rating = round(4.0 + (pharmacy["id"] % 10) / 10, 1)
-        review_count = 50 + (pharmacy["id"] * 23)
-        
-        prices.append({
+    drug_keys = [require_price_key(item.drug_name) for item in batch.drugs]
+    drug_infos = [MOCK_DRUGS[key] for key in drug_keys]
+    generics = list(dict.fromkeys(info["generic"] for info in drug_infos))
+    fda_results = dict(zip(generics, await asyncio.gather(*(get_openfda_info(g) for g in generics))))
+    
+    hits = find_pharmacies(batch.location, batch.lat, batch.lng, batch.radius_km, batch.k)
+    positions, prices = price_table.matrix(
+        drug_keys,
+        [pharmacy["id"] for _, pharmacy in hits],
+        brand=not batch.generic
+    )
+    pharmacies = [hits[i] for i in positions.tolist()]
+    stocked = np.array([
+        [stock_status(pharmacy["id"], key) != "out_of_stock" for _, pharmacy in pharmacies]
+        for key in drug_keys
+    ], dtype=bool).reshape(prices.shape)
+    available = np.where(stocked, prices, np.inf)
+    
+    # One pass over the (drug x pharmacy) matrix gives both basket strategies
+    totals = available.sum(axis=0)
+    best_per_drug = available.argmin(axis=1) if available.size else np.zeros(len(drug_infos), dtype=np.int64)
+    
+    baskets = [
+        {
             "pharmacy_id": pharmacy["id"],
             "pharmacy_name": pharmacy["name"],
             "city": pharmacy["city"],
             "area": pharmacy["area"],
-            "distance": 0,
-            "brand_price": brand_price,
-            "generic_price": generic_price,
-            "savings_inr": savings_inr,
-            "stock_status": "in_stock" if pharmacy["id"] % 4 != 0 else "low_stock",
+            "distance": km(distance),
             "open_now": pharmacy["open"],
-            "lat": pharmacy["lat"],
-            "lng": pharmacy["lng"],
-            "rating": rating,
-            "review_count": review_count,
-            "ai_prediction": {
-                "predicted_price": round(generic_price - predicted_drop, 2),
-                "price_trend": price_trend,
-                "best_time_to_buy": "Tuesday morning" if price_trend == "dropping" else "Now",
-                "confidence": 0.87
-            },
-            "timestamp": datetime.now().isoformat()
+            "total": round(total, 2),
+            "items": [round(price, 2) for price in column]
+        }
+        for (distance, pharmacy), total, column in zip(pharmacies, totals.tolist(), prices.T.tolist())
+        if math.isfinite(total)
+    ]
+    baskets.sort(key=lambda basket: basket["total"])
+    
+    split_items = []
+    for d, info in enumerate(drug_infos):
+        j = int(best_per_drug[d]) if len(pharmacies) else -1
+        if j < 0 or not math.isfinite(available[d, j]):
+            split_items.append({"generic_name": info["generic"], "pharmacy_id": None, "pharmacy_name": None, "price": None})
+            continue
+        pharmacy = pharmacies[j][1]
+        split_items.append({
+            "generic_name": info["generic"],
+            "pharmacy_id": pharmacy["id"],
+            "pharmacy_name": pharmacy["name"],
+            "price": round(float(available[d, j]), 2)
         })
+    split_total = round(sum(item["price"] for item in split_items if item["price"] is not None), 2)
     
-    prices.sort(key=lambda x: x["generic_price"])
+    return FastJSONResponse({
+        "success": True,
+        "data": {
+            "location": batch.location,
+            "drugs": [
+                describe_drug(item, info, fda_results[info["generic"]])
+                for item, info in zip(batch.drugs, drug_infos)
+            ],
+            "baskets": baskets,
+            "cheapest_pharmacy": baskets[0] if baskets else None,
+            "cheapest_split": {
+                "total": split_total,
+                "items": split_items,
+                "savings_vs_single": round(baskets[0]["total"] - split_total, 2) if baskets else None
+            },
+            "total_pharmacies": len(baskets)
+        }
+    })
+
+@app.get("/api/prices/compare")
+def compare_prices(request: Request, drug_name: str, location: str = "Delhi", generic: bool = True,
+                   lat: Optional[float] = Query(None, ge=-90, le=90),
+                   lng: Optional[float] = Query(None, ge=-180, le=180),
+                   radius_km: Optional[float] = Query(None, gt=0, le=MAX_RADIUS_KM),
+                   k: Optional[int] = Query(None, ge=1, le=MAX_NEAREST_K),
+                   stream: Optional[str] = None, live: bool = False):
+    """
+    Get price comparison with INR savings and AI prediction. With
+    stream=ndjson or stream=sse the cheapest pharmacies are sent first and
+    the rest follow in chunks; live=true then keeps the stream open for
+    crowd price and stock updates.
+    """
+    with span("drug_resolution"):
+        drug_key = require_price_key(drug_name)
+    location, lat, lng = place_key(location), coord_key(lat), coord_key(lng)
+    if stream is not None:
+        if stream not in MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"stream must be one of {', '.join(MEDIA_TYPES)}")
+        with span("pharmacy_filter"):
+            hits = find_pharmacies(location, lat, lng, radius_km, k)
+        return StreamingResponse(
+            stream_price_comparison(hits, drug_name, drug_key, location, generic, lat, lng,
+                                    reporter_identity(request, None), stream, live),
+            media_type=MEDIA_TYPES[stream],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    # Keyed on the resolved drug, so spellings of one drug share an entry; the body names the catalogue drug
+    key = ("compare", drug_key, location, generic, lat, lng, radius_km, k)
+    entry = response_cache.get_or_build(
+        key, ("pharmacies", f"drug:{drug_key}"), lambda: build_price_comparison(MOCK_DRUGS[drug_key]["generic"], drug_key, location, generic,
+                                            lat, lng, radius_km, k)
+    )
+    search_analytics.record(drug_key, entry.meta, lat, lng, reporter_identity(request, None))
+    return entry.response(request)
+
+def build_price_comparison(drug_name: str, drug_key: str, location: str, generic: bool,
+                           lat: Optional[float], lng: Optional[float],
+                           radius_km: Optional[float], k: Optional[int]):
+    """Serialized compare_prices payload plus the best saving, for analytics"""
+    with span("pharmacy_filter"):
+        hits = find_pharmacies(location, lat, lng, radius_km, k)
+    with span("price_computation"):
+        table = price_table.lookup(drug_key, [pharmacy["id"] for _, pharmacy in hits])
+    prices = price_rows(hits, table, drug_key, generic, datetime.now().isoformat())
     
-    return {
+    payload = {
         "success": True,
         "data": {
             "drug_name": drug_name,
@@ -241,18 +523,107 @@ def compare_prices(drug_name: str, location: str = "Delhi", generic: bool = True
             "total_pharmacies": len(prices)
         }
     }
+    return render_json(payload), float(table.savings.max()) if len(table.order) else None
 
-@app.get("/api/pharmacies/nearby")
-def get_nearby_pharmacies(location: str = "Delhi"):
-    """Get nearby pharmacies"""
-    location_lower = location.lower()
-    filtered = [
-        p for p in MOCK_PHARMACIES 
-        if location_lower in p["city"].lower() or location_lower in p["area"].lower()
-    ]
+def price_rows(hits: list, table, drug_key: str, generic: bool, timestamp: str) -> List[PharmacyPrice]:
+    """Response rows for a price slice; `table.order` indexes into `hits`"""
+    brand_prices = table.brand.tolist() if not generic else [None] * len(table.order)
+    savings = table.savings.tolist() if not generic else [0] * len(table.order)
     
-    if not filtered:
-        filtered = MOCK_PHARMACIES
+    return [
+        PharmacyPrice(
+            pharmacy_id=pharmacy["id"],
+            pharmacy_name=pharmacy["name"],
+            city=pharmacy["city"],
+            area=pharmacy["area"],
+            distance=km(distance),
+            brand_price=brand_price,
+            generic_price=generic_price,
+            savings_inr=saving,
+            stock_status=stock_status(pharmacy["id"], drug_key),
+            open_now=pharmacy["open"],
+            lat=pharmacy["lat"],
+            lng=pharmacy["lng"],
+            rating=rating,
+            review_count=review_count,
+            ai_prediction=AIPrediction(
+                predicted_price=predicted_price,
+                price_trend=TREND_LABELS[trend],
+                best_time_to_buy=BUY_ADVICE[trend],
+                confidence=confidence
+            ),
+            timestamp=timestamp
+        )
+        for (distance, pharmacy), generic_price, brand_price, saving, predicted_price, trend, confidence, rating, review_count
+        in zip(
+            map(hits.__getitem__, table.order.tolist()),
+            table.generic.tolist(), brand_prices, savings, table.predicted.tolist(),
+            table.trend.tolist(), table.confidence.tolist(), table.rating.tolist(), table.review_count.tolist()
+        )
+    ]
+
+async def stream_price_comparison(hits: list, drug_name: str, drug_key: str, location: str, generic: bool,
+                                  lat: Optional[float], lng: Optional[float], identity: str, fmt: str, live: bool):
+    """
+    Events: "meta", then "prices" chunks cheapest first (each with the rank
+    of its first row), then "done". Live streams follow with "update"
+    events for their pharmacies until STREAM_LIVE_SECONDS pass or the
+    client disconnects. Only one chunk of rows is held at a time.
+    """
+    # Subscribed before ranking, so no update between the snapshot and the stream is lost
+    queue = update_hub.subscribe(drug_key) if live else None
+    try:
+        yield frame(fmt, "meta", {"drug_name": drug_name, "location": location, "total_pharmacies": len(hits)})
+        timestamp = datetime.now().isoformat()
+        sent = 0
+        best_saving = None
+        for table in price_table.ranked(drug_key, [pharmacy["id"] for _, pharmacy in hits], STREAM_FIRST, STREAM_CHUNK):
+            prices = price_rows(hits, table, drug_key, generic, timestamp)
+            yield frame(fmt, "prices", {"rank": sent, "prices": prices})
+            sent += len(prices)
+            chunk_best = float(table.savings.max())
+            best_saving = chunk_best if best_saving is None else max(best_saving, chunk_best)
+            # Let other requests run between chunks of a large city
+            await asyncio.sleep(0)
+        search_analytics.record(drug_key, best_saving, lat, lng, identity)
+        yield frame(fmt, "done", {"total_pharmacies": sent})
+        if queue is None:
+            return
+        
+        pharmacy_ids = {pharmacy["id"] for _, pharmacy in hits}
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STREAM_LIVE_SECONDS
+        while loop.time() < deadline:
+            update = await next_update(queue, min(STREAM_HEARTBEAT, deadline - loop.time()))
+            if update is None:
+                yield heartbeat(fmt)
+                continue
+            pharmacy_id, field, value = update
+            if pharmacy_id in pharmacy_ids:
+                yield frame(fmt, "update", {"pharmacy_id": pharmacy_id, field: value})
+    finally:
+        if queue is not None:
+            update_hub.unsubscribe(drug_key, queue)
+
+@app.get("/api/pharmacies/nearby")
+def get_nearby_pharmacies(request: Request, location: str = "Delhi",
+                          lat: Optional[float] = Query(None, ge=-90, le=90),
+                          lng: Optional[float] = Query(None, ge=-180, le=180),
+                          radius_km: Optional[float] = Query(None, gt=0, le=MAX_RADIUS_KM),
+                          k: Optional[int] = Query(None, ge=1, le=MAX_NEAREST_K)):
+    """Get nearby pharmacies sorted by distance"""
+    location, lat, lng = place_key(location), coord_key(lat), coord_key(lng)
+    key = ("nearby", location, lat, lng, radius_km, k)
+    entry = response_cache.get_or_build(
+        key, ("pharmacies",), lambda: (render_json(nearby_payload(location, lat, lng, radius_km, k)), None)
+    )
+    return entry.response(request)
+
+def nearby_payload(location: str, lat: Optional[float], lng: Optional[float],
+                   radius_km: Optional[float], k: Optional[int]) -> dict:
+    with span("pharmacy_filter"):
+        hits = find_pharmacies(location, lat, lng, radius_km, k)
+    filtered = [{**pharmacy, "distance": km(distance)} for distance, pharmacy in hits]
     
     return {
         "success": True,
@@ -263,26 +634,134 @@ def get_nearby_pharmacies(location: str = "Delhi"):
         }
     }
 
-@app.post("/api/insurance/estimate")
-def estimate_insurance(drug_name: str, insurer: str, generic_price: float, tier: Optional[int] = 1):
-    """Estimate insurance with INR"""
-    copay_tiers = {
-        1: 50.0,
-        2: 150.0,
-        3: 400.0,
-        4: 800.0
+def tracked_drugs(drugs: str) -> tuple:
+    """Sorted price keys of a comma-separated drug list, as sync clients send it"""
+    keys = sorted({require_price_key(name) for name in drugs.split(",") if name.strip()})
+    if len(keys) > SYNC_MAX_DRUGS:
+        raise HTTPException(status_code=400, detail=f"At most {SYNC_MAX_DRUGS} drugs can be synced")
+    return tuple(keys)
+
+def sync_pharmacies(city: Optional[str]) -> List[dict]:
+    """The pharmacies a sync client caches; like find_pharmacies, an unmatched place means all of them"""
+    return (pharmacy_index.search_place(city) if city else None) or pharmacy_index.all()
+
+async def read_sync_cursor() -> tuple:
+    """(cursor up to the first change and price row this worker has not applied, latest cursor)"""
+    settled_before = time.time() - SYNC_SETTLE_SECONDS
+    _, latest = await repository.sync_cursor(settled_before)
+    change_id = catalogue_changes.advance(
+        await repository.change_ids_since(catalogue_changes.through, SYNC_MAX_CHANGES), settled_before
+    )
+    price_id = await report_ingestor.applied_price_id(time.time() - 4 * REPORT_HALF_LIFE)
+    return Cursor(change_id, price_id), Cursor(*latest)
+
+@app.get("/api/sync/bundle")
+async def get_sync_bundle(request: Request, city: Optional[str] = None, drugs: str = ""):
+    """
+    First-install bundle for offline clients: every drug, the pharmacies in
+    `city` and the prices of the comma-separated `drugs` there, as columns,
+    gzipped when accepted. Its cursor is the `since` of the first /api/sync.
+    """
+    tracked = tracked_drugs(drugs)
+    city = place_key(city)
+    # Read before the catalogue, so the bundle holds at least everything the cursor covers
+    cursor, _ = await read_sync_cursor()
+    gzipped = accepts_gzip(request)
+    key = ("sync_bundle", city, tracked, gzipped)
+    entry = await asyncio.to_thread(
+        response_cache.get_or_build, key, ("drugs", "pharmacies", *[f"drug:{drug}" for drug in tracked]),
+        lambda: encode_body(render_json(sync_bundle_payload(cursor, city, tracked)), gzipped)
+    )
+    return sync_response(request, entry)
+
+def sync_bundle_payload(cursor: Cursor, city: Optional[str], tracked: tuple) -> dict:
+    pharmacies = sync_pharmacies(city)
+    pharmacy_ids = [pharmacy["id"] for pharmacy in pharmacies]
+    
+    return {
+        "success": True,
+        "data": {
+            "cursor": str(cursor),
+            "drugs": drug_columns(drug_names(MOCK_DRUGS)),
+            "pharmacies": pharmacy_columns(pharmacies),
+            "prices": {drug: price_columns(price_table, drug, pharmacy_ids) for drug in tracked}
+        }
     }
+
+@app.get("/api/sync")
+async def sync_catalogue(request: Request, since: str, city: Optional[str] = None, drugs: str = ""):
+    """
+    Drugs, pharmacies and tracked prices changed since the `since` cursor,
+    for the same `city` and `drugs` the client's bundle was built with.
+    "reset": true means the client is too far behind (or the database was
+    replaced) and should reinstall from /api/sync/bundle.
+    """
+    try:
+        since_cursor = Cursor.parse(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since must be a cursor from /api/sync or /api/sync/bundle")
+    tracked = tracked_drugs(drugs)
+    cursor, latest = await read_sync_cursor()
+    gzipped = accepts_gzip(request)
     
-    insurer_multiplier = 1.0
-    if insurer.lower() in ["star health", "hdfc ergo", "icici lombard"]:
-        insurer_multiplier = 0.8
-    elif insurer.lower() in ["cghs", "esi", "ayushman bharat"]:
-        insurer_multiplier = 0.5
+    changes = cells = []
+    reset = since_cursor.change_id > latest.change_id or since_cursor.price_id > latest.price_id
+    if not reset:
+        changes = await repository.changes_since(since_cursor.change_id, SYNC_MAX_CHANGES + 1)
+        cells = await repository.priced_cells_since(since_cursor.price_id, SYNC_MAX_CHANGES + 1)
+        reset = len(changes) > SYNC_MAX_CHANGES or len(cells) > SYNC_MAX_CHANGES
+    if reset:
+        payload = {"success": True, "data": {"reset": True}}
+    else:
+        # A client that synced with a worker further ahead keeps its position, and gets nothing
+        # this worker has not applied; rows past the cursor are sent by a later sync
+        cursor = Cursor(max(cursor.change_id, since_cursor.change_id), max(cursor.price_id, since_cursor.price_id))
+        changes = [change for change in changes if change[0] <= cursor.change_id]
+        cells = [cell for cell in cells if cell[0] <= cursor.price_id]
+        payload = sync_delta_payload(cursor, city, tracked, fold_changes(changes, cells, tracked))
+    return sync_response(request, CachedBody(*encode_body(render_json(payload), gzipped)), max_age=0)
+
+def sync_delta_payload(cursor: Cursor, city: Optional[str], tracked: tuple, delta: Delta) -> dict:
+    """Changed entries from this worker's catalogue; an upsert of an entity since deleted here is left out"""
+    place = {pharmacy["id"] for pharmacy in sync_pharmacies(city)}
+    drugs = [key for key, op in delta.drugs.items() if op == UPSERT and key in MOCK_DRUGS]
+    deleted_drugs = [key for key, op in delta.drugs.items() if op == DELETE]
+    pharmacies = [
+        pharmacy_index.get(pharmacy_id) for pharmacy_id, op in delta.pharmacies.items()
+        if op == UPSERT and pharmacy_id in place and pharmacy_index.get(pharmacy_id) is not None
+    ]
+    # Pharmacies that moved out of the client's city are deletes too; clients ignore ids they never had
+    deleted_pharmacies = [
+        pharmacy_id for pharmacy_id, op in delta.pharmacies.items()
+        if op == DELETE or (pharmacy_id not in place and pharmacy_index.get(pharmacy_id) is not None)
+    ]
+    changed_pharmacies = {pharmacy["id"] for pharmacy in pharmacies}
     
-    base_copay = copay_tiers.get(tier, 15.0)
-    copay = round(base_copay * insurer_multiplier, 2)
-    final_cost = min(copay, generic_price)
-    out_of_pocket = max(0, generic_price - copay)
+    prices = {}
+    for drug in tracked:
+        if drug in deleted_drugs:
+            continue
+        # A re-added drug is priced afresh everywhere
+        pharmacy_ids = place if drug in drugs else (delta.priced.get(drug, set()) | changed_pharmacies) & place
+        if pharmacy_ids:
+            prices[drug] = price_columns(price_table, drug, sorted(pharmacy_ids))
+    
+    return {
+        "success": True,
+        "data": {
+            "reset": False,
+            "cursor": str(cursor),
+            "drugs": {"upserted": drug_columns((key, MOCK_DRUGS[key]["generic"], MOCK_DRUGS[key]["brand"]) for key in drugs),
+                      "deleted": deleted_drugs},
+            "pharmacies": {"upserted": pharmacy_columns(pharmacies), "deleted": deleted_pharmacies},
+            "prices": prices
+        }
+    }
+
+@app.post("/api/insurance/estimate")
+def estimate_insurance(drug_name: str, insurer: str, generic_price: float, tier: Optional[int] = 1):
+    """Estimate insurance with INR"""
+    copay, final_cost, out_of_pocket = insurance_table.quote(insurer, tier, generic_price)
     
     return {
         "success": True,
@@ -296,43 +775,169 @@ def estimate_insurance(drug_name: str, insurer: str, generic_price: float, tier:
         }
     }
 
+@app.post("/api/insurance/quote")
+def quote_insurance(basket: InsuranceBasket):
+    """Quote a basket under one insurer against every matching pharmacy in a single vectorized pass"""
+    if not basket.drugs:
+        raise HTTPException(status_code=400, detail="Basket has no drugs")
+    
+    drug_keys = [require_price_key(item.drug_name) for item in basket.drugs]
+    hits = find_pharmacies(basket.location, basket.lat, basket.lng, basket.radius_km, basket.k)
+    positions, prices = price_table.matrix(
+        drug_keys,
+        [pharmacy["id"] for _, pharmacy in hits],
+        brand=not basket.generic
+    )
+    copays, final_costs, out_of_pocket = insurance_table.quote_matrix(
+        basket.insurer, [item.tier for item in basket.drugs], prices
+    )
+    
+    quotes = [
+        {
+            "pharmacy_id": pharmacy["id"],
+            "pharmacy_name": pharmacy["name"],
+            "city": pharmacy["city"],
+            "area": pharmacy["area"],
+            "distance": km(distance),
+            "total_price": round(price, 2),
+            "total_final_cost": round(final, 2),
+            "total_out_of_pocket": round(oop, 2),
+            "items": [
+                {"drug_name": item.drug_name, "price": round(p, 2), "final_cost": round(f, 2), "out_of_pocket": round(o, 2)}
+                for item, p, f, o in zip(basket.drugs, price_column, final_column, oop_column)
+            ]
+        }
+        for (distance, pharmacy), price, final, oop, price_column, final_column, oop_column in zip(
+            (hits[i] for i in positions.tolist()),
+            prices.sum(axis=0).tolist(), final_costs.sum(axis=0).tolist(), out_of_pocket.sum(axis=0).tolist(),
+            prices.T.tolist(), final_costs.T.tolist(), out_of_pocket.T.tolist()
+        )
+    ]
+    quotes.sort(key=lambda quote: quote["total_out_of_pocket"])
+    
+    return FastJSONResponse({
+        "success": True,
+        "data": {
+            "insurer": basket.insurer,
+            "copays": [
+                {"drug_name": item.drug_name, "tier": item.tier, "copay": copay}
+                for item, copay in zip(basket.drugs, copays.tolist())
+            ],
+            "pharmacies": quotes,
+            "total_pharmacies": len(quotes)
+        }
+    })
+
 @app.post("/api/stock/report")
-def report_stock(pharmacy_id: int, drug_name: str, in_stock: bool, user_trust_score: Optional[float] = 0.5):
+async def report_stock(pharmacy_id: int, drug_name: str, in_stock: bool, request: Request,
+                       user: Optional[dict] = Depends(optional_user)):
     """Crowd-sourced stock reporting"""
-    confidence = min(0.95, 0.5 + (user_trust_score * 0.45))
+    confidence = report_confidence(user)
+    pharmacy = find_reported_pharmacy(pharmacy_id, None)
+    drug_key = drug_index.resolve(drug_name)
+    if drug_key is None:
+        raise HTTPException(status_code=404, detail="Medicine not found")
+    
+    submit_report(Report(
+        kind=STOCK, pharmacy_id=pharmacy["id"], drug=drug_key, value=1.0 if in_stock else 0.0,
+        confidence=confidence, reporter=reporter_identity(request, user), reporter_email=user["sub"] if user else None
+    ))
     
     return {
         "success": True,
-        "message": "Stock status updated",
+        "message": "Stock report queued",
         "data": {
             "pharmacy_id": pharmacy_id,
             "drug_name": drug_name,
             "in_stock": in_stock,
             "confidence": round(confidence, 2),
+            "status": "queued",
             "timestamp": datetime.now().isoformat()
         }
     }
 
 @app.post("/api/prices/report")
-def report_price(data: PriceReport):
+async def report_price(data: PriceReport, request: Request, user: Optional[dict] = Depends(optional_user)):
     """Crowdsourced price reporting"""
-    confidence = min(0.95, 0.5 + (data.user_trust_score * 0.45))
+    confidence = report_confidence(user)
+    pharmacy = find_reported_pharmacy(data.pharmacy_id, data.pharmacy_name)
+    drug_key = drug_index.resolve(data.drug_name)
+    if drug_key is None:
+        raise HTTPException(status_code=404, detail="Medicine not found")
+    
+    submit_report(Report(
+        kind=PRICE, pharmacy_id=pharmacy["id"], drug=drug_key, value=data.price,
+        confidence=confidence, reporter=reporter_identity(request, user), reporter_email=user["sub"] if user else None
+    ))
     
     return {
         "success": True,
         "message": "Price report submitted",
         "data": {
-            "pharmacy_name": data.pharmacy_name,
+            "pharmacy_id": pharmacy["id"],
+            "pharmacy_name": pharmacy["name"],
             "drug_name": data.drug_name,
             "price": data.price,
             "confidence": round(confidence, 2),
+            "status": "queued",
             "timestamp": datetime.now().isoformat()
         }
     }
 
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of request, span and subsystem metrics"""
+    return PlainTextResponse(registry.expose(), media_type="text/plain; version=0.0.4")
+
+@app.post("/api/admin/profiler")
+async def toggle_profiler(enabled: bool, threshold_ms: Optional[float] = None,
+                          admin: dict = Depends(require_admin)):
+    """Admin only: sample stacks and dump flame-graph data for requests slower than threshold_ms"""
+    if enabled:
+        try:
+            profiler.start(threshold_ms)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        profiler.stop()
+    
+    return {
+        "success": True,
+        "data": {"enabled": profiler.enabled, "threshold_ms": profiler.threshold_ms,
+                 "out_dir": profiler.out_dir, "dumps": profiler.dumps, "skipped": profiler.skipped}
+    }
+
+@app.get("/api/cache/stats")
+def get_response_cache_stats(admin: dict = Depends(require_admin)):
+    """Response cache occupancy and hit rate"""
+    return {
+        "success": True,
+        "data": response_cache.stats()
+    }
+
+@app.get("/api/ingest/stats")
+def get_ingest_stats(admin: dict = Depends(require_admin)):
+    """Report queue depth, flush latency and aggregate counts"""
+    return {
+        "success": True,
+        "data": report_ingestor.stats()
+    }
+
 @app.post("/api/alerts/create")
-def create_price_alert(drug_name: str, target_price: float, user_email: str):
-    """Create price alert"""
+async def create_price_alert(drug_name: str, target_price: float = Query(gt=0),
+                             user: dict = Depends(require_user)):
+    """Create price alert; fires at once if some pharmacy is already at or below target"""
+    user_email = user["sub"]
+    # Query(gt=0) already rejects NaN, but lets inf through
+    if not math.isfinite(target_price):
+        raise HTTPException(status_code=422, detail="target_price must be finite")
+    drug_key = require_price_key(drug_name)
+    alert_id = await repository.insert_alert(user_email, drug_key, drug_name, target_price)
+    alert = Alert(id=alert_id, user_email=user_email, drug=drug_key, drug_name=drug_name, target_price=target_price)
+    alert_book.add(alert)
+    version_watcher.touch("alerts")
+    observe_cheapest([drug_key])
+    
     return {
         "success": True,
         "message": "Price alert created",
@@ -340,55 +945,83 @@ def create_price_alert(drug_name: str, target_price: float, user_email: str):
             "drug_name": drug_name,
             "target_price": target_price,
             "user_email": user_email,
-            "alert_id": f"alert_{datetime.now().timestamp()}",
-            "status": "active"
+            "alert_id": alert_id,
+            "status": alert.status
         }
     }
 
 @app.get("/api/alerts/list")
-def list_price_alerts(user_email: str):
+async def list_price_alerts(user: dict = Depends(require_user)):
     """List user's price alerts"""
-    mock_alerts = [
-        {"id": 1, "drug_name": "Lisinopril", "target_price": 100, "current_price": 120, "status": "active"},
-        {"id": 2, "drug_name": "Atorvastatin", "target_price": 250, "current_price": 240, "status": "triggered"},
-    ]
+    alerts = []
+    # The database's status, except for alerts this worker fired and has not persisted yet; an alert
+    # missing from the local book may just have been created on another worker
+    unpersisted = alert_notifier.unpersisted()
+    for row in await repository.alerts_for_user(user["sub"]):
+        fired = unpersisted.get(row["id"]) if row["status"] == "active" else None
+        triggered_price = fired.triggered_price if fired else row["triggered_price"]
+        cheapest = price_table.cheapest(row["drug_key"])
+        alerts.append({
+            "id": row["id"],
+            "drug_name": row["drug_name"],
+            "target_price": float(row["target_price"]),
+            "current_price": round(cheapest[1], 2) if cheapest else None,
+            "status": fired.status if fired else row["status"],
+            "triggered_price": float(triggered_price) if triggered_price is not None else None,
+            "triggered_pharmacy_id": fired.triggered_pharmacy_id if fired else row["triggered_pharmacy_id"]
+        })
+    
+    return {
+        "success": True,
+        "data": {"alerts": alerts}
+    }
+
+@app.get("/api/alerts/stats")
+def get_alert_stats(admin: dict = Depends(require_admin)):
+    """Active alert count and notification delivery counters"""
     return {
         "success": True,
-        "data": {"alerts": mock_alerts}
+        "data": {"active": len(alert_book), "drugs": len(alert_book.drugs()), **alert_notifier.stats()}
     }
 
 @app.get("/api/admin/stats")
-def get_admin_stats(user_email: str = Header(..., alias="X-User-Email")):
+async def get_admin_stats(admin: dict = Depends(require_admin)):
     """Admin dashboard with INR savings"""
-    verify_admin(user_email)
+    snapshot = search_analytics.snapshot
     
     return {
         "success": True,
         "data": {
-            "total_searches": 15847,
-            "active_users": 3421,
-            "pharmacy_partners": 127,
-            "total_savings_inr": 2847500.00,
-            "avg_savings_per_search": 179.75,
+            **snapshot,
+            "pharmacy_partners": len(MOCK_PHARMACIES),
             "most_searched": [
-                {"drug": "Lisinopril", "count": 2341, "avg_savings_inr": 225.00},
-                {"drug": "Atorvastatin", "count": 1987, "avg_savings_inr": 180.50},
-                {"drug": "Metformin", "count": 1654, "avg_savings_inr": 150.25}
+                {**row, "drug": MOCK_DRUGS.get(row["drug"], {}).get("generic", row["drug"]).title()}
+                for row in snapshot["most_searched"]
             ]
         }
     }
 
+@app.get("/api/admin/limiter")
+async def get_limiter_stats(admin: dict = Depends(require_admin)):
+    """Per-route adaptive concurrency limits, queue depth and shed counts"""
+    return {"success": True, "data": load_shedder.stats()}
+
 @app.post("/api/admin/medicines")
-def add_medicine(data: MedicineCreate, user_email: str = Header(..., alias="X-User-Email")):
+async def add_medicine(data: MedicineCreate, admin: dict = Depends(require_admin)):
     """Admin only: Add medicine"""
-    verify_admin(user_email)
-    
-    MOCK_DRUGS[data.generic_name.lower()] = {
-        "generic": data.generic_name,
-        "brand": data.brand_name,
-        "rxnorm": data.rxnorm_id,
-        "atc": data.atc_code
-    }
+    with catalogue_changes.writing():
+        MOCK_DRUGS[data.generic_name.lower()] = {
+            "generic": data.generic_name,
+            "brand": data.brand_name,
+            "rxnorm": data.rxnorm_id,
+            "atc": data.atc_code,
+            "synonyms": data.synonyms
+        }
+        await repository.upsert_drug(data.generic_name.lower(), MOCK_DRUGS[data.generic_name.lower()])
+        drug_index.add(data.generic_name.lower(), MOCK_DRUGS[data.generic_name.lower()])
+        response_cache.bump(f"drug:{data.generic_name.lower()}", "drugs")
+        version_watcher.touch("catalogue")
+    observe_cheapest([data.generic_name.lower()])
     
     return {
         "success": True,
@@ -396,19 +1029,24 @@ def add_medicine(data: MedicineCreate, user_email: str = Header(..., alias="X-Us
     }
 
 @app.put("/api/admin/medicines/{drug_name}")
-def edit_medicine(drug_name: str, data: MedicineCreate, user_email: str = Header(..., alias="X-User-Email")):
+async def edit_medicine(drug_name: str, data: MedicineCreate, admin: dict = Depends(require_admin)):
     """Admin only: Edit medicine"""
-    verify_admin(user_email)
-    
     if drug_name.lower() not in MOCK_DRUGS:
         raise HTTPException(status_code=404, detail="Medicine not found")
     
-    MOCK_DRUGS[drug_name.lower()] = {
-        "generic": data.generic_name,
-        "brand": data.brand_name,
-        "rxnorm": data.rxnorm_id,
-        "atc": data.atc_code
-    }
+    with catalogue_changes.writing():
+        MOCK_DRUGS[drug_name.lower()] = {
+            "generic": data.generic_name,
+            "brand": data.brand_name,
+            "rxnorm": data.rxnorm_id,
+            "atc": data.atc_code,
+            "synonyms": data.synonyms
+        }
+        await repository.upsert_drug(drug_name.lower(), MOCK_DRUGS[drug_name.lower()])
+        drug_index.add(drug_name.lower(), MOCK_DRUGS[drug_name.lower()])
+        response_cache.bump(f"drug:{drug_name.lower()}", "drugs")
+        version_watcher.touch("catalogue")
+    observe_cheapest([drug_name.lower()])
     
     return {
         "success": True,
@@ -416,28 +1054,123 @@ def edit_medicine(drug_name: str, data: MedicineCreate, user_email: str = Header
     }
 
 @app.delete("/api/admin/medicines/{drug_name}")
-def delete_medicine(drug_name: str, user_email: str = Header(..., alias="X-User-Email")):
+async def delete_medicine(drug_name: str, admin: dict = Depends(require_admin)):
     """Admin only: Delete medicine"""
-    verify_admin(user_email)
-    
     if drug_name.lower() not in MOCK_DRUGS:
         raise HTTPException(status_code=404, detail="Medicine not found")
     
-    del MOCK_DRUGS[drug_name.lower()]
+    with catalogue_changes.writing():
+        await repository.delete_drug(drug_name.lower())
+        del MOCK_DRUGS[drug_name.lower()]
+        drug_index.remove(drug_name.lower())
+        price_table.drop_drug(drug_name)
+        report_ingestor.forget_catalogue_ids()
+        response_cache.bump(f"drug:{drug_name.lower()}", "drugs")
+        version_watcher.touch("catalogue")
     
     return {
         "success": True,
         "message": "Medicine deleted successfully"
     }
 
+@app.post("/api/admin/pharmacies")
+async def add_pharmacy(data: PharmacyCreate, admin: dict = Depends(require_admin)):
+    """Admin only: Add pharmacy"""
+    pharmacy = data.model_dump()
+    with catalogue_changes.writing():
+        pharmacy = {"id": await repository.insert_pharmacy(pharmacy), **pharmacy}
+        MOCK_PHARMACIES.append(pharmacy)
+        pharmacy_index.add(pharmacy)
+        price_table.add_pharmacy(pharmacy)
+        response_cache.bump("pharmacies")
+        version_watcher.touch("catalogue")
+    observe_cheapest(alert_book.drugs())
+    
+    return {
+        "success": True,
+        "message": "Pharmacy added successfully",
+        "data": pharmacy
+    }
+
+@app.put("/api/admin/pharmacies/{pharmacy_id}")
+async def edit_pharmacy(pharmacy_id: int, data: PharmacyCreate, admin: dict = Depends(require_admin)):
+    """Admin only: Edit pharmacy"""
+    if pharmacy_index.get(pharmacy_id) is None:
+        raise HTTPException(status_code=404, detail="Pharmacy not found")
+    
+    pharmacy = {"id": pharmacy_id, **data.model_dump()}
+    with catalogue_changes.writing():
+        await repository.update_pharmacy(pharmacy)
+        MOCK_PHARMACIES[:] = [pharmacy if p["id"] == pharmacy_id else p for p in MOCK_PHARMACIES]
+        pharmacy_index.update(pharmacy)
+        price_table.update_pharmacy(pharmacy)
+        response_cache.bump("pharmacies")
+        version_watcher.touch("catalogue")
+    observe_cheapest(alert_book.drugs())
+    
+    return {
+        "success": True,
+        "message": "Pharmacy updated successfully",
+        "data": pharmacy
+    }
+
+@app.delete("/api/admin/pharmacies/{pharmacy_id}")
+async def delete_pharmacy(pharmacy_id: int, admin: dict = Depends(require_admin)):
+    """Admin only: Delete pharmacy"""
+    if pharmacy_index.get(pharmacy_id) is None:
+        raise HTTPException(status_code=404, detail="Pharmacy not found")
+    
+    with catalogue_changes.writing():
+        await repository.delete_pharmacy(pharmacy_id)
+        pharmacy_index.remove(pharmacy_id)
+        MOCK_PHARMACIES[:] = [p for p in MOCK_PHARMACIES if p["id"] != pharmacy_id]
+        price_table.remove_pharmacy(pharmacy_id)
+        report_ingestor.forget_catalogue_ids()
+        response_cache.bump("pharmacies")
+        version_watcher.touch("catalogue")
+    
+    return {
+        "success": True,
+        "message": "Pharmacy deleted successfully"
+    }
+
+@app.put("/api/admin/insurers/{name}")
+async def set_insurer(name: str, data: InsurerUpdate, admin: dict = Depends(require_admin)):
+    """Admin only: Set an insurer's copay multiplier"""
+    await repository.upsert_insurer(normalize_insurer(name), name, data.multiplier)
+    insurance_table.set_insurer(name, data.multiplier)
+    version_watcher.touch("insurance")
+    
+    return {
+        "success": True,
+        "message": "Insurer updated successfully",
+        "data": {"insurer": name, "multiplier": data.multiplier}
+    }
+
+@app.put("/api/admin/insurance/tiers/{tier}")
+async def set_insurance_tier(data: TierUpdate, tier: int = Path(ge=0, le=MAX_TIER),
+                             admin: dict = Depends(require_admin)):
+    """Admin only: Set the base copay for a formulary tier"""
+    await repository.upsert_tier(tier, data.copay)
+    insurance_table.set_tier(tier, data.copay)
+    version_watcher.touch("insurance")
+    
+    return {
+        "success": True,
+        "message": "Tier updated successfully",
+        "data": {"tier": tier, "copay": data.copay}
+    }
+
 def extract_drug_name(text: str) -> Optional[str]:
-    text_lower = text.lower()
-    for drug in MOCK_DRUGS.keys():
-        if drug in text_lower:
-            return drug.capitalize()
-    for drug_info in MOCK_DRUGS.values():
-        if drug_info["brand"].lower() in text_lower:
-            return drug_info["brand"]
+    matches = drug_index.matches(text)
+    for key, kind in matches:
+        if kind != BRAND:
+            return key.capitalize()
+    if matches:
+        return MOCK_DRUGS[matches[0][0]]["brand"]
+    fuzzy = drug_index.fuzzy(text)
+    if fuzzy:
+        return fuzzy[0].capitalize()
     words = re.findall(r'\b[A-Za-z]{5,}\b', text)
     return words[0] if words else None
 
@@ -457,31 +1190,231 @@ def extract_dosage(text: str) -> Optional[str]:
             return match.group(0)
     return None
 
-@lru_cache(maxsize=100)
 async def get_openfda_info(drug_name: str) -> dict:
-    try:
-        url = f"https://api.fda.gov/drug/label.json?search=openfda.generic_name:{drug_name}&limit=1"
-        response = requests.get(url, timeout=3)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get("results"):
-                result = data["results"][0]
-                return {
-                    "warnings": result.get("warnings", ["No warnings"])[:1],
-                    "active_ingredient": result.get("openfda", {}).get("substance_name", [drug_name]),
-                    "manufacturer": result.get("openfda", {}).get("manufacturer_name", ["Various"])[:1],
-                    "purpose": result.get("purpose", ["Prescription medication"])[:1]
-                }
-    except Exception as e:
-        print(f"OpenFDA error: {e}")
+    """Drug label summary from OpenFDA, served from the shared label cache"""
+    with span("openfda_fetch"):
+        return await label_cache.get(drug_name)
+
+async def load_catalogue():
+    """Replace the in-memory catalogue and its indexes with the database contents, mapped from the snapshot if enabled"""
+    global MOCK_DRUGS, drug_index, pharmacy_index, price_table
+    # Read before the catalogue, so the catalogue holds every change they cover
+    settled, _ = await repository.sync_cursor(time.time() - SYNC_SETTLE_SECONDS)
+    changes = await repository.change_ids_since(settled[0], SYNC_MAX_CHANGES)
+    catalogue = await read_catalogue(repository)
+    MOCK_DRUGS = catalogue.drugs
+    MOCK_PHARMACIES[:] = catalogue.pharmacies
     
-    return {
-        "warnings": ["Consult your doctor"],
-        "active_ingredient": [drug_name],
-        "manufacturer": ["Various"],
-        "purpose": ["Prescription medication"]
-    }
+    drug_index = catalogue.drug_index
+    pharmacy_index = PharmacyIndex(MOCK_PHARMACIES)
+    price_table = PriceTable(MOCK_PHARMACIES, forecasts=price_forecaster.forecasts)
+    for drug, pharmacy_id, price in catalogue.prices:
+        price_table.set_price(drug, pharmacy_id, price)
+    report_ingestor.forget_catalogue_ids()
+    response_cache.bump_all()
+    catalogue_changes.loaded((row[0] for row in changes), through=settled[0])
+
+def apply_report_updates(price_updates: dict, stock_updates: dict, observe: bool = True):
+    """
+    Fold freshly aggregated crowd prices into the price table. Alerts are
+    only observed by the worker that ingested the reports, so other workers
+    catching up on them never fire the same alert twice.
+    """
+    for (pharmacy_id, drug), price in price_updates.items():
+        price_table.set_price(drug, pharmacy_id, price)
+        if observe:
+            alert_notifier.enqueue(alert_book.observe(drug, price, pharmacy_id))
+    update_hub.publish(price_updates, stock_updates)
+    response_cache.bump(*{f"drug:{drug}" for _, drug in list(price_updates) + list(stock_updates)})
+
+def observe_cheapest(drugs):
+    """Fire alerts on each drug's cheapest cell, after a change that may have added or recomputed its prices"""
+    for drug in drugs:
+        cheapest = price_table.cheapest(drug)
+        if cheapest:
+            alert_notifier.enqueue(alert_book.observe(drug, cheapest[1], cheapest[0]))
+
+def apply_forecasts(drugs: set):
+    for drug in drugs:
+        price_table.invalidate(drug)
+    response_cache.bump(*{f"drug:{drug}" for drug in drugs})
+
+def publish_reports(price_updates: dict, stock_updates: dict):
+    version_watcher.touch("reports")
+
+async def persist_triggered(alerts: List[Alert]):
+    await repository.mark_alerts_triggered(
+        [(alert.triggered_price, alert.triggered_pharmacy_id, alert.id) for alert in alerts]
+    )
+    version_watcher.touch("alerts")
+
+def rearm_alerts(alerts: List[Alert]):
+    """Put alerts the notifier could not deliver back in the book, still active as in the database"""
+    for alert in alerts:
+        if alert.id in alert_book.alerts:
+            continue
+        alert.status = "active"
+        alert.triggered_price = alert.triggered_pharmacy_id = alert.triggered_at = None
+        alert_book.add(alert)
+
+alert_notifier = AlertNotifier(create_sink(), on_flush=persist_triggered, on_drop=rearm_alerts)
+report_ingestor.subscribe(apply_report_updates)
+report_ingestor.subscribe(publish_reports)
+price_forecaster.subscribe(apply_forecasts)
+
+async def load_alert_book() -> AlertBook:
+    """
+    Active alerts from the database, less those this worker fired and has not
+    persisted yet: the database still has them active, so re-adding them would
+    fire them again. Fired before or during the read, they are in one of the
+    two unpersisted sets.
+    """
+    unpersisted = alert_notifier.unpersisted()
+    rows = await repository.load_active_alerts()
+    unpersisted.update(alert_notifier.unpersisted())
+    book = AlertBook()
+    for row in rows:
+        if row["id"] in unpersisted:
+            continue
+        book.add(Alert(id=row["id"], user_email=row["user_email"], drug=row["drug_key"],
+                       drug_name=row["drug_name"], target_price=float(row["target_price"])))
+    return book
+
+async def load_alerts(sweep: bool = True):
+    """Rebuild the alert book and, with `sweep`, fire anything the current prices already satisfy"""
+    global alert_book
+    alert_book = await load_alert_book()
+    if sweep:
+        observe_cheapest(alert_book.drugs())
+
+async def replay_reports(observe: bool = True):
+    """Rebuild report aggregates from the last few half-lives of stored reports"""
+    apply_report_updates(*await report_ingestor.reload(time.time() - 4 * REPORT_HALF_LIFE), observe=observe)
+
+# Reloads for changes other workers made, run by the version watcher
+async def reload_catalogue():
+    await load_catalogue()
+    apply_report_updates(report_ingestor.price_updates(report_ingestor.prices), {}, observe=False)
+
+async def reload_reports():
+    apply_report_updates(*await report_ingestor.catch_up(time.time() - 4 * REPORT_HALF_LIFE), observe=False)
+
+async def reload_alerts():
+    global alert_book
+    alert_book = await load_alert_book()
+
+async def reload_insurance():
+    insurance_table.load(*await repository.load_insurance())
+
+version_watcher.on("catalogue", reload_catalogue)
+version_watcher.on("reports", reload_reports)
+version_watcher.on("alerts", reload_alerts)
+version_watcher.on("insurance", reload_insurance)
+response_cache.shared_versions = lambda: version_watcher.settled
+
+registry.collector("medfinder_openfda", lambda: label_cache.stats)
+registry.collector("medfinder_response_cache", response_cache.stats)
+registry.collector("medfinder_ingest", report_ingestor.stats)
+registry.collector("medfinder_alerts", alert_notifier.stats)
+registry.collector("medfinder_analytics", search_analytics.stats)
+registry.collector("medfinder_ocr", ocr_pool.stats)
+registry.collector("medfinder_versions", version_watcher.stats)
+registry.collector("medfinder_streams", update_hub.stats)
+registry.collector("medfinder_forecast", price_forecaster.stats)
+registry.collector("medfinder_snapshot", lambda: snapshot_stats)
+registry.collector("medfinder_limiter", load_shedder.totals)
+registry.collector("medfinder_price_rows", lambda: price_table.stats())
+
+@app.on_event("startup")
+async def start_profiler():
+    if PROFILE_SLOW_MS > 0:
+        profiler.start()
+
+async def prepare_database():
+    """Create the schema and seed an empty database; serve.py runs this once before starting workers"""
+    await repository.init_schema()
+    if await repository.needs_seed():
+        users = {email: {**user, "password": await hash_password(user["password"])} for email, user in USERS_DB.items()}
+        await repository.seed(MOCK_DRUGS, MOCK_PHARMACIES, users)
+    # Databases seeded by earlier releases hold plaintext passwords
+    for row in await repository.user_passwords():
+        if row["password"] and not is_hashed(row["password"]):
+            await repository.set_password(row["email"], await hash_password(row["password"]))
+    await repository.seed_insurance(
+        [(normalize_insurer(name), name, multiplier) for name, multiplier in SEED_INSURERS.items()], SEED_TIERS
+    )
+
+async def sweep_alerts():
+    """
+    Deliver every alert the stored prices already satisfy. serve.py runs this
+    once before starting workers, so a notification goes out once rather than
+    once per worker; alerts it cannot deliver stay active for the next match.
+    """
+    await load_catalogue()
+    await replay_reports(observe=False)
+    await load_alerts()
+    # Each failed flush counts towards the notifier's attempt limit, past which it gives the batch up
+    for _ in range(alert_notifier.max_attempts):
+        try:
+            await alert_notifier.flush()
+            return
+        except Exception as e:
+            print(f"Alert delivery failed: {e}")
+            await asyncio.sleep(alert_notifier.flush_interval)
+
+@app.on_event("startup")
+async def open_database():
+    await db.connect()
+    if not DATABASE_PREPARED:
+        await prepare_database()
+    # Versions are read before loading, so changes made meanwhile are reloaded once polling starts
+    await version_watcher.snapshot()
+    await load_catalogue()
+    insurance_table.load(*await repository.load_insurance())
+    await replay_reports(observe=not DATABASE_PREPARED)
+    await price_forecaster.start()
+    await load_alerts(sweep=not DATABASE_PREPARED)
+    await search_analytics.load()
+    await report_ingestor.start()
+    await alert_notifier.start()
+    await search_analytics.start()
+    await version_watcher.start()
+
+@app.on_event("shutdown")
+async def stop_report_ingestor():
+    await report_ingestor.stop()
+
+@app.on_event("shutdown")
+async def stop_alert_notifier():
+    await alert_notifier.stop()
+
+@app.on_event("shutdown")
+async def stop_search_analytics():
+    await search_analytics.stop()
+
+@app.on_event("shutdown")
+async def stop_price_forecaster():
+    await price_forecaster.stop()
+
+@app.on_event("shutdown")
+async def stop_version_watcher():
+    await version_watcher.stop()
+
+@app.on_event("shutdown")
+async def close_database():
+    await db.close()
+
+@app.on_event("shutdown")
+async def close_openfda_client():
+    await label_cache.close()
+
+@app.on_event("shutdown")
+def stop_ocr_pool():
+    ocr_pool.shutdown()
+
+@app.on_event("shutdown")
+def stop_profiler():
+    profiler.stop()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,316 @@
+"""Request metrics, hot-path span timers and a sampling profiler, exposed in Prometheus text format"""
+import bisect
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = 0.005
+PROFILE_BUFFER_SECONDS = 30
+# Dumps kept in PROFILE_DIR; older ones are deleted as new ones are written
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+# Slow requests waiting to be dumped; past this they are counted as skipped
+PROFILE_QUEUE_SIZE = 16
+# Innermost Python frames of a thread that is parked rather than working
+IDLE_FRAMES = {"select", "poll", "wait", "_worker"}
+
+# Seconds; spans are mostly sub-millisecond, requests mostly tens of ms
+SPAN_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def expose(self) -> List[str]:
+        lines = super().expose()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram; `observe` is one bisect and a few increments under a lock"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        self.series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                # [per-bucket counts..., +Inf count, sum]
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.label_names + ("le",)
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+        self.collectors: List[Callable[[], Dict[str, float]]] = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        metric = Gauge(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, prefix: str, fn: Callable[[], Dict[str, float]]):
+        """Numeric stats read at scrape time, exported as `<prefix>_<key>` gauges"""
+        self.collectors.append((prefix, fn))
+
+    def expose(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        for prefix, fn in self.collectors:
+            for key, value in fn().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+requests_total = registry.counter("medfinder_requests_total", "HTTP requests", ("route", "method", "status"))
+request_errors = registry.counter("medfinder_request_errors_total", "Requests that raised or returned 5xx", ("route",))
+request_seconds = registry.histogram("medfinder_request_seconds", "Request latency", ("route", "method"))
+in_flight = registry.gauge("medfinder_requests_in_flight", "Requests being served")
+span_seconds = registry.histogram("medfinder_span_seconds", "Hot-path span latency", ("span",), SPAN_BUCKETS)
+
+
+class span:
+    """`with span("drug_resolution"):` times a block into medfinder_span_seconds"""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if METRICS_ENABLED:
+            span_seconds.observe(time.perf_counter() - self.start, self.name)
+        return False
+
+
+class SamplingProfiler:
+    """
+    A daemon thread snapshots every thread's stack each PROFILE_INTERVAL
+    into a short ring buffer. When a request runs longer than the threshold,
+    the samples taken during it are folded into collapsed-stack lines
+    ("frame;frame;frame count"), the input format of flamegraph.pl and
+    speedscope, and written to PROFILE_DIR. Samples cover every thread, so
+    a file can include concurrent requests.
+
+    Folding and writing happen on a writer thread, never on the event
+    loop, and only the newest `max_files` dumps are kept.
+    """
+
+    def __init__(self, threshold_ms: float = PROFILE_SLOW_MS, out_dir: str = PROFILE_DIR,
+                 interval: float = PROFILE_INTERVAL, max_files: int = PROFILE_MAX_FILES):
+        self.threshold_ms = threshold_ms
+        self.out_dir = out_dir
+        self.interval = interval
+        self.max_files = max_files
+        self._samples: deque = deque(maxlen=int(PROFILE_BUFFER_SECONDS / interval))
+        self._thread: Optional[threading.Thread] = None
+        self._writer: Optional[threading.Thread] = None
+        self._slow: queue.Queue = queue.Queue(maxsize=PROFILE_QUEUE_SIZE)
+        self._files: deque = deque()
+        self._running = False
+        self.dumps = 0
+        self.skipped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._running
+
+    def start(self, threshold_ms: Optional[float] = None):
+        """Start sampling; ValueError unless the threshold is positive, since 0 would dump every request"""
+        threshold_ms = self.threshold_ms if threshold_ms is None else threshold_ms
+        if not threshold_ms > 0:
+            raise ValueError(f"threshold_ms must be positive, got {threshold_ms}")
+        self.threshold_ms = threshold_ms
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._sample, name="medfinder-profiler", daemon=True)
+        self._thread.start()
+        self._writer = threading.Thread(target=self._write_dumps, name="medfinder-profiler-writer", daemon=True)
+        self._writer.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._writer is not None:
+            self._slow.put(None)
+            self._writer.join()
+            self._writer = None
+        self._samples.clear()
+
+    def _sample(self):
+        own = threading.get_ident()
+        while self._running:
+            now = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or frame.f_code.co_name in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self._samples.append((now, ";".join(reversed(stack))))
+            time.sleep(self.interval)
+
+    def finished(self, route: str, start: float, end: float):
+        """Called on the event loop for every request; slow ones are handed to the writer thread"""
+        if not self._running or (end - start) * 1000 < self.threshold_ms:
+            return
+        try:
+            self._slow.put_nowait((route, start, end))
+        except queue.Full:
+            self.skipped += 1
+
+    def _write_dumps(self):
+        while True:
+            item = self._slow.get()
+            if item is None:
+                return
+            try:
+                self._dump(*item)
+            except OSError as e:
+                print(f"Profile dump failed: {e}")
+
+    def _dump(self, route: str, start: float, end: float):
+        folded: Dict[str, int] = {}
+        for at, stack in list(self._samples):
+            if start <= at <= end:
+                folded[stack] = folded.get(stack, 0) + 1
+        if not folded:
+            return
+        os.makedirs(self.out_dir, exist_ok=True)
+        name = f"{int(time.time() * 1000)}-{self.dumps}-{route.strip('/').replace('/', '_') or 'root'}.folded"
+        path = os.path.join(self.out_dir, name)
+        with open(path, "w") as f:
+            for stack, count in sorted(folded.items(), key=lambda kv: -kv[1]):
+                f.write(f"{stack} {count}\n")
+        self.dumps += 1
+        self._files.append(path)
+        while len(self._files) > self.max_files:
+            try:
+                os.remove(self._files.popleft())
+            except FileNotFoundError:
+                pass
+
+
+profiler = SamplingProfiler()
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware, so it adds no extra task or body buffering. The
+    route label is the matched path template, looked up from the endpoint
+    the router stored in the scope, which keeps label cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.routes: Optional[Dict[Callable, str]] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end = time.perf_counter()
+            in_flight.dec()
+            if self.routes is None:
+                self.routes = {r.endpoint: r.path for r in scope["app"].routes if hasattr(r, "endpoint")}
+            route = self.routes.get(scope.get("endpoint"), "unmatched")
+            method = scope["method"]
+            requests_total.inc(route, method, str(status))
+            request_seconds.observe(end - start, route, method)
+            if status >= 500:
+                request_errors.inc(route)
+            if profiler.enabled:
+                profiler.finished(route, start, end)
@@ -0,0 +1,227 @@
+"""Prescription OCR: image preprocessing and Tesseract in a worker process pool"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from fastapi import UploadFile
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+OCR_MAX_UPLOAD_BYTES = int(os.getenv("OCR_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+MAX_IMAGE_SIDE = 2000
+DESKEW_MAX_ANGLE = 5.0
+DESKEW_STEP = 0.5
+
+
+class OCRUnavailable(RuntimeError):
+    """Raised when Pillow/pytesseract or the tesseract binary is missing"""
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class UnreadableImage(ValueError):
+    """The upload is an image Pillow recognises but cannot decode, e.g. truncated"""
+
+
+class UnsupportedImage(UnreadableImage):
+    """The upload is not in any image format Pillow recognises"""
+
+
+def load_image(path: str):
+    """Decoded, EXIF-upright image at `path`; decode failures become UnreadableImage"""
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except UnidentifiedImageError:
+        raise UnsupportedImage("Not a recognised image format")
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise UnreadableImage(f"Could not decode image: {e}")
+    return image
+
+
+def estimate_skew(gray) -> float:
+    """
+    Small-angle skew in degrees by projection profile: text lines are
+    horizontal when the variance of row ink sums is largest.
+    """
+    import numpy as np
+    from PIL import Image
+
+    probe = gray.copy()
+    probe.thumbnail((600, 600))
+    ink = np.asarray(probe) < 128
+    if not ink.any():
+        return 0.0
+    ink_image = Image.fromarray((ink * 255).astype("uint8"))
+
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-DESKEW_MAX_ANGLE, DESKEW_MAX_ANGLE + DESKEW_STEP, DESKEW_STEP):
+        rotated = np.asarray(ink_image.rotate(float(angle), resample=Image.NEAREST))
+        score = float(rotated.sum(axis=1, dtype=np.float64).var())
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def image_dhash(path: str) -> int:
+    """64-bit difference hash: survives re-compression, resizing and small shifts"""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError as e:
+        raise OCRUnavailable(f"OCR dependencies missing: {e}")
+
+    small = ImageOps.grayscale(load_image(path)).resize((9, 8), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def run_ocr(path: str) -> dict:
+    """Worker-process entry point: preprocess the image at `path` and OCR it"""
+    try:
+        import pytesseract
+        from PIL import Image, ImageOps
+    except ImportError as e:
+        raise OCRUnavailable(f"OCR dependencies missing: {e}")
+
+    timings = {}
+    start = time.perf_counter()
+    image = load_image(path)
+    timings["decode_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+    gray = ImageOps.autocontrast(ImageOps.grayscale(image))
+    timings["preprocess_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    angle = estimate_skew(gray)
+    if angle:
+        gray = gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    timings["deskew_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    try:
+        data = pytesseract.image_to_data(gray, output_type=pytesseract.Output.DICT)
+    except pytesseract.TesseractNotFoundError as e:
+        raise OCRUnavailable(str(e))
+    timings["recognize_ms"] = (time.perf_counter() - start) * 1000
+
+    words = [w for w in data["text"] if w.strip()]
+    confidences = [float(c) for c, w in zip(data["conf"], data["text"]) if w.strip() and float(c) >= 0]
+    return {
+        "text": " ".join(words),
+        "confidence": round(sum(confidences) / len(confidences) / 100, 2) if confidences else 0.0,
+        "skew_degrees": angle,
+        "timings": timings,
+    }
+
+
+class OCRPool:
+    """
+    Process pool for OCR jobs plus the counters needed to size it: jobs
+    waiting or running, and rolling per-stage timings.
+    """
+
+    def __init__(self, workers: int = OCR_WORKERS):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self._stage_totals: Dict[str, float] = {}
+        self._stage_last: Dict[str, float] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def dhash(self, path: str) -> int:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), image_dhash, path)
+
+    async def run(self, path: str) -> dict:
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self._get_executor(), run_ocr, path)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        result["timings"]["queue_and_run_ms"] = (time.perf_counter() - start) * 1000
+        self.completed += 1
+        self.record(result["timings"])
+        return result
+
+    def record(self, timings: Dict[str, float]):
+        for stage, ms in timings.items():
+            self._stage_totals[stage] = self._stage_totals.get(stage, 0.0) + ms
+            self._stage_last[stage] = ms
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": max(0, self.pending - self.workers),
+            "in_flight": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "stages": {
+                stage: {
+                    "avg_ms": round(total / self.completed, 2) if self.completed else 0.0,
+                    "last_ms": round(self._stage_last[stage], 2)
+                }
+                for stage, total in self._stage_totals.items()
+            }
+        }
+
+
+async def spool_upload(file: UploadFile, max_bytes: int = OCR_MAX_UPLOAD_BYTES) -> Tuple[str, str]:
+    """
+    Copy an upload to a temp file chunk by chunk, hashing as it goes.
+    Returns (path, sha256 hex digest); caller removes the file.
+    """
+    digest = hashlib.sha256()
+    suffix = os.path.splitext(file.filename or "")[1]
+    fd, path = tempfile.mkstemp(prefix="medfinder-ocr-", suffix=suffix)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, digest.hexdigest()
+
+
+ocr_pool = OCRPool()
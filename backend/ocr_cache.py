@@ -0,0 +1,162 @@
+"""Bounded on-disk cache of OCR results keyed by content hash and perceptual hash"""
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "medfinder-ocr-cache"))
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "10000"))
+OCR_PHASH_MAX_DISTANCE = int(os.getenv("OCR_PHASH_MAX_DISTANCE", "6"))
+
+PHASH_BANDS = 8
+
+
+def _bands(phash: int):
+    return [(band, (phash >> (band * 8)) & 0xFF) for band in range(PHASH_BANDS)]
+
+
+class OCRResultCache:
+    """
+    One JSON file per distinct upload, named by its SHA-256. File mtimes
+    double as the LRU clock, so recency survives restarts; the in-memory
+    index is rebuilt from the directory on first use.
+
+    Near-duplicates are found through the 64-bit dHash stored with each
+    entry. The hash is split into 8 one-byte bands, and any hash within 7
+    bits of another must share at least one band exactly. That lets a
+    lookup verify a handful of candidates instead of scanning every entry.
+    They are only counted, never served: two prescriptions on the same
+    letterhead are usually this close, and would get each other's text.
+    """
+
+    def __init__(
+        self,
+        directory: str = OCR_CACHE_DIR,
+        max_bytes: int = OCR_CACHE_MAX_BYTES,
+        max_entries: int = OCR_CACHE_MAX_ENTRIES,
+        max_distance: int = OCR_PHASH_MAX_DISTANCE,
+    ):
+        if max_distance >= PHASH_BANDS:
+            raise ValueError(f"max_distance must be below {PHASH_BANDS}")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._loaded = False
+        # digest -> (size_bytes, phash)
+        self._index: "OrderedDict[str, Tuple[int, Optional[int]]]" = OrderedDict()
+        self._bands: Dict[Tuple[int, int], Set[str]] = {}
+        self._bytes = 0
+        self.stats = {"hits": 0, "near_duplicates": 0, "misses": 0, "evictions": 0}
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def _load(self):
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    phash = json.load(f).get("phash")
+                entries.append((os.path.getmtime(path), name[:-5], os.path.getsize(path), phash))
+            except (OSError, ValueError):
+                continue
+        for _, digest, size, phash in sorted(entries):
+            self._link(digest, size, phash)
+        self._loaded = True
+        self._evict()
+
+    def _link(self, digest: str, size: int, phash: Optional[int]):
+        self._index[digest] = (size, phash)
+        self._bytes += size
+        if phash is not None:
+            for band in _bands(phash):
+                self._bands.setdefault(band, set()).add(digest)
+
+    def _unlink(self, digest: str):
+        size, phash = self._index.pop(digest)
+        self._bytes -= size
+        if phash is not None:
+            for band in _bands(phash):
+                digests = self._bands.get(band)
+                if digests is not None:
+                    digests.discard(digest)
+                    if not digests:
+                        del self._bands[band]
+
+    def _evict(self):
+        while self._index and (len(self._index) > self.max_entries or self._bytes > self.max_bytes):
+            digest = next(iter(self._index))
+            self._unlink(digest)
+            self.stats["evictions"] += 1
+            try:
+                os.unlink(self._path(digest))
+            except OSError:
+                pass
+
+    def _read(self, digest: str) -> Optional[dict]:
+        try:
+            with open(self._path(digest)) as f:
+                entry = json.load(f)
+            os.utime(self._path(digest))
+        except (OSError, ValueError):
+            self._unlink(digest)
+            return None
+        self._index.move_to_end(digest)
+        return entry["result"]
+
+    def get(self, digest: str) -> Optional[dict]:
+        """Cached result for an exact content hash"""
+        with self._lock:
+            self._load()
+            if digest in self._index:
+                result = self._read(digest)
+                if result is not None:
+                    self.stats["hits"] += 1
+                    return result
+            return None
+
+    def record_miss(self, phash: int) -> bool:
+        """Count a content-hash miss, as a near-duplicate if a cached image is within `max_distance` bits"""
+        with self._lock:
+            self._load()
+            candidates = set()
+            for band in _bands(phash):
+                candidates |= self._bands.get(band, set())
+            near = any((self._index[digest][1] ^ phash).bit_count() <= self.max_distance for digest in candidates)
+            self.stats["near_duplicates" if near else "misses"] += 1
+            return near
+
+    def put(self, digest: str, result: dict, phash: Optional[int] = None):
+        payload = json.dumps({"phash": phash, "result": result})
+        with self._lock:
+            self._load()
+            if digest in self._index:
+                self._unlink(digest)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(payload)
+            os.replace(tmp, self._path(digest))
+            self._link(digest, len(payload), phash)
+            self._evict()
+
+    def info(self) -> dict:
+        return {
+            "entries": len(self._index),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            **self.stats
+        }
+
+
+ocr_cache = OCRResultCache()
@@ -0,0 +1,171 @@
+"""Async OpenFDA drug label lookups with a TTL cache and request coalescing"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    import httpx
+
+OPENFDA_BASE_URL = os.getenv("OPENFDA_BASE_URL", "https://api.fda.gov")
+
+
+def fallback_label(drug_name: str) -> dict:
+    """Generic label returned when OpenFDA has nothing usable"""
+    return {
+        "warnings": ["Consult your doctor"],
+        "active_ingredient": [drug_name],
+        "manufacturer": ["Various"],
+        "purpose": ["Prescription medication"]
+    }
+
+
+def parse_label(payload: dict, drug_name: str) -> Optional[dict]:
+    """Reduce an OpenFDA label.json response to the fields the API exposes"""
+    results = payload.get("results")
+    if not results:
+        return None
+    result = results[0]
+    openfda = result.get("openfda", {})
+    return {
+        "warnings": result.get("warnings", ["No warnings"])[:1],
+        "active_ingredient": openfda.get("substance_name", [drug_name]),
+        "manufacturer": openfda.get("manufacturer_name", ["Various"])[:1],
+        "purpose": result.get("purpose", ["Prescription medication"])[:1]
+    }
+
+
+class LabelCache:
+    """
+    Size-bounded LRU of OpenFDA labels keyed by generic name.
+
+    Entries younger than `ttl` are served directly. Entries older than `ttl`
+    but inside the `stale_ttl` grace window are served immediately while a
+    single background fetch refreshes them. Concurrent misses for the same
+    name share one upstream request. A transient upstream failure never
+    replaces a stale entry or extends its life: the entry keeps its expiry,
+    and the next refresh is attempted no sooner than `error_ttl` later.
+    Without a usable entry the fallback label is cached for `error_ttl`.
+    """
+
+    def __init__(
+        self,
+        base_url: str = OPENFDA_BASE_URL,
+        ttl: float = 6 * 3600,
+        stale_ttl: float = 24 * 3600,
+        error_ttl: float = 60,
+        max_entries: int = 2048,
+        timeout: float = 3.0,
+        max_connections: int = 20,
+    ):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.max_connections = max_connections
+        # name -> (label, expires_at)
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # name -> monotonic time before which a failed refresh is not retried
+        self._retry_at: Dict[str, float] = {}
+        self._client: Optional["httpx.AsyncClient"] = None
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "upstream_errors": 0}
+
+    def _get_client(self) -> "httpx.AsyncClient":
+        if self._client is None:
+            # Imported on first lookup; httpx is the slowest import on the startup path
+            import httpx
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def clear(self):
+        self._entries.clear()
+        self._retry_at.clear()
+
+    async def get(self, drug_name: str) -> dict:
+        key = drug_name.lower().strip()
+        now = time.monotonic()
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            label, expires_at = entry
+            if now < expires_at:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return label
+            if now < expires_at + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self.stats["stale_hits"] += 1
+                if now >= self._retry_at.get(key, 0.0):
+                    self._refresh(key)
+                return label
+
+        self.stats["misses"] += 1
+        return await asyncio.shield(self._refresh(key))
+
+    def _refresh(self, key: str) -> asyncio.Future:
+        """Start (or join) the single upstream fetch for `key`"""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return future
+        future = asyncio.ensure_future(self._fetch_and_store(key))
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return future
+
+    async def _fetch_and_store(self, key: str) -> dict:
+        import httpx
+
+        try:
+            label = await self._fetch(key)
+            expires_at = time.monotonic() + self.ttl
+            self._retry_at.pop(key, None)
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"OpenFDA error: {e}")
+            self.stats["upstream_errors"] += 1
+            now = time.monotonic()
+            stale = self._entries.get(key)
+            if stale is not None and now < stale[1] + self.stale_ttl:
+                self._retry_at[key] = now + self.error_ttl
+                return stale[0]
+            self._retry_at.pop(key, None)
+            label = fallback_label(key)
+            expires_at = now + self.error_ttl
+
+        self._entries[key] = (label, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._retry_at.pop(evicted, None)
+        return label
+
+    async def _fetch(self, key: str) -> dict:
+        response = await self._get_client().get(
+            "/drug/label.json",
+            params={"search": f"openfda.generic_name:{key}", "limit": 1},
+        )
+        # OpenFDA answers 404 when the search matches nothing; that is a
+        # definitive answer worth caching, unlike 5xx/429.
+        if response.status_code == 404:
+            return fallback_label(key)
+        response.raise_for_status()
+        return parse_label(response.json(), key) or fallback_label(key)
+
+
+label_cache = LabelCache()
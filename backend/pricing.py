@@ -0,0 +1,331 @@
+"""Columnar, NumPy-backed price table keyed by (drug, pharmacy)"""
+import heapq
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# Computed rows are N pharmacies wide, so the cache is bounded by bytes like the response cache
+PRICE_ROW_CACHE_BYTES = int(os.getenv("PRICE_ROW_CACHE_BYTES", str(128 * 1024 * 1024)))
+
+DEFAULT_BASE_PRICE = 80.0
+PHARMACY_PRICE_STEP = 15.0
+BRAND_MARKUP = 3.5
+
+CITY_MULTIPLIERS = {
+    "Mumbai": 1.2,
+    "Bangalore": 0.9,
+    "Chennai": 0.85,
+    "Pune": 0.95,
+}
+
+
+class PriceRow(NamedTuple):
+    """Per-pharmacy price columns for one drug, aligned to table columns"""
+    generic: np.ndarray
+    brand: np.ndarray
+    savings: np.ndarray
+    predicted: np.ndarray
+    trend: np.ndarray
+    confidence: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self)
+
+
+class PriceSlice(NamedTuple):
+    """Columns for the pharmacies of one request, cheapest first"""
+    order: np.ndarray
+    generic: np.ndarray
+    brand: np.ndarray
+    savings: np.ndarray
+    predicted: np.ndarray
+    trend: np.ndarray
+    confidence: np.ndarray
+    rating: np.ndarray
+    review_count: np.ndarray
+
+
+def _round2(values: np.ndarray) -> np.ndarray:
+    return np.round(values, 2)
+
+
+class PharmacyColumns(NamedTuple):
+    """Pharmacy attributes as aligned arrays plus the id -> column map, published together"""
+    col: Dict[int, int]
+    ids: np.ndarray
+    multiplier: np.ndarray
+    live: np.ndarray
+    rating: np.ndarray
+    review_count: np.ndarray
+
+
+class PriceTable:
+    """
+    Pharmacy attributes live in one set of column arrays; each drug owns a
+    `PriceRow` of the same width. Rows are computed in one vectorized pass
+    the first time a drug is priced and then reused, so a comparison is a
+    dict lookup plus fancy-indexing on the requested pharmacy columns.
+    Rows live in an LRU bounded by `max_row_bytes`, so arbitrary drug names
+    cannot grow it without limit.
+
+    Explicit prices (`set_price`) override the pricing model for a single
+    (drug, pharmacy) cell and survive row recomputation. `forecasts` maps
+    drug -> pharmacy_id -> (predicted, trend, confidence), as published by
+    the forecaster; cells without one predict their current price with
+    zero confidence.
+
+    Writes come from the event loop while endpoints read from the
+    threadpool. Pharmacy changes replace the `PharmacyColumns` whole, and
+    each cached row keeps the columns it was computed against, so readers
+    never index one with the other's width. Every invalidation bumps a
+    generation, and a row computed across one is served but not cached.
+    """
+
+    def __init__(self, pharmacies: Iterable[dict] = (), base_prices: Optional[Dict[str, float]] = None,
+                 forecasts: Optional[Dict[str, Dict[int, Tuple[float, int, float]]]] = None,
+                 max_row_bytes: int = PRICE_ROW_CACHE_BYTES):
+        self.base_prices = {k.lower(): v for k, v in (base_prices or {}).items()}
+        self.forecasts = forecasts if forecasts is not None else {}
+        self._columns = PharmacyColumns(
+            col={}, ids=np.zeros(0, dtype=np.int64), multiplier=np.zeros(0), live=np.zeros(0, dtype=bool),
+            rating=np.zeros(0), review_count=np.zeros(0, dtype=np.int64)
+        )
+        self.max_row_bytes = max_row_bytes
+        self._rows: "OrderedDict[str, Tuple[PharmacyColumns, PriceRow]]" = OrderedDict()
+        self._row_bytes = 0
+        self._generation = 0
+        # Endpoints in the threadpool share the LRU
+        self._rows_lock = threading.Lock()
+        self._overrides: Dict[str, Dict[int, float]] = {}
+        self.add_pharmacies(pharmacies)
+
+    def add_pharmacies(self, pharmacies: Iterable[dict]):
+        columns = self._columns
+        pharmacies = [p for p in pharmacies if p["id"] not in columns.col]
+        if not pharmacies:
+            return
+        start = len(columns.ids)
+        ids = np.array([p["id"] for p in pharmacies], dtype=np.int64)
+        self._columns = PharmacyColumns(
+            col={**columns.col, **{pharmacy["id"]: start + offset for offset, pharmacy in enumerate(pharmacies)}},
+            ids=np.concatenate([columns.ids, ids]),
+            multiplier=np.concatenate([
+                columns.multiplier,
+                np.array([CITY_MULTIPLIERS.get(p["city"], 1.0) for p in pharmacies])
+            ]),
+            live=np.concatenate([columns.live, np.ones(len(pharmacies), dtype=bool)]),
+            rating=np.concatenate([columns.rating, np.round(4.0 + (ids % 10) / 10, 1)]),
+            review_count=np.concatenate([columns.review_count, 50 + ids * 23]),
+        )
+        self._forget_rows()
+
+    def add_pharmacy(self, pharmacy: dict):
+        self.add_pharmacies([pharmacy])
+
+    def update_pharmacy(self, pharmacy: dict):
+        columns = self._columns
+        col = columns.col.get(pharmacy["id"])
+        if col is None:
+            self.add_pharmacy(pharmacy)
+            return
+        multiplier = columns.multiplier.copy()
+        multiplier[col] = CITY_MULTIPLIERS.get(pharmacy["city"], 1.0)
+        self._columns = columns._replace(multiplier=multiplier)
+        self._forget_rows()
+
+    def remove_pharmacy(self, pharmacy_id: int):
+        columns = self._columns
+        col = columns.col.get(pharmacy_id)
+        if col is not None:
+            live = columns.live.copy()
+            live[col] = False
+            self._columns = columns._replace(
+                col={i: c for i, c in columns.col.items() if i != pharmacy_id}, live=live
+            )
+        for key, overrides in list(self._overrides.items()):
+            if pharmacy_id in overrides:
+                self._overrides[key] = {i: price for i, price in overrides.items() if i != pharmacy_id}
+        self._forget_rows()
+
+    def set_price(self, drug: str, pharmacy_id: int, generic_price: float):
+        """Override the modelled generic price of one (drug, pharmacy) cell"""
+        key = drug.lower()
+        # Copied rather than updated in place, since a row may be computing from the old dict
+        self._overrides[key] = {**self._overrides.get(key, {}), pharmacy_id: generic_price}
+        self._forget_row(key)
+
+    def invalidate(self, drug: str):
+        """Recompute a drug's row on next use, e.g. after its forecasts change"""
+        self._forget_row(drug.lower())
+
+    def drop_drug(self, drug: str):
+        key = drug.lower()
+        self.base_prices.pop(key, None)
+        self._overrides.pop(key, None)
+        self._forget_row(key)
+
+    def columns(self, pharmacy_ids: Iterable[int]) -> np.ndarray:
+        return self._columns_of(self._columns, pharmacy_ids)
+
+    @staticmethod
+    def _columns_of(columns: PharmacyColumns, pharmacy_ids: Iterable[int]) -> np.ndarray:
+        col = columns.col
+        return np.fromiter((col[i] for i in pharmacy_ids if i in col), dtype=np.int64)
+
+    def row(self, drug: str) -> PriceRow:
+        return self._row(drug.lower())[1]
+
+    def _row(self, key: str) -> Tuple[PharmacyColumns, PriceRow]:
+        with self._rows_lock:
+            entry = self._rows.get(key)
+            if entry is not None:
+                self._rows.move_to_end(key)
+                return entry
+            generation = self._generation
+            columns = self._columns
+        entry = (columns, self._compute_row(key, columns))
+        row = entry[1]
+        with self._rows_lock:
+            # Something was invalidated while computing, and may not be in this row
+            if self._generation != generation:
+                return entry
+            old = self._rows.pop(key, None)
+            if old is not None:
+                self._row_bytes -= old[1].nbytes
+            self._rows[key] = entry
+            self._row_bytes += row.nbytes
+            while self._row_bytes > self.max_row_bytes and len(self._rows) > 1:
+                _, (_, evicted) = self._rows.popitem(last=False)
+                self._row_bytes -= evicted.nbytes
+        return entry
+
+    def _forget_row(self, key: str):
+        with self._rows_lock:
+            self._generation += 1
+            entry = self._rows.pop(key, None)
+            if entry is not None:
+                self._row_bytes -= entry[1].nbytes
+
+    def _forget_rows(self):
+        with self._rows_lock:
+            self._generation += 1
+            self._rows.clear()
+            self._row_bytes = 0
+
+    def stats(self) -> dict:
+        return {"rows": len(self._rows), "row_bytes": self._row_bytes, "max_row_bytes": self.max_row_bytes}
+
+    def _compute_row(self, key: str, columns: PharmacyColumns) -> PriceRow:
+        base = self.base_prices.get(key, DEFAULT_BASE_PRICE)
+        generic = _round2(base * columns.multiplier + columns.ids * PHARMACY_PRICE_STEP)
+        for pharmacy_id, price in self._overrides.get(key, {}).items():
+            col = columns.col.get(pharmacy_id)
+            if col is not None:
+                generic[col] = price
+        brand = _round2(generic * BRAND_MARKUP)
+        predicted = generic.copy()
+        trend = np.zeros(len(generic), dtype=np.int8)
+        confidence = np.zeros(len(generic))
+        # The forecaster updates its dicts in place; copying is one C call, so no write lands mid-loop
+        for pharmacy_id, (price, direction, certainty) in list(self.forecasts.get(key, {}).items()):
+            col = columns.col.get(pharmacy_id)
+            if col is not None:
+                predicted[col] = price
+                trend[col] = direction
+                confidence[col] = certainty
+        return PriceRow(
+            generic=generic,
+            brand=brand,
+            savings=_round2(brand - generic),
+            predicted=predicted,
+            trend=trend,
+            confidence=confidence,
+        )
+
+    def lookup(self, drug: str, pharmacy_ids: Iterable[int]) -> PriceSlice:
+        """Price columns for `pharmacy_ids`; `order` maps back to their input positions"""
+        columns, positions, cols, row = self._select(drug, pharmacy_ids)
+        return self._slice(columns, row, cols, positions, np.argsort(row.generic[cols], kind="stable"))
+
+    def ranked(self, drug: str, pharmacy_ids: Iterable[int], first: int = 10, chunk: int = 200) -> Iterator[PriceSlice]:
+        """
+        The same rows as `lookup`, yielded cheapest first in slices. The
+        cheapest `first` come from one argpartition. The rest come off a
+        heap `chunk` at a time, so nothing past the head is sorted until
+        the consumer asks for it.
+        """
+        columns, positions, cols, row = self._select(drug, pharmacy_ids)
+        generic = row.generic[cols]
+        n = len(cols)
+        if not n:
+            return
+        first = max(1, min(first, n))
+        head = np.argpartition(generic, first - 1)[:first] if first < n else np.arange(n)
+        head = head[np.lexsort((head, generic[head]))]
+        yield self._slice(columns, row, cols, positions, head)
+        rest = np.ones(n, dtype=bool)
+        rest[head] = False
+        rest = np.flatnonzero(rest)
+        heap = list(zip(generic[rest].tolist(), rest.tolist()))
+        heapq.heapify(heap)
+        while heap:
+            take = [heapq.heappop(heap)[1] for _ in range(min(chunk, len(heap)))]
+            yield self._slice(columns, row, cols, positions, np.array(take, dtype=np.int64))
+
+    @staticmethod
+    def _positions(columns: PharmacyColumns, ids: List[int]) -> np.ndarray:
+        col = columns.col
+        return np.fromiter((i for i, pid in enumerate(ids) if pid in col), dtype=np.int64)
+
+    def _select(self, drug: str, pharmacy_ids: Iterable[int]):
+        """(columns, positions, cols, row), all from the columns the row was computed against"""
+        ids = list(pharmacy_ids)
+        columns, row = self._row(drug.lower())
+        return columns, self._positions(columns, ids), self._columns_of(columns, ids), row
+
+    @staticmethod
+    def _slice(columns: PharmacyColumns, row: PriceRow, cols: np.ndarray, positions: np.ndarray,
+               sort: np.ndarray) -> PriceSlice:
+        cols = cols[sort]
+        return PriceSlice(
+            order=positions[sort],
+            generic=row.generic[cols],
+            brand=row.brand[cols],
+            savings=row.savings[cols],
+            predicted=row.predicted[cols],
+            trend=row.trend[cols],
+            confidence=row.confidence[cols],
+            rating=columns.rating[cols],
+            review_count=columns.review_count[cols],
+        )
+
+    def matrix(self, drugs: List[str], pharmacy_ids: Iterable[int], brand: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (positions, prices) where prices[d, j] is the price of drugs[d] at the
+        pharmacy found at pharmacy_ids[positions[j]].
+        """
+        ids = list(pharmacy_ids)
+        while True:
+            entries = [self._row(drug.lower()) for drug in drugs]
+            columns = entries[0][0] if entries else self._columns
+            # A pharmacy change between rows widens some of them; read them all again
+            if all(entry[0] is columns for entry in entries):
+                break
+        cols = self._columns_of(columns, ids)
+        prices = np.empty((len(drugs), len(cols)))
+        for d, (_, row) in enumerate(entries):
+            prices[d] = (row.brand if brand else row.generic)[cols]
+        return self._positions(columns, ids), prices
+
+    def cheapest(self, drug: str) -> Optional[Tuple[int, float]]:
+        """(pharmacy_id, generic_price) of the cheapest pharmacy for `drug`"""
+        columns, row = self._row(drug.lower())
+        if not columns.live.any():
+            return None
+        generic = np.where(columns.live, row.generic, np.inf)
+        col = int(np.argmin(generic))
+        return int(columns.ids[col]), float(generic[col])
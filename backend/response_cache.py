@@ -0,0 +1,191 @@
+"""Pre-serialized response cache with ETags and data-version invalidation"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import Request, Response
+
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_AGE = int(os.getenv("RESPONSE_CACHE_MAX_AGE", "15"))
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_TTL = 600
+
+
+class CachedBody:
+    __slots__ = ("body", "etag", "meta")
+
+    def __init__(self, body: bytes, meta: Any = None, etag: Optional[str] = None):
+        self.body = body
+        self.etag = etag or '"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.meta = meta
+
+    def response(self, request: Request, max_age: int = RESPONSE_CACHE_MAX_AGE) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": f"public, max-age={max_age}"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match == "*" or self.etag in [t.strip() for t in if_none_match.split(",")]):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+class MemoryStore:
+    """Byte-bounded LRU; endpoints run in the threadpool, so access is locked"""
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[Hashable, CachedBody]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[CachedBody]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, entry: CachedBody):
+        if len(entry.body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.body)
+            self._entries[key] = entry
+            self.size += len(entry.body)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class RedisStore:
+    """
+    Shared second tier so workers reuse each other's bodies. Entries expire
+    on a TTL; stale versions are never read because the version is part of
+    the key (see ResponseCache.shared_versions).
+    """
+
+    def __init__(self, url: str, ttl: int = REDIS_TTL):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return "medfinder:response:" + hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+    def get(self, key: Hashable) -> Optional[CachedBody]:
+        raw = self.client.get(self._key(key))
+        if raw is None:
+            return None
+        header, body = raw.split(b"\n", 1)
+        etag, meta = json.loads(header)
+        return CachedBody(body, meta, etag)
+
+    def put(self, key: Hashable, entry: CachedBody):
+        header = json.dumps([entry.etag, entry.meta]).encode()
+        self.client.set(self._key(key), header + b"\n" + entry.body, ex=self.ttl)
+
+
+class ResponseCache:
+    """
+    Responses are cached under (route, normalized params, versions of the
+    data they read). Writers `bump` the scopes they touch, such as
+    "pharmacies" or "drug:<key>", so later lookups build new keys and old
+    entries simply age out of the LRU; nothing is scanned on invalidation.
+
+    Those counters are per process, so the shared tier is keyed on
+    `shared_versions()` instead: versions every worker agrees on, such as
+    the database's data_versions, or None while this process cannot vouch
+    for them, which skips the shared tier. A body is only shared if they
+    did not move while it was built.
+    """
+
+    def __init__(self, memory: MemoryStore, shared=None,
+                 shared_versions: Callable[[], Optional[Hashable]] = lambda: None):
+        self.memory = memory
+        self.shared = shared
+        self.shared_versions = shared_versions
+        self._versions: Dict[str, int] = {}
+        self._generation = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def version(self, *scopes: str) -> Tuple[int, ...]:
+        return (self._generation,) + tuple(self._versions.get(scope, 0) for scope in scopes)
+
+    def bump(self, *scopes: str):
+        for scope in scopes:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def bump_all(self):
+        """Invalidate everything, e.g. after the catalogue is reloaded"""
+        self._generation += 1
+
+    def get_or_build(self, key: tuple, scopes: Tuple[str, ...], build: Callable[[], Tuple[bytes, Any]]) -> CachedBody:
+        """The body for `key`, a tuple of route and normalized params, built from data in `scopes`"""
+        local_key = key + (self.version(*scopes),)
+        entry = self.memory.get(local_key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        versions = self.shared_versions() if self.shared is not None else None
+        shared_key = key + (versions,)
+        if versions is not None:
+            try:
+                entry = self.shared.get(shared_key)
+            except Exception as e:
+                print(f"Shared response cache error: {e}")
+            if entry is not None:
+                self.shared_hits += 1
+                self.memory.put(local_key, entry)
+                return entry
+        self.misses += 1
+        entry = CachedBody(*build())
+        self.memory.put(local_key, entry)
+        if versions is not None and self.shared_versions() == versions:
+            try:
+                self.shared.put(shared_key, entry)
+            except Exception as e:
+                print(f"Shared response cache error: {e}")
+        return entry
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "entries": len(self.memory),
+            "bytes": self.memory.size,
+            "max_bytes": self.memory.max_bytes,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.shared_hits) / lookups, 3) if lookups else 0.0,
+            "shared_backend": "redis" if self.shared is not None else None
+        }
+
+
+def create_shared_store(url: Optional[str] = REDIS_URL):
+    if not url:
+        return None
+    try:
+        return RedisStore(url)
+    except ImportError:
+        print("REDIS_URL is set but redis-py is not installed; using the in-process cache only")
+        return None
+
+
+response_cache = ResponseCache(MemoryStore(), create_shared_store())
@@ -0,0 +1,56 @@
+"""Typed response rows and an orjson-backed response class"""
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import orjson
+from fastapi.responses import JSONResponse
+
+from metrics import span
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def render_json(content: Any) -> bytes:
+    """Serialize dicts, lists, dataclasses and numpy values straight to bytes"""
+    with span("serialization"):
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Renders with orjson. Endpoints that return an instance directly also
+    skip FastAPI's jsonable_encoder pass over the payload.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return render_json(content)
+
+
+# Plain dataclasses on purpose: orjson serializes them from __dict__,
+# while __slots__ instances take a per-field getattr path about 3x slower.
+@dataclass
+class AIPrediction:
+    predicted_price: float
+    price_trend: str
+    best_time_to_buy: str
+    confidence: float
+
+
+@dataclass
+class PharmacyPrice:
+    pharmacy_id: int
+    pharmacy_name: str
+    city: str
+    area: str
+    distance: Optional[float]
+    brand_price: Optional[float]
+    generic_price: float
+    savings_inr: float
+    stock_status: str
+    open_now: bool
+    lat: float
+    lng: float
+    rating: float
+    review_count: int
+    ai_prediction: AIPrediction
+    timestamp: str
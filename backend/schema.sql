@@ -1,90 +1,128 @@
 -- MedFinder Database Schema
+-- Applied by storage.py on startup (SQLite swaps SERIAL for INTEGER PRIMARY KEY AUTOINCREMENT).
+-- Demo seed data is inserted by the API when the drugs table is empty.
 
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
     email VARCHAR(255) UNIQUE NOT NULL,
+    name VARCHAR(255),
+    password VARCHAR(255),
     role VARCHAR(50) DEFAULT 'patient',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE TABLE drugs (
+CREATE TABLE IF NOT EXISTS drugs (
     id SERIAL PRIMARY KEY,
+    lookup_name VARCHAR(255) UNIQUE NOT NULL,
     generic_name VARCHAR(255) NOT NULL,
     brand_name VARCHAR(255),
     rxnorm_id VARCHAR(50),
     atc_code VARCHAR(50),
+    synonyms TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE TABLE pharmacies (
+CREATE TABLE IF NOT EXISTS pharmacies (
     id SERIAL PRIMARY KEY,
     name VARCHAR(255) NOT NULL,
+    city VARCHAR(255),
+    area VARCHAR(255),
     address TEXT,
     lat DECIMAL(10, 8),
     lng DECIMAL(11, 8),
     phone VARCHAR(20),
     hours JSONB,
+    is_open BOOLEAN DEFAULT TRUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE TABLE prices (
+CREATE TABLE IF NOT EXISTS prices (
     id SERIAL PRIMARY KEY,
     drug_id INTEGER REFERENCES drugs(id),
     pharmacy_id INTEGER REFERENCES pharmacies(id),
     generic_price DECIMAL(10, 2),
     brand_price DECIMAL(10, 2),
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    source VARCHAR(50)
+    source VARCHAR(50),
+    confidence DECIMAL(3, 2),
+    -- Worker process that ingested a crowd report, so it can skip its own rows when catching up
+    ingested_by VARCHAR(32)
 );
 
-CREATE TABLE searches (
+CREATE TABLE IF NOT EXISTS searches (
     id SERIAL PRIMARY KEY,
     user_id INTEGER REFERENCES users(id),
     drug_name VARCHAR(255),
+    savings DECIMAL(10, 2),
     lat DECIMAL(10, 8),
     lng DECIMAL(11, 8),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE TABLE stock_reports (
+CREATE TABLE IF NOT EXISTS stock_reports (
     id SERIAL PRIMARY KEY,
     pharmacy_id INTEGER REFERENCES pharmacies(id),
     drug_id INTEGER REFERENCES drugs(id),
     in_stock BOOLEAN,
     reported_by INTEGER REFERENCES users(id),
     confidence DECIMAL(3, 2),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    ingested_by VARCHAR(32)
 );
 
-CREATE TABLE insurers (
+CREATE TABLE IF NOT EXISTS insurers (
     id SERIAL PRIMARY KEY,
     name VARCHAR(255) NOT NULL,
+    lookup_name VARCHAR(255) UNIQUE,
+    multiplier DECIMAL(4, 2) DEFAULT 1.0,
     copay_generic DECIMAL(10, 2),
     copay_brand DECIMAL(10, 2)
 );
 
--- Indexes
-CREATE INDEX idx_prices_drug ON prices(drug_id);
-CREATE INDEX idx_prices_pharmacy ON prices(pharmacy_id);
-CREATE INDEX idx_searches_user ON searches(user_id);
-CREATE INDEX idx_pharmacies_location ON pharmacies(lat, lng);
+CREATE TABLE IF NOT EXISTS insurance_tiers (
+    tier INTEGER PRIMARY KEY,
+    copay DECIMAL(10, 2) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS price_alerts (
+    id SERIAL PRIMARY KEY,
+    user_email VARCHAR(255) NOT NULL,
+    drug_key VARCHAR(255) NOT NULL,
+    drug_name VARCHAR(255),
+    target_price DECIMAL(10, 2) NOT NULL,
+    status VARCHAR(20) DEFAULT 'active',
+    triggered_price DECIMAL(10, 2),
+    triggered_pharmacy_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    triggered_at TIMESTAMP
+);
 
--- Mock Data
-INSERT INTO drugs (generic_name, brand_name, rxnorm_id, atc_code) VALUES
-('lisinopril', 'Prinivil', '29046', 'C09AA03'),
-('atorvastatin', 'Lipitor', '83367', 'C10AA05'),
-('metformin', 'Glucophage', '6809', 'A10BA02'),
-('amlodipine', 'Norvasc', '17767', 'C08CA01'),
-('omeprazole', 'Prilosec', '7646', 'A02BC01');
+-- Bumped on every change a worker must reload (catalogue, reports, alerts, insurance)
+CREATE TABLE IF NOT EXISTS data_versions (
+    scope VARCHAR(64) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
 
-INSERT INTO pharmacies (name, address, lat, lng, phone) VALUES
-('CVS Pharmacy', '123 Main St, New York, NY', 40.7580, -73.9855, '555-0101'),
-('Walgreens', '456 Broadway, New York, NY', 40.7614, -73.9776, '555-0102'),
-('Rite Aid', '789 5th Ave, New York, NY', 40.7489, -73.9680, '555-0103'),
-('Walmart Pharmacy', '321 Park Ave, New York, NY', 40.7128, -74.0060, '555-0104');
+-- Catalogue mutations in order, replayed by /api/sync for clients holding an older cursor
+CREATE TABLE IF NOT EXISTS change_log (
+    id SERIAL PRIMARY KEY,
+    entity VARCHAR(16) NOT NULL,
+    entity_key VARCHAR(255) NOT NULL,
+    op VARCHAR(8) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Worker process that made the change, which has it in memory already
+    logged_by VARCHAR(32)
+);
 
-INSERT INTO prices (drug_id, pharmacy_id, generic_price, brand_price) VALUES
-(1, 1, 15.50, 54.25),
-(1, 2, 21.00, 58.00),
-(1, 3, 18.75, 52.50),
-(1, 4, 12.99, 49.99);
+-- Indexes
+CREATE INDEX IF NOT EXISTS idx_prices_drug ON prices(drug_id);
+CREATE INDEX IF NOT EXISTS idx_prices_pharmacy ON prices(pharmacy_id);
+CREATE INDEX IF NOT EXISTS idx_prices_timestamp ON prices(timestamp);
+CREATE INDEX IF NOT EXISTS idx_change_log_created ON change_log(created_at);
+CREATE INDEX IF NOT EXISTS idx_stock_reports_created ON stock_reports(created_at);
+CREATE INDEX IF NOT EXISTS idx_price_alerts_user ON price_alerts(user_email);
+CREATE INDEX IF NOT EXISTS idx_price_alerts_status ON price_alerts(status);
+CREATE INDEX IF NOT EXISTS idx_searches_user ON searches(user_id);
+CREATE INDEX IF NOT EXISTS idx_searches_drug ON searches(drug_name);
+CREATE INDEX IF NOT EXISTS idx_pharmacies_location ON pharmacies(lat, lng);
+CREATE INDEX IF NOT EXISTS idx_pharmacies_city ON pharmacies(city);
@@ -0,0 +1,154 @@
+"""
+Multi-worker server: one uvicorn process per CPU, all accepting on one
+listening socket, each pinned to its own core.
+
+Workers keep their own in-memory price table and rule tables, and map the
+same catalogue snapshot (see snapshot.py). The database is the shared
+store. Changes made in one worker reach the others through the version
+watcher (see versions.py), within about SYNC_INTERVAL seconds. That
+requires PostgreSQL or a file-backed SQLite database, and the same
+SECRET_KEY in every worker.
+
+    cd backend
+    python serve.py                      # one worker per available CPU
+    python serve.py --workers 4 --cpus 0-3 --port 8000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import secrets
+import signal
+import socket
+import sys
+import time
+from typing import List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# Respawn delay for a crashed worker, so a worker that dies at startup does not spin
+RESPAWN_DELAY = 1.0
+
+
+def parse_cpus(spec: Optional[str]) -> List[int]:
+    """'0-3,6' -> [0, 1, 2, 3, 6]; empty means every CPU this process may run on"""
+    if not spec:
+        return sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    if spec == "off":
+        return []
+    cpus = []
+    for part in spec.split(","):
+        low, _, high = part.partition("-")
+        cpus.extend(range(int(low), int(high or low) + 1))
+    return cpus
+
+
+def prepare_database():
+    """
+    Create and seed the schema once, so workers never race to seed an empty
+    database, and bring the catalogue snapshot up to date for them to map.
+    Alerts the stored prices already satisfy are fired here too, since each
+    worker firing them at startup would notify once per worker.
+    """
+    sys.path.insert(0, BACKEND_DIR)
+    import main
+    from snapshot import ensure_snapshot
+
+    async def run():
+        await main.db.connect()
+        try:
+            await main.prepare_database()
+            await ensure_snapshot(main.repository)
+            await main.sweep_alerts()
+        finally:
+            await main.db.close()
+
+    asyncio.run(run())
+
+
+def run_worker(sock: socket.socket, cpu: Optional[int], log_level: str):
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    sys.path.insert(0, BACKEND_DIR)
+    import uvicorn
+
+    config = uvicorn.Config("main:app", log_level=log_level, access_log=False)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(args):
+    url = os.getenv("DATABASE_URL", "sqlite:///medfinder.db")
+    if ":memory:" in url:
+        sys.exit("serve.py needs a shared database; an in-memory SQLite DATABASE_URL is private to each worker")
+    cpus = parse_cpus(args.cpus)
+    workers = args.workers or len(cpus) or os.cpu_count() or 1
+    if not os.getenv("SECRET_KEY"):
+        print("SECRET_KEY is not set; generated one for this run, so tokens will not survive a restart")
+        os.environ["SECRET_KEY"] = secrets.token_hex(32)
+    # Read by versions.py in each worker to turn on cross-worker invalidation
+    os.environ["WORKERS"] = str(workers)
+
+    # Spawned rather than forked, so no worker inherits a half-initialized event loop or thread
+    ctx = multiprocessing.get_context("spawn")
+    seeder = ctx.Process(target=prepare_database)
+    seeder.start()
+    seeder.join()
+    if seeder.exitcode != 0:
+        sys.exit("database preparation failed")
+    # Workers, including respawned ones, skip preparation and the startup alert sweep
+    os.environ["DATABASE_PREPARED"] = "1"
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+
+    def spawn(i: int):
+        cpu = cpus[i % len(cpus)] if cpus else None
+        process = ctx.Process(target=run_worker, args=(sock, cpu, args.log_level), name=f"medfinder-worker-{i}")
+        process.start()
+        return process
+
+    processes = [spawn(i) for i in range(workers)]
+    pinned = f", pinned to CPUs {[cpus[i % len(cpus)] for i in range(workers)]}" if cpus else ""
+    print(f"MedFinder serving on http://{args.host}:{args.port} with {workers} workers{pinned}")
+
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    while not stopping:
+        time.sleep(0.5)
+        for i, process in enumerate(processes):
+            if not process.is_alive() and not stopping:
+                print(f"Worker {i} (pid {process.pid}) exited with {process.exitcode}; restarting")
+                time.sleep(RESPAWN_DELAY)
+                processes[i] = spawn(i)
+
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join()
+    sock.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", "0")),
+                        help="worker processes (default: one per CPU in --cpus)")
+    parser.add_argument("--cpus", default=os.getenv("CPU_AFFINITY"),
+                        help="CPUs to pin workers to, e.g. '0-3,6', or 'off' (default: all available)")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--log-level", default="warning")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    serve(parse_args())
@@ -0,0 +1,382 @@
+"""
+Compiled, memory-mapped snapshot of the drug, pharmacy and price catalogues.
+
+Loading the catalogue from the database means decoding every row and
+rebuilding the drug index, which takes seconds for a large catalogue.
+The snapshot keeps all of it, including the frozen drug index (see
+drug_index.py), as flat arrays in one file. A worker maps that file and
+reads the arrays in place, so startup does no parsing or index building,
+and sibling workers share the same page-cache pages.
+
+The file starts with a magic string and a length-prefixed JSON header,
+followed by 64-byte aligned little-endian arrays. Strings are stored as
+an int64 offsets array plus one UTF-8 blob.
+
+A snapshot is valid for the catalogue version (see versions.py) and
+fingerprint it was built from. Price rows written after it are read from
+the database on load. The first worker to find it stale rebuilds it under
+a file lock, and serve.py does that once before starting workers.
+"""
+import asyncio
+import json
+import mmap
+import os
+import time
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from drug_index import DrugIndex, FrozenDrugIndex, Tables
+from storage import DATABASE_URL, Repository
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent rebuilds are not serialized, which is only wasteful
+    fcntl = None
+
+
+def default_snapshot_path(url: str = DATABASE_URL) -> str:
+    """Next to a SQLite database file, so each database gets its own snapshot"""
+    if url.startswith("sqlite:///"):
+        return url[len("sqlite:///"):] + ".snapshot"
+    return "catalogue.snapshot"
+
+
+# Empty disables the snapshot; in-memory SQLite databases never use one
+CATALOGUE_SNAPSHOT = os.getenv("CATALOGUE_SNAPSHOT", default_snapshot_path())
+# Rebuild once this many price rows have been written since the snapshot
+SNAPSHOT_MAX_PRICE_TAIL = int(os.getenv("SNAPSHOT_MAX_PRICE_TAIL", "100000"))
+PRICE_BATCH_SIZE = 50000
+
+MAGIC = b"MEDSNAP1"
+FORMAT_VERSION = 1
+ALIGN = 64
+INDEX_PREFIX = "index."
+
+snapshot_stats = {"maps": 0, "builds": 0, "bytes": 0, "last_map_ms": 0.0, "last_build_ms": 0.0}
+
+
+class StringTable(Sequence):
+    """Read-only sequence of strings over an offsets array and a UTF-8 blob, decoded on access"""
+
+    __slots__ = ("_offsets", "_blob")
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        self._offsets = memoryview(offsets)
+        self._blob = memoryview(blob)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+
+def pack_strings(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [s.encode() for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGN) * ALIGN
+
+
+def write_snapshot(path: str, tables: Tables, meta: dict):
+    """Write `tables` (arrays and lists of strings) to `path`, atomically replacing any old file"""
+    arrays: Dict[str, np.ndarray] = {}
+    strings = []
+    for name, value in tables.items():
+        if isinstance(value, list):
+            arrays[f"{name}.offsets"], arrays[f"{name}.blob"] = pack_strings(value)
+            strings.append(name)
+        else:
+            value = np.ascontiguousarray(value)
+            arrays[name] = value.astype(value.dtype.newbyteorder("<"), copy=False)
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "count": len(array), "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({"format": FORMAT_VERSION, "meta": meta, "strings": strings, "arrays": layout}).encode()
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    # Mapped files are never written in place; workers still reading the old one keep its inode
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp, path)
+
+
+class Snapshot:
+    """A mapped snapshot file: its metadata and zero-copy views of its tables"""
+
+    def __init__(self, meta: dict, tables: Tables, nbytes: int):
+        self.meta = meta
+        self.tables = tables
+        self.nbytes = nbytes
+
+    @classmethod
+    def open(cls, path: str) -> Optional["Snapshot"]:
+        """Map `path`, or None if it is missing or not a snapshot this version can read"""
+        try:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        if mapped[:len(MAGIC)] != MAGIC:
+            return None
+        header_length = int.from_bytes(mapped[len(MAGIC):len(MAGIC) + 8], "little")
+        header = json.loads(mapped[len(MAGIC) + 8:len(MAGIC) + 8 + header_length])
+        if header.get("format") != FORMAT_VERSION:
+            return None
+        data_start = _aligned(len(MAGIC) + 8 + header_length)
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            if spec["count"]:
+                arrays[name] = np.frombuffer(
+                    mapped, dtype=spec["dtype"], count=spec["count"], offset=data_start + spec["offset"]
+                )
+            else:
+                arrays[name] = np.empty(0, dtype=spec["dtype"])
+        tables: Tables = {}
+        for name in header["strings"]:
+            tables[name] = StringTable(arrays.pop(f"{name}.offsets"), arrays.pop(f"{name}.blob"))
+        tables.update(arrays)
+        return cls(header["meta"], tables, len(mapped))
+
+    def matches(self, fingerprint: Dict[str, int]) -> bool:
+        """Whether this snapshot still describes the database `fingerprint` was read from"""
+        built = self.meta.get("catalogue", {})
+        current = {name: value for name, value in fingerprint.items() if name != "last_price"}
+        tail = fingerprint["last_price"] - self.meta.get("last_price", 0)
+        return built == current and 0 <= tail <= SNAPSHOT_MAX_PRICE_TAIL
+
+    def drug_index(self) -> FrozenDrugIndex:
+        return FrozenDrugIndex({
+            name[len(INDEX_PREFIX):]: table for name, table in self.tables.items() if name.startswith(INDEX_PREFIX)
+        })
+
+    def pharmacies(self) -> List[dict]:
+        t = self.tables
+        return [
+            {"id": pharmacy_id, "name": t["pharmacy_name"][i], "city": t["pharmacy_city"][i],
+             "area": t["pharmacy_area"][i], "lat": lat, "lng": lng, "open": is_open}
+            for i, (pharmacy_id, lat, lng, is_open) in enumerate(zip(
+                t["pharmacy_id"].tolist(), t["pharmacy_lat"].tolist(), t["pharmacy_lng"].tolist(),
+                t["pharmacy_open"].tolist()
+            ))
+        ]
+
+    def prices(self, keys: Sequence[str]) -> List[Tuple[str, int, float]]:
+        t = self.tables
+        return [
+            (keys[drug], pharmacy_id, price)
+            for drug, pharmacy_id, price in zip(
+                t["price_drug"].tolist(), t["price_pharmacy"].tolist(), t["price_value"].tolist()
+            )
+        ]
+
+
+class SnapshotDrugs(MutableMapping):
+    """
+    The drug catalogue mapping (lookup name -> info dict) over snapshot
+    tables. An entry is decoded the first time it is read and kept, so
+    callers get the same dict back. Writes and deletes land in the
+    overlay, and new keys iterate after the snapshot's, in insertion order.
+    """
+
+    def __init__(self, snapshot: Snapshot, index: FrozenDrugIndex):
+        self._index = index
+        self._generic: Sequence[str] = snapshot.tables["drug_generic"]
+        self._brand: Sequence[str] = snapshot.tables["drug_brand"]
+        self._details: Sequence[str] = snapshot.tables["drug_details"]
+        self._entries: Dict[str, dict] = {}
+        self._added: Dict[str, None] = {}
+        self._removed: Set[str] = set()
+
+    def _position(self, key: str) -> Optional[int]:
+        # Only str keys can be bisected against the snapshot's sorted keys; dict lookups accept anything
+        if not isinstance(key, str) or key in self._removed:
+            return None
+        return self._index.position(key)
+
+    def __getitem__(self, key: str) -> dict:
+        info = self._entries.get(key)
+        if info is not None:
+            return info
+        position = self._position(key)
+        if position is None:
+            raise KeyError(key)
+        rxnorm, atc, synonyms = json.loads(self._details[position])
+        info = self._entries[key] = {
+            "generic": self._generic[position], "brand": self._brand[position],
+            "rxnorm": rxnorm, "atc": atc, "synonyms": synonyms
+        }
+        return info
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries or self._position(key) is not None
+
+    def __setitem__(self, key: str, info: dict):
+        if self._index.position(key) is None:
+            self._added[key] = None
+        self._removed.discard(key)
+        self._entries[key] = info
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        self._entries.pop(key, None)
+        if key in self._added:
+            del self._added[key]
+        else:
+            self._removed.add(key)
+
+    def __iter__(self) -> Iterator[str]:
+        removed = self._removed
+        for key in self._index.keys:
+            if key not in removed:
+                yield key
+        yield from list(self._added)
+
+    def __len__(self) -> int:
+        return len(self._index) - len(self._removed) + len(self._added)
+
+    def names(self) -> Iterator[Tuple[str, str, str]]:
+        """(key, generic, brand) in iteration order, read from the string tables without caching entries"""
+        entries = self._entries
+        removed = self._removed
+        for position, key in enumerate(self._index.keys):
+            info = entries.get(key)
+            if info is not None:
+                yield key, info["generic"], info["brand"]
+            elif key not in removed:
+                yield key, self._generic[position], self._brand[position]
+        for key in list(self._added):
+            info = entries[key]
+            yield key, info["generic"], info["brand"]
+
+
+class Catalogue(NamedTuple):
+    drugs: MutableMapping
+    pharmacies: List[dict]
+    prices: List[Tuple[str, int, float]]
+    drug_index: DrugIndex
+
+
+def compile_catalogue(drugs: Dict[str, dict], pharmacies: List[dict], prices: List[tuple]) -> Tables:
+    """Snapshot tables for a catalogue as loaded from the repository"""
+    index = DrugIndex(drugs).freeze()
+    keys = index["keys"]
+    positions = {key: i for i, key in enumerate(keys)}
+    infos = [drugs[key] for key in keys]
+    prices = [(positions[drug], pharmacy_id, price) for drug, pharmacy_id, price in prices if drug in positions]
+    return {
+        **{INDEX_PREFIX + name: table for name, table in index.items()},
+        "drug_generic": [info["generic"] for info in infos],
+        "drug_brand": [info["brand"] for info in infos],
+        "drug_details": [json.dumps([info["rxnorm"], info["atc"], info.get("synonyms", [])]) for info in infos],
+        "pharmacy_id": np.array([p["id"] for p in pharmacies], dtype=np.int64),
+        "pharmacy_name": [p["name"] for p in pharmacies],
+        "pharmacy_city": [p["city"] for p in pharmacies],
+        "pharmacy_area": [p["area"] for p in pharmacies],
+        "pharmacy_lat": np.array([p["lat"] for p in pharmacies], dtype=np.float64),
+        "pharmacy_lng": np.array([p["lng"] for p in pharmacies], dtype=np.float64),
+        "pharmacy_open": np.array([p["open"] for p in pharmacies], dtype=bool),
+        "price_drug": np.array([row[0] for row in prices], dtype=np.int32),
+        "price_pharmacy": np.array([row[1] for row in prices], dtype=np.int64),
+        "price_value": np.array([row[2] for row in prices], dtype=np.float64),
+    }
+
+
+async def catalogue_fingerprint(repository: Repository) -> Dict[str, int]:
+    versions = await repository.load_versions()
+    return {
+        "version": versions.get("catalogue", 0),
+        **await repository.catalogue_fingerprint()
+    }
+
+
+async def build_snapshot(repository: Repository, path: str, fingerprint: Dict[str, int]):
+    """
+    Write a snapshot of the current catalogue. `fingerprint` must be read
+    before the rows: a change landing in between then only makes the file
+    look older than it is, and it gets rebuilt again.
+    """
+    start = time.perf_counter()
+    drugs = await repository.load_drugs()
+    pharmacies = await repository.load_pharmacies()
+    prices = await repository.load_prices()
+    # Compiled off the event loop, so a worker rebuilding after a catalogue change keeps serving
+    tables = await asyncio.to_thread(compile_catalogue, drugs, pharmacies, prices)
+    meta = {
+        "catalogue": {name: value for name, value in fingerprint.items() if name != "last_price"},
+        "last_price": fingerprint["last_price"],
+        "built_at": time.time(),
+    }
+    await asyncio.to_thread(write_snapshot, path, tables, meta)
+    snapshot_stats["builds"] += 1
+    snapshot_stats["last_build_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+
+def snapshot_enabled(path: str = CATALOGUE_SNAPSHOT) -> bool:
+    # An in-memory database is private to one process and has no identity to key a file on
+    return bool(path) and ":memory:" not in DATABASE_URL
+
+
+async def ensure_snapshot(repository: Repository, path: str = CATALOGUE_SNAPSHOT) -> Optional[Snapshot]:
+    """Map the snapshot at `path`, rebuilding it first if it no longer matches the database"""
+    if not snapshot_enabled(path):
+        return None
+    fingerprint = await catalogue_fingerprint(repository)
+    snapshot = Snapshot.open(path)
+    if snapshot is None or not snapshot.matches(fingerprint):
+        with open(f"{path}.lock", "a") as lock:
+            if fcntl is not None:
+                await asyncio.to_thread(fcntl.flock, lock.fileno(), fcntl.LOCK_EX)
+            try:
+                # Another worker may have rebuilt it while this one waited for the lock
+                snapshot = Snapshot.open(path)
+                if snapshot is None or not snapshot.matches(fingerprint):
+                    await build_snapshot(repository, path, fingerprint)
+                    snapshot = Snapshot.open(path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+    return snapshot
+
+
+async def read_catalogue(repository: Repository, path: str = CATALOGUE_SNAPSHOT) -> Catalogue:
+    """The catalogue and its drug index, mapped from the snapshot when enabled, else loaded row by row"""
+    snapshot = await ensure_snapshot(repository, path)
+    if snapshot is None:
+        drugs = await repository.load_drugs()
+        return Catalogue(drugs, await repository.load_pharmacies(), await repository.load_prices(), DrugIndex(drugs))
+
+    start = time.perf_counter()
+    index = snapshot.drug_index()
+    prices = snapshot.prices(index.keys)
+    # Prices written since the snapshot, oldest first, so the latest per cell wins
+    after = snapshot.meta["last_price"]
+    while True:
+        rows = await repository.price_observations(after, PRICE_BATCH_SIZE)
+        prices.extend((drug, pharmacy_id, price) for _, drug, pharmacy_id, price, _ in rows)
+        if len(rows) < PRICE_BATCH_SIZE:
+            break
+        after = rows[-1][0]
+    catalogue = Catalogue(SnapshotDrugs(snapshot, index), snapshot.pharmacies(), prices, DrugIndex(base=index))
+    snapshot_stats["maps"] += 1
+    snapshot_stats["bytes"] = snapshot.nbytes
+    snapshot_stats["last_map_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return catalogue
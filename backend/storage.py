@@ -0,0 +1,684 @@
+"""Pooled async database access and the repository the API reads and writes through"""
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///medfinder.db")
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "4"))
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+
+# Hot queries. Both backends cache a prepared statement per connection keyed
+# by SQL text (sqlite3 `cached_statements`, asyncpg `statement_cache_size`),
+# so keeping these as fixed strings is what keeps them prepared.
+SELECT_DRUGS = (
+    "SELECT id, lookup_name, generic_name, brand_name, rxnorm_id, atc_code, synonyms FROM drugs ORDER BY id"
+)
+SELECT_PHARMACIES = "SELECT id, name, city, area, lat, lng, is_open FROM pharmacies ORDER BY id"
+SELECT_LATEST_PRICES = """
+    SELECT d.lookup_name, p.pharmacy_id, p.generic_price
+    FROM prices p
+    JOIN drugs d ON d.id = p.drug_id
+    WHERE p.id IN (SELECT MAX(id) FROM prices GROUP BY drug_id, pharmacy_id)
+"""
+SELECT_CATALOGUE_FINGERPRINT = """
+    SELECT (SELECT COUNT(*) FROM drugs) AS drugs, (SELECT MAX(id) FROM drugs) AS last_drug,
+           (SELECT COUNT(*) FROM pharmacies) AS pharmacies, (SELECT MAX(id) FROM pharmacies) AS last_pharmacy,
+           (SELECT MAX(id) FROM prices) AS last_price
+"""
+SELECT_PRICE_OBSERVATIONS = """
+    SELECT p.id, d.lookup_name, p.pharmacy_id, p.generic_price, p.timestamp
+    FROM prices p JOIN drugs d ON d.id = p.drug_id
+    WHERE p.id > ? AND p.generic_price IS NOT NULL
+    ORDER BY p.id
+    LIMIT ?
+"""
+SELECT_PRICE_REPORTS_AFTER = """
+    SELECT p.id, p.pharmacy_id, d.lookup_name, p.generic_price AS value, p.confidence,
+           p.timestamp AS created_at, p.ingested_by
+    FROM prices p JOIN drugs d ON d.id = p.drug_id
+    WHERE p.source = 'crowd' AND p.id > ? AND p.timestamp >= ?
+    ORDER BY p.id
+"""
+SELECT_STOCK_REPORTS_AFTER = """
+    SELECT s.id, s.pharmacy_id, d.lookup_name, s.in_stock AS value, s.confidence, s.created_at, s.ingested_by
+    FROM stock_reports s JOIN drugs d ON d.id = s.drug_id
+    WHERE s.id > ? AND s.created_at >= ?
+    ORDER BY s.id
+"""
+BUMP_VERSION = (
+    "INSERT INTO data_versions (scope, version) VALUES (?, 1) "
+    "ON CONFLICT (scope) DO UPDATE SET version = data_versions.version + 1 RETURNING version"
+)
+SELECT_SYNC_CURSOR = """
+    SELECT (SELECT MAX(id) FROM change_log) AS last_change,
+           (SELECT MIN(id) FROM change_log WHERE created_at > ?) AS pending_change,
+           (SELECT MAX(id) FROM prices) AS last_price,
+           (SELECT MIN(id) FROM prices WHERE timestamp > ?) AS pending_price
+"""
+SELECT_CHANGES = "SELECT id, entity, entity_key, op FROM change_log WHERE id > ? ORDER BY id LIMIT ?"
+SELECT_CHANGE_IDS = "SELECT id, created_at, logged_by FROM change_log WHERE id > ? ORDER BY id LIMIT ?"
+SELECT_PRICED_CELLS = """
+    SELECT p.id, d.lookup_name, p.pharmacy_id
+    FROM prices p JOIN drugs d ON d.id = p.drug_id
+    WHERE p.id > ?
+    ORDER BY p.id
+    LIMIT ?
+"""
+INSERT_CHANGE = "INSERT INTO change_log (entity, entity_key, op, logged_by) VALUES (?, ?, ?, ?)"
+# Columns added to tables that already existed in earlier releases. CREATE TABLE IF NOT EXISTS
+# leaves an existing table alone, so databases created before a column was added get it here.
+ADDED_COLUMNS = [
+    ("users", "name", "VARCHAR(255)"),
+    ("users", "password", "VARCHAR(255)"),
+    ("drugs", "lookup_name", "VARCHAR(255)"),
+    ("drugs", "synonyms", "TEXT"),
+    ("pharmacies", "city", "VARCHAR(255)"),
+    ("pharmacies", "area", "VARCHAR(255)"),
+    ("pharmacies", "is_open", "BOOLEAN DEFAULT TRUE"),
+    ("prices", "confidence", "DECIMAL(3, 2)"),
+    ("prices", "ingested_by", "VARCHAR(32)"),
+    ("stock_reports", "ingested_by", "VARCHAR(32)"),
+    ("change_log", "logged_by", "VARCHAR(32)"),
+    ("searches", "savings", "DECIMAL(10, 2)"),
+    ("insurers", "lookup_name", "VARCHAR(255)"),
+    ("insurers", "multiplier", "DECIMAL(4, 2) DEFAULT 1.0"),
+]
+# Run after a column above is added: backfill it and give it the constraint CREATE TABLE would have
+COLUMN_BACKFILLS = {
+    ("drugs", "lookup_name"): [
+        "UPDATE drugs SET lookup_name = LOWER(generic_name) WHERE lookup_name IS NULL",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_drugs_lookup_name ON drugs(lookup_name)",
+    ],
+    ("pharmacies", "city"): ["UPDATE pharmacies SET city = '' WHERE city IS NULL"],
+    ("pharmacies", "area"): ["UPDATE pharmacies SET area = '' WHERE area IS NULL"],
+    ("insurers", "lookup_name"): [
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_insurers_lookup_name ON insurers(lookup_name)",
+    ],
+}
+SELECT_USER = "SELECT email, name, password, role FROM users WHERE email = ?"
+SELECT_DRUG_ID = "SELECT id FROM drugs WHERE lookup_name = ?"
+INSERT_PRICE = (
+    "INSERT INTO prices (drug_id, pharmacy_id, generic_price, source, confidence, ingested_by) VALUES (?, ?, ?, ?, ?, ?)"
+)
+INSERT_STOCK_REPORT = (
+    "INSERT INTO stock_reports (pharmacy_id, drug_id, in_stock, reported_by, confidence, ingested_by) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+
+class Executor(ABC):
+    """Statements on the database, whether through a pool or inside an open transaction"""
+
+    dialect = ""
+
+    @abstractmethod
+    async def fetch(self, sql: str, *args) -> List[Dict[str, Any]]:
+        ...
+
+    async def fetchrow(self, sql: str, *args) -> Optional[Dict[str, Any]]:
+        rows = await self.fetch(sql, *args)
+        return rows[0] if rows else None
+
+    @abstractmethod
+    async def execute(self, sql: str, *args):
+        ...
+
+    @abstractmethod
+    async def executemany(self, sql: str, rows: Iterable[Sequence]):
+        ...
+
+
+class Database(Executor):
+    """Minimal async interface shared by the SQLite and PostgreSQL pools"""
+
+    @abstractmethod
+    async def connect(self):
+        ...
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+    @abstractmethod
+    async def executescript(self, script: str):
+        ...
+
+    @abstractmethod
+    def transaction(self) -> AsyncIterator[Executor]:
+        """`async with db.transaction() as tx:` runs tx's statements on one connection, committed together"""
+
+    @abstractmethod
+    async def columns(self, table: str) -> Set[str]:
+        """Column names of `table`, empty if it does not exist"""
+
+
+class SQLiteTransaction(Executor):
+    """Statements on one pooled sqlite3 connection inside an open transaction"""
+
+    dialect = "sqlite"
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    async def fetch(self, sql: str, *args) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(SQLiteDatabase._fetch, self._conn, sql, args)
+
+    async def execute(self, sql: str, *args):
+        return await asyncio.to_thread(lambda: self._conn.execute(sql, args).fetchall())
+
+    async def executemany(self, sql: str, rows: Iterable[Sequence]):
+        rows = list(rows)
+        await asyncio.to_thread(lambda: self._conn.executemany(sql, rows))
+
+
+class SQLiteDatabase(Database):
+    """
+    A fixed pool of sqlite3 connections driven from worker threads.
+
+    `sqlite:///:memory:` becomes a named shared-cache database so every
+    pooled connection sees the same data; it lives as long as the pool.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(self, path: str, pool_size: int = DATABASE_POOL_SIZE):
+        if path == ":memory:":
+            self._target = f"file:medfinder-{uuid.uuid4().hex}?mode=memory&cache=shared"
+            # Shared-cache memory databases lock per table; one writer avoids SQLITE_LOCKED
+            pool_size = 1
+        else:
+            self._target = f"file:{path}"
+        self.pool_size = pool_size
+        self._pool: Optional[asyncio.Queue] = None
+        self._connections: List[sqlite3.Connection] = []
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._target, uri=True, check_same_thread=False,
+            cached_statements=256, isolation_level=None, timeout=10,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        if "mode=memory" not in self._target:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    async def connect(self):
+        if self._pool is not None:
+            return
+        self._pool = asyncio.Queue()
+        for _ in range(self.pool_size):
+            conn = await asyncio.to_thread(self._open)
+            self._connections.append(conn)
+            self._pool.put_nowait(conn)
+
+    async def close(self):
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
+        self._pool = None
+
+    async def _run(self, fn, *args):
+        conn = await self._pool.get()
+        try:
+            return await asyncio.to_thread(fn, conn, *args)
+        finally:
+            self._pool.put_nowait(conn)
+
+    @staticmethod
+    def _fetch(conn: sqlite3.Connection, sql: str, args: tuple):
+        return [dict(row) for row in conn.execute(sql, args).fetchall()]
+
+    @staticmethod
+    def _executemany(conn: sqlite3.Connection, sql: str, rows: list):
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(sql, rows)
+
+    async def fetch(self, sql: str, *args) -> List[Dict[str, Any]]:
+        return await self._run(self._fetch, sql, args)
+
+    async def execute(self, sql: str, *args):
+        return await self._run(lambda conn: conn.execute(sql, args).fetchall())
+
+    async def executemany(self, sql: str, rows: Iterable[Sequence]):
+        await self._run(self._executemany, sql, list(rows))
+
+    async def executescript(self, script: str):
+        script = script.replace("SERIAL PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT")
+        await self._run(lambda conn: conn.executescript(script))
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[Executor]:
+        conn = await self._pool.get()
+        try:
+            # IMMEDIATE takes the write lock up front, so a later statement cannot fail with SQLITE_BUSY
+            await asyncio.to_thread(conn.execute, "BEGIN IMMEDIATE")
+            try:
+                yield SQLiteTransaction(conn)
+            except BaseException:
+                conn.rollback()
+                raise
+            await asyncio.to_thread(conn.commit)
+        finally:
+            self._pool.put_nowait(conn)
+
+    async def columns(self, table: str) -> Set[str]:
+        return {row["name"] for row in await self.fetch("SELECT name FROM pragma_table_info(?)", table)}
+
+
+class PostgresTransaction(Executor):
+    """Statements on one acquired asyncpg connection inside `conn.transaction()`"""
+
+    dialect = "postgresql"
+
+    def __init__(self, conn, translate):
+        self._conn = conn
+        self._sql = translate
+
+    async def fetch(self, sql: str, *args) -> List[Dict[str, Any]]:
+        return [dict(row) for row in await self._conn.fetch(self._sql(sql), *args)]
+
+    async def execute(self, sql: str, *args):
+        return await self._conn.fetch(self._sql(sql), *args)
+
+    async def executemany(self, sql: str, rows: Iterable[Sequence]):
+        await self._conn.executemany(self._sql(sql), list(rows))
+
+
+class PostgresDatabase(Database):
+    """asyncpg pool; `?` placeholders are rewritten to `$n` once per statement"""
+
+    dialect = "postgresql"
+
+    def __init__(self, url: str, pool_size: int = DATABASE_POOL_SIZE):
+        self.url = url
+        self.pool_size = pool_size
+        self._pool = None
+        self._translated: Dict[str, str] = {}
+
+    def _sql(self, sql: str) -> str:
+        translated = self._translated.get(sql)
+        if translated is None:
+            counter = iter(range(1, sql.count("?") + 1))
+            translated = re.sub(r"\?", lambda _: f"${next(counter)}", sql)
+            self._translated[sql] = translated
+        return translated
+
+    async def connect(self):
+        import asyncpg
+
+        if self._pool is None:
+            self._pool = await asyncpg.create_pool(self.url, min_size=1, max_size=self.pool_size)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def fetch(self, sql: str, *args) -> List[Dict[str, Any]]:
+        return [dict(row) for row in await self._pool.fetch(self._sql(sql), *args)]
+
+    async def execute(self, sql: str, *args):
+        return await self._pool.fetch(self._sql(sql), *args)
+
+    async def executemany(self, sql: str, rows: Iterable[Sequence]):
+        await self._pool.executemany(self._sql(sql), list(rows))
+
+    async def executescript(self, script: str):
+        async with self._pool.acquire() as conn:
+            await conn.execute(script)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[Executor]:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                yield PostgresTransaction(conn, self._sql)
+
+    async def columns(self, table: str) -> Set[str]:
+        rows = await self.fetch(
+            "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = ?",
+            table
+        )
+        return {row["column_name"] for row in rows}
+
+
+def _epoch(value) -> float:
+    """Seconds since the epoch for a UTC timestamp column (string on SQLite, datetime on PostgreSQL)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def create_database(url: str = DATABASE_URL) -> Database:
+    if url.startswith("sqlite:///"):
+        return SQLiteDatabase(url[len("sqlite:///"):])
+    if url.startswith(("postgresql://", "postgres://")):
+        return PostgresDatabase(url)
+    raise ValueError(f"Unsupported DATABASE_URL: {url}")
+
+
+class Repository:
+    """Catalogue, user and price persistence on top of a `Database`"""
+
+    def __init__(self, db: Database):
+        self.db = db
+        # Tags the rows this process writes, so it can tell them from other workers' rows
+        self.worker_id = uuid.uuid4().hex[:16]
+
+    async def init_schema(self):
+        # Columns first: the schema's indexes may cover columns an older table lacks
+        await self.add_missing_columns()
+        with open(SCHEMA_PATH) as f:
+            await self.db.executescript(f.read())
+
+    async def add_missing_columns(self):
+        """Bring tables created by an earlier schema.sql up to date with ADDED_COLUMNS"""
+        existing: Dict[str, Set[str]] = {}
+        for table, column, definition in ADDED_COLUMNS:
+            if table not in existing:
+                existing[table] = await self.db.columns(table)
+            if not existing[table] or column in existing[table]:
+                continue
+            try:
+                async with self.db.transaction() as tx:
+                    await tx.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                    for sql in COLUMN_BACKFILLS.get((table, column), []):
+                        await tx.execute(sql)
+            except Exception:
+                # Another worker starting alongside this one may have added it first
+                if column not in await self.db.columns(table):
+                    raise
+            existing[table].add(column)
+
+    async def needs_seed(self) -> bool:
+        return await self.db.fetchrow("SELECT id FROM drugs LIMIT 1") is None
+
+    async def seed(self, drugs: Dict[str, dict], pharmacies: List[dict], users: Dict[str, dict]):
+        """Insert the demo catalogue into an empty database; user passwords must already be hashed"""
+        if not await self.needs_seed():
+            return
+        await self.db.executemany(
+            "INSERT INTO drugs (lookup_name, generic_name, brand_name, rxnorm_id, atc_code, synonyms) VALUES (?, ?, ?, ?, ?, ?)",
+            [(key.lower(), info["generic"], info["brand"], info["rxnorm"], info["atc"], json.dumps(info.get("synonyms", [])))
+             for key, info in drugs.items()]
+        )
+        await self.db.executemany(
+            "INSERT INTO pharmacies (id, name, city, area, lat, lng, is_open) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(p["id"], p["name"], p["city"], p["area"], p["lat"], p["lng"], p["open"]) for p in pharmacies]
+        )
+        if self.db.dialect == "postgresql":
+            await self.db.execute("SELECT setval('pharmacies_id_seq', (SELECT MAX(id) FROM pharmacies))")
+        await self.db.executemany(
+            "INSERT INTO users (email, name, password, role) VALUES (?, ?, ?, ?) ON CONFLICT (email) DO NOTHING",
+            [(email, u["name"], u["password"], u["role"]) for email, u in users.items()]
+        )
+
+    async def seed_insurance(self, insurers: List[tuple], tiers: Dict[int, float]):
+        """Insert default (lookup_name, name, multiplier) insurers and tier copays into empty tables"""
+        if await self.db.fetchrow("SELECT tier FROM insurance_tiers LIMIT 1"):
+            return
+        await self.db.executemany("INSERT INTO insurance_tiers (tier, copay) VALUES (?, ?)", list(tiers.items()))
+        for lookup_name, name, multiplier in insurers:
+            await self.upsert_insurer(lookup_name, name, multiplier)
+
+    async def load_insurance(self) -> Tuple[Dict[str, float], Dict[int, float]]:
+        insurers = {row["name"]: float(row["multiplier"])
+                    for row in await self.db.fetch("SELECT name, multiplier FROM insurers WHERE multiplier IS NOT NULL")}
+        tiers = {row["tier"]: float(row["copay"]) for row in await self.db.fetch("SELECT tier, copay FROM insurance_tiers")}
+        return insurers, tiers
+
+    async def upsert_insurer(self, lookup_name: str, name: str, multiplier: float):
+        await self.db.execute(
+            "INSERT INTO insurers (name, lookup_name, multiplier) VALUES (?, ?, ?) "
+            "ON CONFLICT (lookup_name) DO UPDATE SET name = excluded.name, multiplier = excluded.multiplier",
+            name, lookup_name, multiplier
+        )
+
+    async def upsert_tier(self, tier: int, copay: float):
+        await self.db.execute(
+            "INSERT INTO insurance_tiers (tier, copay) VALUES (?, ?) ON CONFLICT (tier) DO UPDATE SET copay = excluded.copay",
+            tier, copay
+        )
+
+    async def load_drugs(self) -> Dict[str, dict]:
+        return {
+            row["lookup_name"]: {
+                "generic": row["generic_name"],
+                "brand": row["brand_name"],
+                "rxnorm": row["rxnorm_id"],
+                "atc": row["atc_code"],
+                "synonyms": json.loads(row["synonyms"] or "[]")
+            }
+            for row in await self.db.fetch(SELECT_DRUGS)
+        }
+
+    @staticmethod
+    def _pharmacy(row: dict) -> dict:
+        return {
+            "id": row["id"],
+            "name": row["name"],
+            "city": row["city"],
+            "area": row["area"],
+            "lat": float(row["lat"]),
+            "lng": float(row["lng"]),
+            "open": bool(row["is_open"])
+        }
+
+    async def load_pharmacies(self) -> List[dict]:
+        return [self._pharmacy(row) for row in await self.db.fetch(SELECT_PHARMACIES)]
+
+    async def load_prices(self) -> List[tuple]:
+        """Latest (drug lookup_name, pharmacy_id, generic_price) per cell"""
+        return [
+            (row["lookup_name"], row["pharmacy_id"], float(row["generic_price"]))
+            for row in await self.db.fetch(SELECT_LATEST_PRICES)
+        ]
+
+    async def catalogue_fingerprint(self) -> Dict[str, int]:
+        """Row counts and last ids of the catalogue tables, which a recreated database will not repeat"""
+        row = await self.db.fetchrow(SELECT_CATALOGUE_FINGERPRINT)
+        return {name: int(value or 0) for name, value in row.items()}
+
+    async def price_observations(self, after_id: int, limit: int) -> List[tuple]:
+        """(id, drug lookup_name, pharmacy_id, generic_price, epoch seconds) price rows past `after_id`"""
+        return [
+            (row["id"], row["lookup_name"], row["pharmacy_id"], float(row["generic_price"]), _epoch(row["timestamp"]))
+            for row in await self.db.fetch(SELECT_PRICE_OBSERVATIONS, after_id, limit)
+        ]
+
+    async def insert_prices(self, rows: List[tuple], ingested_by: Optional[str] = None):
+        """Bulk insert (drug_id, pharmacy_id, generic_price, source, confidence) rows, tagged with the ingesting worker"""
+        await self.db.executemany(INSERT_PRICE, [(*row, ingested_by) for row in rows])
+
+    async def insert_reports(self, price_rows: List[tuple], stock_rows: List[tuple], ingested_by: Optional[str] = None):
+        """
+        insert_prices rows and (pharmacy_id, drug_id, in_stock, reported_by,
+        confidence) stock rows in one transaction, so a failed batch leaves
+        nothing behind to duplicate when it is retried.
+        """
+        async with self.db.transaction() as tx:
+            if price_rows:
+                await tx.executemany(INSERT_PRICE, [(*row, ingested_by) for row in price_rows])
+            if stock_rows:
+                await tx.executemany(INSERT_STOCK_REPORT, [(*row, ingested_by) for row in stock_rows])
+
+    async def reports_after(self, kind: str, after_id: int, since: float) -> List[tuple]:
+        """(id, pharmacy_id, drug, value, confidence, created_at, ingested_by) crowd reports past `after_id`, newer than `since`"""
+        sql = SELECT_PRICE_REPORTS_AFTER if kind == "price" else SELECT_STOCK_REPORTS_AFTER
+        return [
+            (row["id"], row["pharmacy_id"], row["lookup_name"], float(row["value"]),
+             float(row["confidence"] or 0.5), _epoch(row["created_at"]), row["ingested_by"])
+            for row in await self.db.fetch(sql, after_id, self._timestamp(since))
+        ]
+
+    def _timestamp(self, epoch: float):
+        """A timestamp column parameter for epoch seconds, in the form the dialect compares correctly"""
+        value = datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+        return value.strftime("%Y-%m-%d %H:%M:%S") if self.db.dialect == "sqlite" else value
+
+    async def insert_searches(self, rows: List[tuple]):
+        """Bulk insert (drug_name, savings, lat, lng) rows"""
+        await self.db.executemany("INSERT INTO searches (drug_name, savings, lat, lng) VALUES (?, ?, ?, ?)", rows)
+
+    async def search_totals(self) -> List[dict]:
+        return await self.db.fetch(
+            "SELECT drug_name AS drug_key, COUNT(*) AS searches, COUNT(savings) AS priced, AVG(savings) AS avg_savings "
+            "FROM searches GROUP BY drug_name"
+        )
+
+    async def insert_alert(self, user_email: str, drug_key: str, drug_name: str, target_price: float) -> int:
+        rows = await self.db.execute(
+            "INSERT INTO price_alerts (user_email, drug_key, drug_name, target_price) VALUES (?, ?, ?, ?) RETURNING id",
+            user_email, drug_key, drug_name, target_price
+        )
+        return rows[0][0]
+
+    async def load_active_alerts(self) -> List[dict]:
+        return await self.db.fetch(
+            "SELECT id, user_email, drug_key, drug_name, target_price FROM price_alerts WHERE status = 'active'"
+        )
+
+    async def alerts_for_user(self, user_email: str) -> List[dict]:
+        return await self.db.fetch(
+            "SELECT id, drug_key, drug_name, target_price, status, triggered_price, triggered_pharmacy_id "
+            "FROM price_alerts WHERE user_email = ? ORDER BY id",
+            user_email
+        )
+
+    async def mark_alerts_triggered(self, rows: List[tuple]):
+        """Bulk update from (triggered_price, triggered_pharmacy_id, id) rows"""
+        await self.db.executemany(
+            "UPDATE price_alerts SET status = 'triggered', triggered_price = ?, triggered_pharmacy_id = ?, "
+            "triggered_at = CURRENT_TIMESTAMP WHERE id = ?",
+            rows
+        )
+
+    async def bump_version(self, scope: str) -> int:
+        """Increment a data scope's version and return the new value"""
+        return (await self.db.fetchrow(BUMP_VERSION, scope))["version"]
+
+    async def load_versions(self) -> Dict[str, int]:
+        return {row["scope"]: row["version"] for row in await self.db.fetch("SELECT scope, version FROM data_versions")}
+
+    async def log_change(self, tx: Executor, entity: str, key, op: str):
+        """
+        Record an admin mutation ("drug" or "pharmacy", lookup name or id,
+        "upsert" or "delete") for delta sync, in the mutation's transaction
+        so the log never misses or invents a change.
+        """
+        await tx.execute(INSERT_CHANGE, entity, str(key), op, self.worker_id)
+
+    async def sync_cursor(self, settled_before: float) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """
+        ((change id, price id) written before `settled_before`, latest (change id, price id)).
+        Rows past the settled ids may not have reached every worker's memory yet.
+        """
+        cutoff = self._timestamp(settled_before)
+        row = await self.db.fetchrow(SELECT_SYNC_CURSOR, cutoff, cutoff)
+        latest = (int(row["last_change"] or 0), int(row["last_price"] or 0))
+        settled = (
+            int(row["pending_change"]) - 1 if row["pending_change"] is not None else latest[0],
+            int(row["pending_price"]) - 1 if row["pending_price"] is not None else latest[1]
+        )
+        return settled, latest
+
+    async def changes_since(self, after_id: int, limit: int) -> List[tuple]:
+        """(id, entity, key, op) change log rows past `after_id`"""
+        return [
+            (row["id"], row["entity"], row["entity_key"], row["op"])
+            for row in await self.db.fetch(SELECT_CHANGES, after_id, limit)
+        ]
+
+    async def change_ids_since(self, after_id: int, limit: int) -> List[tuple]:
+        """(id, created_at, logged by this worker) of change log rows past `after_id`"""
+        return [
+            (row["id"], _epoch(row["created_at"]), row["logged_by"] == self.worker_id)
+            for row in await self.db.fetch(SELECT_CHANGE_IDS, after_id, limit)
+        ]
+
+    async def priced_cells_since(self, after_id: int, limit: int) -> List[tuple]:
+        """(id, drug lookup_name, pharmacy_id) of price rows past `after_id`"""
+        return [
+            (row["id"], row["lookup_name"], row["pharmacy_id"])
+            for row in await self.db.fetch(SELECT_PRICED_CELLS, after_id, limit)
+        ]
+
+    async def get_user(self, email: str) -> Optional[dict]:
+        return await self.db.fetchrow(SELECT_USER, email)
+
+    async def user_passwords(self) -> List[dict]:
+        return await self.db.fetch("SELECT email, password FROM users")
+
+    async def set_password(self, email: str, password_hash: str):
+        await self.db.execute("UPDATE users SET password = ? WHERE email = ?", password_hash, email)
+
+    async def drug_id(self, key: str) -> Optional[int]:
+        row = await self.db.fetchrow(SELECT_DRUG_ID, key.lower())
+        return row["id"] if row else None
+
+    async def upsert_drug(self, key: str, info: dict):
+        async with self.db.transaction() as tx:
+            await tx.execute(
+                """
+                INSERT INTO drugs (lookup_name, generic_name, brand_name, rxnorm_id, atc_code, synonyms)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (lookup_name) DO UPDATE SET
+                    generic_name = excluded.generic_name, brand_name = excluded.brand_name,
+                    rxnorm_id = excluded.rxnorm_id, atc_code = excluded.atc_code, synonyms = excluded.synonyms
+                """,
+                key.lower(), info["generic"], info["brand"], info["rxnorm"], info["atc"],
+                json.dumps(info.get("synonyms", []))
+            )
+            await self.log_change(tx, "drug", key.lower(), "upsert")
+
+    async def delete_drug(self, key: str):
+        """Delete a drug with its price and stock rows; all or nothing"""
+        async with self.db.transaction() as tx:
+            row = await tx.fetchrow(SELECT_DRUG_ID, key.lower())
+            if row is None:
+                return
+            await tx.execute("DELETE FROM prices WHERE drug_id = ?", row["id"])
+            await tx.execute("DELETE FROM stock_reports WHERE drug_id = ?", row["id"])
+            await tx.execute("DELETE FROM drugs WHERE id = ?", row["id"])
+            await self.log_change(tx, "drug", key.lower(), "delete")
+
+    async def insert_pharmacy(self, data: dict) -> int:
+        async with self.db.transaction() as tx:
+            rows = await tx.execute(
+                "INSERT INTO pharmacies (name, city, area, lat, lng, is_open) VALUES (?, ?, ?, ?, ?, ?) RETURNING id",
+                data["name"], data["city"], data["area"], data["lat"], data["lng"], data["open"]
+            )
+            await self.log_change(tx, "pharmacy", rows[0][0], "upsert")
+        return rows[0][0]
+
+    async def update_pharmacy(self, pharmacy: dict):
+        async with self.db.transaction() as tx:
+            await tx.execute(
+                "UPDATE pharmacies SET name = ?, city = ?, area = ?, lat = ?, lng = ?, is_open = ? WHERE id = ?",
+                pharmacy["name"], pharmacy["city"], pharmacy["area"], pharmacy["lat"], pharmacy["lng"],
+                pharmacy["open"], pharmacy["id"]
+            )
+            await self.log_change(tx, "pharmacy", pharmacy["id"], "upsert")
+
+    async def delete_pharmacy(self, pharmacy_id: int):
+        """Delete a pharmacy with its price and stock rows; all or nothing"""
+        async with self.db.transaction() as tx:
+            await tx.execute("DELETE FROM prices WHERE pharmacy_id = ?", pharmacy_id)
+            await tx.execute("DELETE FROM stock_reports WHERE pharmacy_id = ?", pharmacy_id)
+            await tx.execute("DELETE FROM pharmacies WHERE id = ?", pharmacy_id)
+            await self.log_change(tx, "pharmacy", pharmacy_id, "delete")
+
+
+db = create_database()
+repository = Repository(db)
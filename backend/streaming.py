@@ -0,0 +1,92 @@
+"""NDJSON / Server-Sent Events framing and live price and stock updates for open streams"""
+import asyncio
+import os
+from typing import Any, Dict, Set, Tuple
+
+from responses import render_json
+
+STREAM_FIRST = int(os.getenv("STREAM_FIRST", "10"))
+STREAM_CHUNK = int(os.getenv("STREAM_CHUNK", "200"))
+# How long a live stream stays open after its results are sent
+STREAM_LIVE_SECONDS = float(os.getenv("STREAM_LIVE_SECONDS", "300"))
+STREAM_HEARTBEAT = 15.0
+STREAM_QUEUE_SIZE = 1000
+
+NDJSON = "ndjson"
+SSE = "sse"
+MEDIA_TYPES = {NDJSON: "application/x-ndjson", SSE: "text/event-stream"}
+
+
+def frame(fmt: str, event: str, data: Any) -> bytes:
+    """One NDJSON line ({"event": ..., **data}) or one SSE message"""
+    if fmt == SSE:
+        return b"event: " + event.encode() + b"\ndata: " + render_json(data) + b"\n\n"
+    return render_json({"event": event, **data}) + b"\n"
+
+
+def heartbeat(fmt: str) -> bytes:
+    # SSE comments are ignored by EventSource; NDJSON readers skip blank lines
+    return b": keepalive\n\n" if fmt == SSE else b"\n"
+
+
+async def next_update(queue: asyncio.Queue, timeout: float):
+    """queue.get() with a timeout, or None; asyncio.wait, unlike wait_for, never swallows a cancel"""
+    getter = asyncio.ensure_future(queue.get())
+    try:
+        await asyncio.wait({getter}, timeout=timeout)
+    finally:
+        if not getter.done():
+            getter.cancel()
+    return getter.result() if getter.done() and not getter.cancelled() else None
+
+
+class UpdateHub:
+    """
+    Fans aggregated report updates out to open price streams. Each stream
+    subscribes to one drug with a bounded queue. `publish` only touches
+    the queues of drugs that changed, and a stream too slow to drain its
+    queue loses its oldest updates rather than growing without bound.
+    """
+
+    def __init__(self, queue_size: int = STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._queues: Dict[str, Set[asyncio.Queue]] = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, drug: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._queues.setdefault(drug, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, drug: str, queue: asyncio.Queue):
+        queues = self._queues.get(drug)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._queues[drug]
+
+    def publish(self, price_updates: Dict[Tuple[int, str], float], stock_updates: Dict[Tuple[int, str], str]):
+        """Same signature as ReportIngestor subscribers; queues (pharmacy_id, field, value) per drug"""
+        if not self._queues:
+            return
+        for updates, field in ((price_updates, "generic_price"), (stock_updates, "stock_status")):
+            for (pharmacy_id, drug), value in updates.items():
+                for queue in self._queues.get(drug, ()):
+                    if queue.full():
+                        queue.get_nowait()
+                        self.dropped += 1
+                    queue.put_nowait((pharmacy_id, field, value))
+                    self.published += 1
+
+    def stats(self) -> dict:
+        return {
+            "streams": sum(len(queues) for queues in self._queues.values()),
+            "drugs": len(self._queues),
+            "published": self.published,
+            "dropped": self.dropped
+        }
+
+
+update_hub = UpdateHub()
+
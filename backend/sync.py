@@ -0,0 +1,133 @@
+"""
+Versioned delta sync for clients that cache the catalogue locally.
+
+A client installs from a bundle: compact columns of drugs, pharmacies
+in its city and prices of the drugs it tracks, plus a cursor. After that
+it sends the cursor back and gets only what changed since. A cursor is
+"<change id>.<price id>". The first half is a position in the change_log
+table, where the admin endpoints record every drug and pharmacy
+mutation. The second half is a position in the prices table, whose rows
+are the price reports.
+
+Each worker applies other workers' changes to its in-memory catalogue
+some time after the rows are written (see versions.py), and ids can
+commit out of order. So a worker's cursor stops before the first row it
+has not applied (see AppliedRows), and a delta only covers rows up to
+it. Later rows are sent by a later sync, from whichever worker serves
+it. A client may get a row again; that is harmless because every entry
+is an upsert or a delete of current state.
+"""
+import gzip
+import os
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+from fastapi import Request, Response
+
+from pricing import PriceTable
+from response_cache import RESPONSE_CACHE_MAX_AGE, CachedBody
+from snapshot import SnapshotDrugs
+
+# A client further behind than this many change or price rows reinstalls from a bundle
+SYNC_MAX_CHANGES = int(os.getenv("SYNC_MAX_CHANGES", "20000"))
+SYNC_SETTLE_SECONDS = float(os.getenv("SYNC_SETTLE_SECONDS", "3"))
+SYNC_MAX_DRUGS = 50
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+UPSERT, DELETE = "upsert", "delete"
+PHARMACY_FIELDS = ("id", "name", "city", "area", "lat", "lng", "open")
+
+
+class Cursor(NamedTuple):
+    change_id: int
+    price_id: int
+
+    def __str__(self) -> str:
+        return f"{self.change_id}.{self.price_id}"
+
+    @classmethod
+    def parse(cls, text: str) -> "Cursor":
+        change_id, _, price_id = text.partition(".")
+        cursor = cls(int(change_id), int(price_id))
+        if min(cursor) < 0:
+            raise ValueError(f"Invalid sync cursor: {text!r}")
+        return cursor
+
+
+class Delta(NamedTuple):
+    """Last op per drug key and pharmacy id, and the pharmacies with new price rows per tracked drug"""
+    drugs: Dict[str, str]
+    pharmacies: Dict[int, str]
+    priced: Dict[str, Set[int]]
+
+
+def fold_changes(changes: List[tuple], cells: List[tuple], tracked: Iterable[str]) -> Delta:
+    """Collapse change log rows and priced cells (see storage.py) so only each entity's latest op is sent"""
+    drugs: Dict[str, str] = {}
+    pharmacies: Dict[int, str] = {}
+    for _, entity, key, op in changes:
+        if entity == "drug":
+            drugs[key] = op
+        else:
+            pharmacies[int(key)] = op
+    tracked = set(tracked)
+    priced: Dict[str, Set[int]] = {}
+    for _, drug, pharmacy_id in cells:
+        if drug in tracked:
+            priced.setdefault(drug, set()).add(pharmacy_id)
+    return Delta(drugs, pharmacies, priced)
+
+
+def drug_names(drugs: Mapping[str, dict]) -> Iterator[Tuple[str, str, str]]:
+    """(key, generic, brand) of every drug, without decoding full entries of a mapped catalogue"""
+    if isinstance(drugs, SnapshotDrugs):
+        return drugs.names()
+    # list() copies in one step, so a concurrent admin write cannot break the iteration
+    return ((key, info["generic"], info["brand"]) for key, info in list(drugs.items()))
+
+
+def drug_columns(names: Iterable[Tuple[str, str, str]]) -> dict:
+    keys: List[str] = []
+    generic: List[str] = []
+    brand: List[str] = []
+    for key, generic_name, brand_name in names:
+        keys.append(key)
+        generic.append(generic_name)
+        brand.append(brand_name)
+    return {"key": keys, "generic": generic, "brand": brand}
+
+
+def pharmacy_columns(pharmacies: List[dict]) -> dict:
+    return {field: [pharmacy[field] for pharmacy in pharmacies] for field in PHARMACY_FIELDS}
+
+
+def price_columns(table: PriceTable, drug: str, pharmacy_ids: List[int]) -> dict:
+    """Generic and brand prices of `drug` at `pharmacy_ids`, cheapest first"""
+    prices = table.lookup(drug, pharmacy_ids)
+    return {
+        "pharmacy_id": np.asarray(pharmacy_ids, dtype=np.int64)[prices.order],
+        "generic": prices.generic,
+        "brand": prices.brand
+    }
+
+
+def accepts_gzip(request: Request) -> bool:
+    return "gzip" in request.headers.get("accept-encoding", "").lower()
+
+
+def encode_body(body: bytes, gzipped: bool) -> Tuple[bytes, Optional[str]]:
+    """(body, Content-Encoding); bodies under GZIP_MIN_BYTES are not worth compressing"""
+    if gzipped and len(body) >= GZIP_MIN_BYTES:
+        # mtime=0 keeps the output, and so the ETag, stable for the same payload
+        return gzip.compress(body, GZIP_LEVEL, mtime=0), "gzip"
+    return body, None
+
+
+def sync_response(request: Request, entry: CachedBody, max_age: int = RESPONSE_CACHE_MAX_AGE) -> Response:
+    """entry.response with the Content-Encoding kept in its meta"""
+    response = entry.response(request, max_age)
+    response.headers["Vary"] = "Accept-Encoding"
+    if entry.meta and response.status_code == 200:
+        response.headers["Content-Encoding"] = entry.meta
+    return response
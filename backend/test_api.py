@@ -3,6 +3,9 @@ import json
 
 BASE_URL = "http://localhost:8000/api"
 
+# Manual script against a running server, not a pytest module
+__test__ = False
+
 def test_api():
     print("🧪 Testing MedFinder API\n")
     
@@ -33,8 +36,9 @@ def test_api():
     print(f"   ✓ Status: {response.status_code}")
     print(f"   Found {len(result['data']['prices'])} pharmacies")
     for price in result['data']['prices'][:2]:
-        print(f"   - {price['pharmacy_name']}: ${price['generic_price']}")
+        print(f"   - {price['pharmacy_name']}: ₹{price['generic_price']}")
     print()
+    pharmacy_id = result['data']['prices'][0]['pharmacy_id']
     
     # Test 4: Nearby pharmacies
     print("4. Nearby Pharmacies...")
@@ -47,23 +51,22 @@ def test_api():
     print("5. Insurance Estimate (Tier-Based)...")
     response = requests.post(
         f"{BASE_URL}/insurance/estimate",
-        params={"drug_name": "Lisinopril", "insurer": "Blue Cross", "generic_price": 15.50, "tier": 1}
+        params={"drug_name": "Lisinopril", "insurer": "Star Health", "generic_price": 95.0, "tier": 1}
     )
     result = response.json()
     print(f"   ✓ Status: {response.status_code}")
     print(f"   Tier: {result['data']['tier']}")
-    print(f"   Copay: ${result['data']['copay']}")
-    print(f"   Final Cost: ${result['data']['final_cost']}\n")
+    print(f"   Copay: ₹{result['data']['copay']}")
+    print(f"   Final Cost: ₹{result['data']['final_cost']}\n")
     
     # Test 6: Crowdsourced price report
     print("6. Crowdsourced Price Report...")
     response = requests.post(
         f"{BASE_URL}/prices/report",
         json={
-            "pharmacy_name": "CVS Pharmacy",
-            "drug_name": "Lisinopril 10mg",
-            "price": 15.50,
-            "user_trust_score": 0.8
+            "pharmacy_id": pharmacy_id,
+            "drug_name": "Lisinopril",
+            "price": 90.0
         }
     )
     result = response.json()
@@ -71,14 +74,16 @@ def test_api():
     print(f"   Confidence: {result['data']['confidence']}")
     print(f"   Status: {result['data']['status']}\n")
     
-    # Test 6: Admin stats
-    print("7. Admin Statistics..."))
-    response = requests.get(f"{BASE_URL}/admin/stats")
+    # Test 7: Admin stats
+    print("7. Admin Statistics...")
+    login = requests.post(f"{BASE_URL}/auth/login", json={"email": "admin@medfinder.com", "password": "admin123"})
+    token = login.json()['data']['access_token']
+    response = requests.get(f"{BASE_URL}/admin/stats", headers={"Authorization": f"Bearer {token}"})
     result = response.json()
     print(f"   ✓ Status: {response.status_code}")
     print(f"   Total Searches: {result['data']['total_searches']}")
     print(f"   Active Users: {result['data']['active_users']}")
-    print(f"   Avg Savings: {result['data']['avg_savings']}%\n")
+    print(f"   Avg Savings: ₹{result['data']['avg_savings_per_search']}\n")
     
     print("✅ All tests passed!")
     print("\n🎉 MedFinder API is working perfectly!")
@@ -0,0 +1,7 @@
+"""Backend modules import each other as top-level modules, as they do when run from backend/"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# Modules that open the database at import time get a private in-memory one
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
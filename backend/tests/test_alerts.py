@@ -0,0 +1,126 @@
+"""AlertBook matching and AlertNotifier delivery, persistence order, retries and bounds"""
+import asyncio
+from typing import List
+
+from alerts import TRIGGERED, Alert, AlertBook, AlertSink, AlertNotifier
+
+
+def alert(alert_id: int, target: float, drug: str = "metformin") -> Alert:
+    return Alert(id=alert_id, user_email="u@x", drug=drug, drug_name=drug.title(), target_price=target)
+
+
+def test_observe_fires_every_alert_at_or_above_the_price():
+    book = AlertBook()
+    for alert_id, target in [(1, 10.0), (2, 15.0), (3, 12.0), (4, 12.0)]:
+        book.add(alert(alert_id, target))
+    book.add(alert(5, 50.0, drug="lisinopril"))
+    assert book.observe("metformin", 16.0) == []
+    fired = book.observe("metformin", 12.0, pharmacy_id=7)
+    assert [a.id for a in fired] == [3, 4, 2]
+    assert all(a.status == TRIGGERED and a.triggered_price == 12.0 and a.triggered_pharmacy_id == 7 for a in fired)
+    assert sorted(book.alerts) == [1, 5]
+
+
+def test_fired_alerts_leave_the_book():
+    book = AlertBook()
+    book.add(alert(1, 10.0))
+    assert [a.id for a in book.observe("metformin", 9.0)] == [1]
+    assert book.observe("metformin", 1.0) == []
+    assert book.drugs() == [] and len(book) == 0
+    assert book.observe("omeprazole", 1.0) == []
+
+
+class FlakySink(AlertSink):
+    """Fails the first `failures` deliveries, then records what it is given"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.batches: List[List[int]] = []
+
+    async def deliver(self, notifications: List[dict]):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("sink down")
+        self.batches.append([n["id"] for n in notifications])
+
+
+def fired(*ids: int) -> List[Alert]:
+    return [Alert(id=i, user_email="u@x", drug="metformin", drug_name="Metformin", target_price=10.0,
+                  status="triggered", triggered_price=9.0) for i in ids]
+
+
+def notifier_with(sink: AlertSink, **kwargs):
+    persisted: List[int] = []
+    dropped: List[int] = []
+
+    async def on_flush(alerts):
+        persisted.extend(alert.id for alert in alerts)
+
+    notifier = AlertNotifier(sink, on_flush=on_flush, on_drop=lambda alerts: dropped.extend(a.id for a in alerts),
+                             **kwargs)
+    return notifier, persisted, dropped
+
+
+def flush(notifier: AlertNotifier):
+    """Run one flush pass; True if it succeeded"""
+    try:
+        asyncio.run(notifier.flush())
+        return True
+    except ConnectionError:
+        return False
+
+
+def test_alerts_are_persisted_only_after_delivery():
+    sink = FlakySink(failures=1)
+    notifier, persisted, _ = notifier_with(sink)
+    notifier.enqueue(fired(1, 2))
+    assert not flush(notifier)
+    assert persisted == [] and notifier.stats()["pending"] == 2
+    assert flush(notifier)
+    assert sink.batches == [[1, 2]] and persisted == [1, 2]
+    assert notifier.stats()["pending"] == 0
+
+
+def test_failed_persistence_is_retried_without_redelivery():
+    sink = FlakySink()
+    calls = []
+
+    async def on_flush(alerts):
+        calls.append([alert.id for alert in alerts])
+        if len(calls) == 1:
+            raise ConnectionError("database down")
+
+    notifier = AlertNotifier(sink, on_flush=on_flush)
+    notifier.enqueue(fired(1))
+    assert not flush(notifier)
+    assert notifier.stats()["unsaved"] == 1
+    assert flush(notifier)
+    assert sink.batches == [[1]]
+    assert calls == [[1], [1]]
+    assert notifier.stats()["unsaved"] == 0
+
+
+def test_batches_the_sink_keeps_refusing_are_handed_back():
+    notifier, persisted, dropped = notifier_with(FlakySink(failures=10), max_attempts=3)
+    notifier.enqueue(fired(1, 2))
+    results = [flush(notifier) for _ in range(3)]
+    assert results == [False, False, True]
+    assert dropped == [1, 2] and persisted == []
+    assert notifier.stats()["pending"] == 0 and notifier.stats()["dropped"] == 2
+
+
+def test_pending_alerts_are_bounded():
+    notifier, _, dropped = notifier_with(FlakySink(failures=10), max_pending=3)
+    notifier.enqueue(fired(1, 2))
+    notifier.enqueue(fired(3, 4, 5))
+    assert notifier.stats()["pending"] == 3
+    assert dropped == [4, 5]
+
+
+def test_unpersisted_alerts_are_those_pending_or_unsaved():
+    sink = FlakySink()
+    notifier = AlertNotifier(sink)
+    notifier.enqueue(fired(1, 2))
+    assert set(notifier.unpersisted()) == {1, 2}
+    flush(notifier)
+    assert notifier.unpersisted() == {}
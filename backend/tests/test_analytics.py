@@ -0,0 +1,70 @@
+"""SearchAnalytics memory bounds and dashboard snapshot"""
+import asyncio
+import time
+
+from analytics import ACTIVE_USER_WINDOW, SearchAnalytics, SpaceSaving
+
+
+class NullRepository:
+    async def insert_searches(self, rows):
+        pass
+
+
+def test_space_saving_reports_what_it_evicts():
+    sketch = SpaceSaving(capacity=2)
+    assert sketch.add("a", 5) is None
+    assert sketch.add("b", 1) is None
+    assert sketch.add("c") == "b"
+    assert sketch.top(2) == [("a", 5), ("c", 2)]
+
+
+def test_savings_are_kept_only_for_tracked_drugs():
+    analytics = SearchAnalytics(NullRepository())
+    analytics.drugs = SpaceSaving(capacity=3)
+    for i in range(50):
+        analytics.record(f"drug-{i}", savings=float(i))
+    asyncio.run(analytics.flush())
+    assert set(analytics.savings) <= set(analytics.drugs.counts)
+    assert len(analytics.savings) <= 3
+    assert analytics.snapshot["total_searches"] == 50
+    assert analytics.snapshot["total_savings_inr"] == sum(range(50))
+
+
+def test_clients_outside_the_window_expire_from_the_front():
+    analytics = SearchAnalytics(NullRepository())
+    now = time.time()
+    analytics._events.extend([
+        (now - ACTIVE_USER_WINDOW - 10, "metformin", None, None, None, "old"),
+        (now - 60, "metformin", None, None, None, "recent"),
+        (now - 30, "metformin", None, None, None, "old"),
+    ])
+    asyncio.run(analytics.flush())
+    snapshot = analytics._build_snapshot(now)
+    # "old" was seen again inside the window, so it moved behind "recent"
+    assert list(analytics._clients) == ["recent", "old"]
+    assert snapshot["active_users"] == 2
+    assert analytics._build_snapshot(now + ACTIVE_USER_WINDOW - 45)["active_users"] == 1
+    assert list(analytics._clients) == ["old"]
+
+
+def test_stopping_mid_flush_still_writes_the_folded_events():
+    class SlowRepository:
+        def __init__(self):
+            self.rows = []
+
+        async def insert_searches(self, rows):
+            await asyncio.sleep(0.05)
+            self.rows.extend(rows)
+
+    async def scenario():
+        repository = SlowRepository()
+        analytics = SearchAnalytics(repository, flush_interval=0.01)
+        await analytics.start()
+        analytics.record("metformin")
+        # The background flush has folded the event and is inside the insert
+        await asyncio.sleep(0.03)
+        await analytics.stop()
+        return repository.rows, analytics.snapshot["total_searches"]
+
+    rows, total = asyncio.run(scenario())
+    assert len(rows) == 1 and total == 1
@@ -0,0 +1,46 @@
+"""Password verification and access tokens"""
+import pytest
+
+import auth
+from auth import TokenError, TokenSigner, hash_password_sync, verify_password_sync
+
+
+def test_hashes_verify_only_their_password():
+    stored = hash_password_sync("s3cret")
+    assert verify_password_sync("s3cret", stored)
+    assert not verify_password_sync("s3cret!", stored)
+
+
+def test_unknown_users_and_unhashed_rows_cost_the_same_scrypt_work(monkeypatch):
+    calls = []
+    real_scrypt = auth._scrypt
+
+    def counting_scrypt(password, salt, n, r, p):
+        calls.append((n, r, p))
+        return real_scrypt(password, salt, n, r, p)
+
+    monkeypatch.setattr(auth, "_scrypt", counting_scrypt)
+    stored = hash_password_sync("s3cret")
+    calls.clear()
+    assert not verify_password_sync("s3cret", None)
+    assert not verify_password_sync("s3cret", "")
+    assert not verify_password_sync("guess", stored)
+    # A plaintext row never verifies, even against its own password
+    assert not verify_password_sync("s3cret", "s3cret")
+    assert calls == [(auth.SCRYPT_N, auth.SCRYPT_R, auth.SCRYPT_P)] * 4
+
+
+def test_tokens_verify_and_tampering_is_rejected():
+    signer = TokenSigner("test-secret")
+    token = signer.issue("u@x", "user")
+    assert signer.verify(token)["sub"] == "u@x"
+    payload, _, mac = token.partition(".")
+    for forged in [f"{payload}.{mac[:-1]}", f"{payload}.{mac[:-1]}é", f"é{payload}.{mac}", payload]:
+        with pytest.raises(TokenError):
+            signer.verify(forged)
+
+
+def test_placeholder_secrets_are_refused():
+    for placeholder in auth.PLACEHOLDER_SECRETS:
+        with pytest.raises(ValueError):
+            TokenSigner(placeholder)
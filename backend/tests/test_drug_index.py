@@ -0,0 +1,64 @@
+"""DrugIndex exact and fuzzy matching, updates, and the frozen base it can layer over"""
+import pytest
+
+from drug_index import BRAND, GENERIC, SYNONYM, DrugIndex, FrozenDrugIndex
+
+DRUGS = {
+    "lisinopril": {"generic": "lisinopril", "brand": "Prinivil", "rxnorm": "29046", "atc": "C09AA03"},
+    "metformin": {"generic": "metformin", "brand": "Glucophage", "rxnorm": "6809", "atc": "A10BA02",
+                  "synonyms": ["metformin hcl"]},
+    "amlodipine": {"generic": "amlodipine", "brand": "Norvasc", "rxnorm": "17767", "atc": "C08CA01"},
+}
+
+
+def frozen_over(drugs) -> DrugIndex:
+    return DrugIndex(base=FrozenDrugIndex(DrugIndex(drugs).freeze()))
+
+
+@pytest.fixture(params=["mutable", "frozen"])
+def index(request):
+    return DrugIndex(DRUGS) if request.param == "mutable" else frozen_over(DRUGS)
+
+
+def test_resolves_generic_brand_and_synonym_names_in_text(index):
+    assert index.resolve("Rx: Metformin 500mg twice daily") == "metformin"
+    assert index.resolve("GLUCOPHAGE") == "metformin"
+    assert index.resolve("take norvasc 5 mg") == "amlodipine"
+    assert index.resolve("paracetamol") is None
+
+
+def test_matches_report_kind_and_prefer_generic(index):
+    assert index.matches("glucophage") == [("metformin", BRAND)]
+    assert index.matches("metformin hcl") == [("metformin", GENERIC)]
+    assert index.matches("metformin hcl, not glucophage")[0] == ("metformin", GENERIC)
+
+
+def test_several_drugs_resolve_in_catalogue_order(index):
+    assert [key for key, _ in index.matches("amlodipine and lisinopril")] == ["lisinopril", "amlodipine"]
+    assert index.resolve("amlodipine and lisinopril") == "lisinopril"
+
+
+def test_fuzzy_matches_misspellings(index):
+    key, name, score = index.fuzzy("metfromin 500")
+    assert (key, name) == ("metformin", "metformin")
+    assert 0.5 <= score < 1
+    assert index.fuzzy("zzzz") is None
+
+
+def test_updates_and_removals_apply_over_a_frozen_base():
+    index = frozen_over(DRUGS)
+    index.add("metformin", {**DRUGS["metformin"], "brand": "Riomet", "synonyms": []})
+    index.remove("amlodipine")
+    index.add("omeprazole", {"generic": "omeprazole", "brand": "Prilosec", "rxnorm": "7646", "atc": "A02BC01"})
+    assert index.resolve("glucophage") is None
+    assert index.resolve("riomet") == "metformin"
+    assert index.resolve("norvasc") is None
+    assert index.fuzzy("amlodipin") is None
+    assert index.matches("prilosec") == [("omeprazole", BRAND)]
+    # Re-indexed base keys keep their catalogue position
+    assert index.resolve("omeprazole or metformin or lisinopril") == "lisinopril"
+
+
+def test_synonym_kind_is_reported_for_synonym_only_names():
+    index = DrugIndex({"metformin": {**DRUGS["metformin"], "synonyms": ["dimethylbiguanide"]}})
+    assert index.matches("dimethylbiguanide") == [("metformin", SYNONYM)]
@@ -0,0 +1,256 @@
+"""Endpoints against a file-backed SQLite database, so the catalogue is mapped from its snapshot"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Runs in a fresh interpreter: main opens DATABASE_URL at import, and conftest pins this one to :memory:
+CLIENT = """
+import json, sys
+from fastapi.testclient import TestClient
+import main
+responses = []
+with TestClient(main.app, raise_server_exceptions=False) as client:
+    for method, url, body in json.load(sys.stdin):
+        response = client.request(method, url, json=body)
+        is_json = response.headers.get("content-type", "").startswith("application/json")
+        responses.append([response.status_code, response.json() if is_json else response.text])
+        # Requests after a login carry its token
+        token = is_json and (response.json().get("data") or {}).get("access_token")
+        if token:
+            client.headers["Authorization"] = f"Bearer {token}"
+# The app prints to stdout, so results go to a file
+with open(sys.argv[1], "w") as out:
+    json.dump(responses, out)
+"""
+
+
+def app_env(tmp_path, **overrides) -> dict:
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{tmp_path / 'medfinder.db'}",
+        OPENFDA_BASE_URL="http://127.0.0.1:9",
+        SECRET_KEY="test-secret",
+        ALERT_SINK=f"file:{tmp_path / 'notifications.jsonl'}",
+        PYTHONPATH=BACKEND,
+        **overrides,
+    )
+    # The default snapshot path sits next to the database file
+    env.pop("CATALOGUE_SNAPSHOT", None)
+    return env
+
+
+def call(tmp_path, *requests, **env):
+    """(status, json body) for each (method, url, body) request, in order, against one app instance"""
+    result = subprocess.run(
+        [sys.executable, "-c", CLIENT, str(tmp_path / "responses.json")], input=json.dumps(list(requests)),
+        cwd=BACKEND, env=app_env(tmp_path, **env), capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    with open(tmp_path / "responses.json") as responses:
+        return [tuple(response) for response in json.load(responses)]
+
+
+def test_unknown_drugs_are_not_server_errors_with_a_snapshot(tmp_path):
+    compare, parse, bundle, prescription, quote = call(
+        tmp_path,
+        ("GET", "/api/prices/compare?drug_name=zzqqxx", None),
+        ("POST", "/api/drugs/parse", {"drug_name": "zzqqxx"}),
+        ("GET", "/api/sync/bundle?drugs=paracetamol", None),
+        ("POST", "/api/prescriptions/compare", {"drugs": [{"drug_name": "zzqqxx"}]}),
+        ("POST", "/api/insurance/quote", {"insurer": "Star Health", "drugs": [{"drug_name": "zzqqxx"}]}),
+    )
+    assert os.path.exists(tmp_path / "medfinder.db.snapshot")
+    assert compare[0] == 404
+    assert parse[0] == 200
+    assert bundle[0] == 404
+    assert prescription[0] == 404
+    assert quote[0] == 404
+
+
+def test_search_bounds_are_validated(tmp_path):
+    near = "lat=28.6&lng=77.2"
+    rejected = [
+        f"/api/pharmacies/nearby?{near}&k=-1",
+        f"/api/pharmacies/nearby?{near}&k=0",
+        "/api/pharmacies/nearby?location=Delhi&k=-2",
+        f"/api/prices/compare?drug_name=metformin&{near}&k=-1",
+        f"/api/pharmacies/nearby?{near}&radius_km=inf",
+        f"/api/pharmacies/nearby?{near}&radius_km=nan",
+        f"/api/pharmacies/nearby?{near}&radius_km=0",
+        "/api/pharmacies/nearby?lat=nan&lng=77.2",
+        "/api/pharmacies/nearby?lat=91&lng=77.2",
+        "/api/pharmacies/nearby?lat=28.6&lng=-inf",
+    ]
+    responses = call(
+        tmp_path,
+        *(("GET", url, None) for url in rejected),
+        ("POST", "/api/prescriptions/compare", {"drugs": [{"drug_name": "metformin"}], "k": -1}),
+        ("GET", f"/api/pharmacies/nearby?{near}&radius_km=5&k=3", None),
+    )
+    assert [status for status, _ in responses[:-1]] == [422] * (len(rejected) + 1)
+    status, body = responses[-1]
+    assert status == 200 and 1 <= body["data"]["count"] <= 3
+
+
+LOGIN = ("POST", "/api/auth/login", {"email": "demo@medfinder.com", "password": "demo123"})
+
+
+def test_alert_targets_must_be_positive_and_finite(tmp_path):
+    _, *responses, (status, body) = call(
+        tmp_path,
+        LOGIN,
+        *(("POST", f"/api/alerts/create?drug_name=metformin&target_price={price}", None)
+          for price in ["nan", "inf", "-inf", "0", "-5"]),
+        ("GET", "/api/alerts/list", None),
+    )
+    assert [status for status, _ in responses] == [422] * 5
+    assert status == 200 and body["data"]["alerts"] == []
+
+
+def test_unknown_basket_drugs_are_not_priced_as_another_drug(tmp_path):
+    basket = [{"drug_name": "metformin"}, {"drug_name": "zzqqxx"}]
+    prescription, quote, known = call(
+        tmp_path,
+        ("POST", "/api/prescriptions/compare", {"drugs": basket}),
+        ("POST", "/api/insurance/quote", {"insurer": "Star Health", "drugs": basket}),
+        ("POST", "/api/prescriptions/compare", {"drugs": basket[:1]}),
+    )
+    for status, body in [prescription, quote]:
+        assert status == 404 and "zzqqxx" in body["detail"]
+    assert known[0] == 200
+
+
+def test_alert_status_comes_from_the_database_or_this_workers_unpersisted_fires(tmp_path):
+    *_, (status, body) = call(
+        tmp_path,
+        LOGIN,
+        ("POST", "/api/alerts/create?drug_name=metformin&target_price=0.01", None),
+        ("POST", "/api/alerts/create?drug_name=metformin&target_price=100000", None),
+        ("GET", "/api/alerts/list", None),
+    )
+    assert status == 200
+    by_target = {alert["target_price"]: alert for alert in body["data"]["alerts"]}
+    assert by_target[0.01]["status"] == "active" and by_target[0.01]["triggered_price"] is None
+    assert by_target[100000]["status"] == "triggered" and by_target[100000]["triggered_price"] is not None
+
+
+def notifications(tmp_path) -> list:
+    path = tmp_path / "notifications.jsonl"
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+
+def test_alerts_met_at_startup_notify_once_across_serve_workers(tmp_path):
+    _, (status, created) = call(
+        tmp_path, LOGIN, ("POST", "/api/alerts/create?drug_name=metformin&target_price=0.01", None)
+    )
+    assert status == 200 and notifications(tmp_path) == []
+    # Prices have since dropped below the target, as far as the stored alert can tell
+    with sqlite3.connect(tmp_path / "medfinder.db") as conn:
+        conn.execute("UPDATE price_alerts SET target_price = 100000 WHERE id = ?", (created["data"]["alert_id"],))
+
+    # Workers started by serve.py leave the startup sweep to it
+    call(tmp_path, DATABASE_PREPARED="1")
+    call(tmp_path, DATABASE_PREPARED="1")
+    assert notifications(tmp_path) == []
+    sweep = "import asyncio, main\nasyncio.run(main.db.connect())\nasyncio.run(main.sweep_alerts())"
+    subprocess.run([sys.executable, "-c", sweep], cwd=BACKEND, env=app_env(tmp_path), check=True,
+                   capture_output=True, timeout=120)
+    call(tmp_path, DATABASE_PREPARED="1")
+    assert [n["id"] for n in notifications(tmp_path)] == [created["data"]["alert_id"]]
+
+
+RELOAD = """
+import asyncio, sys, main
+
+async def run():
+    await main.db.connect()
+    await main.prepare_database()
+    await main.load_catalogue()
+    alert_id = await main.repository.insert_alert("demo@medfinder.com", "metformin", "Metformin", 20.0)
+    await main.load_alerts(sweep=False)
+    main.alert_notifier.enqueue(main.alert_book.observe("metformin", 10.0, 1))
+    # Another worker bumped the alerts version before this fire was persisted
+    await main.reload_alerts()
+    sys.stderr.write(repr(alert_id in main.alert_book.alerts))
+
+asyncio.run(run())
+"""
+
+
+def test_alert_reloads_do_not_rearm_fires_awaiting_persistence(tmp_path):
+    result = subprocess.run([sys.executable, "-c", RELOAD], cwd=BACKEND, env=app_env(tmp_path),
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stderr == "False"
+
+
+def test_stored_passwords_are_hashed_including_rows_from_earlier_releases(tmp_path):
+    call(tmp_path)
+    with sqlite3.connect(tmp_path / "medfinder.db") as conn:
+        conn.execute("UPDATE users SET password = 'demo123' WHERE email = 'demo@medfinder.com'")
+    (status, _), = call(tmp_path, LOGIN)
+    with sqlite3.connect(tmp_path / "medfinder.db") as conn:
+        passwords = [row[0] for row in conn.execute("SELECT password FROM users")]
+    assert status == 200
+    assert passwords and all(password.startswith("scrypt$") for password in passwords)
+
+
+ADMIN_LOGIN = ("POST", "/api/auth/login", {"email": "admin@medfinder.com", "password": "admin123"})
+
+
+def test_pharmacy_edits_that_lower_prices_fire_alerts(tmp_path):
+    *_, (_, listed) = call(tmp_path, ADMIN_LOGIN,
+                           ("POST", "/api/alerts/create?drug_name=metformin&target_price=0.01", None),
+                           ("GET", "/api/alerts/list", None))
+    current = listed["data"]["alerts"][0]["current_price"]
+    # Pharmacy 1 is the cheapest; in Chennai its price drops by 15%, below a target 10% under today's
+    target = round(15 + (current - 15) * 0.9, 2)
+    pharmacy = {"name": "Apollo Pharmacy", "city": "Chennai", "area": "T Nagar", "lat": 13.04, "lng": 80.23}
+    *_, (status, body) = call(
+        tmp_path,
+        ADMIN_LOGIN,
+        ("POST", f"/api/alerts/create?drug_name=metformin&target_price={target}", None),
+        ("PUT", "/api/admin/pharmacies/1", pharmacy),
+        ("GET", "/api/alerts/list", None),
+    )
+    assert status == 200
+    fired = {alert["target_price"]: alert for alert in body["data"]["alerts"]}[target]
+    assert fired["status"] == "triggered" and fired["triggered_pharmacy_id"] == 1
+
+
+def test_price_reports_beyond_the_price_column_are_rejected_alone(tmp_path):
+    report = {"pharmacy_id": 1, "drug_name": "metformin", "user_trust_score": 1.0}
+    (too_big, _), (status, body) = call(
+        tmp_path,
+        ("POST", "/api/prices/report", {**report, "price": 1e9}),
+        ("POST", "/api/prices/report", {**report, "price": 12.5}),
+    )
+    assert too_big == 422
+    # The client's trust score is ignored; an anonymous report gets the anonymous weight
+    assert status == 200 and body["data"]["confidence"] == 0.5
+
+
+def test_insurance_rules_must_be_finite_and_fit_their_columns(tmp_path):
+    _, *rejected, (status, body) = call(
+        tmp_path,
+        ADMIN_LOGIN,
+        *(("PUT", "/api/admin/insurers/Star Health", {"multiplier": m}) for m in [float("nan"), 100, -0.5]),
+        *(("PUT", f"/api/admin/insurance/tiers/{tier}", {"copay": copay})
+          for tier, copay in [(1, float("inf")), (1, -1), (-1, 10), (10 ** 9, 10)]),
+        ("PUT", "/api/admin/insurers/Star Health", {"multiplier": 0.7}),
+    )
+    assert [status for status, _ in rejected] == [422] * 7
+    assert status == 200 and body["data"]["multiplier"] == 0.7
+
+
+def test_unmatched_parses_are_not_counted_as_searches_for_the_fallback_drug(tmp_path):
+    parsed, _ = call(tmp_path, ("POST", "/api/drugs/parse", {"drug_name": "zzqqxx"}),
+                     ("POST", "/api/drugs/parse", {"drug_name": "metformin"}))
+    _, (status, body) = call(tmp_path, ADMIN_LOGIN, ("GET", "/api/admin/stats", None))
+    assert parsed[1]["data"]["generic_name"] == "lisinopril"
+    assert status == 200 and body["data"]["total_searches"] == 1
+    assert [row["drug"] for row in body["data"]["most_searched"]] == ["Metformin"]
@@ -0,0 +1,58 @@
+"""PharmacyIndex place lookups and nearest-neighbour queries"""
+import pytest
+
+from geo import PharmacyIndex, haversine_km
+
+PHARMACIES = [
+    {"id": 1, "name": "Apollo Pharmacy", "city": "Delhi", "area": "Connaught Place", "lat": 28.6139, "lng": 77.2090, "open": True},
+    {"id": 2, "name": "MedPlus", "city": "Delhi", "area": "Karol Bagh", "lat": 28.6519, "lng": 77.1900, "open": True},
+    {"id": 3, "name": "Apollo Pharmacy", "city": "Mumbai", "area": "Andheri", "lat": 19.1136, "lng": 72.8697, "open": True},
+    {"id": 4, "name": "Netmeds", "city": "Navi Mumbai", "area": "Vashi", "lat": 19.0771, "lng": 72.9986, "open": True},
+]
+
+
+@pytest.fixture
+def index():
+    return PharmacyIndex([dict(p) for p in PHARMACIES])
+
+
+def ids(pharmacies):
+    return [p["id"] for p in pharmacies]
+
+
+def test_search_place_matches_city_and_area_words(index):
+    assert ids(index.search_place("Delhi")) == [1, 2]
+    assert ids(index.search_place("karol bagh")) == [2]
+    assert ids(index.search_place("Mumbai")) == [3, 4]
+    assert ids(index.search_place("navi mumbai")) == [4]
+
+
+def test_search_place_matches_word_prefixes(index):
+    assert ids(index.search_place("Mum")) == [3, 4]
+    assert ids(index.search_place("conn")) == [1]
+
+
+def test_search_place_without_a_match_is_empty(index):
+    assert index.search_place("Chennai") == []
+    assert index.search_place("Delhi Andheri") == []
+    assert index.search_place("") == []
+
+
+def test_search_place_follows_updates_and_removals(index):
+    index.update({**PHARMACIES[1], "city": "Gurgaon", "area": "Sector 29"})
+    assert ids(index.search_place("Delhi")) == [1]
+    assert ids(index.search_place("gurgaon")) == [2]
+    index.remove(2)
+    assert index.search_place("gurgaon") == []
+    assert "gurgaon" not in index._place_words
+
+
+def test_nearest_orders_by_distance_and_respects_radius(index):
+    hits = index.nearest(28.62, 77.21, radius_km=10)
+    assert ids(p for _, p in hits) == [1, 2]
+    assert hits[0][0] == pytest.approx(haversine_km(28.62, 77.21, 28.6139, 77.2090))
+    assert ids(p for _, p in index.nearest(19.1, 72.9, k=1)) == [3]
+
+
+def test_by_name_returns_every_branch_of_a_chain(index):
+    assert ids(index.by_name("apollo pharmacy ")) == [1, 3]
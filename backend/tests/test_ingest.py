@@ -0,0 +1,205 @@
+"""Report aggregation: trust weighting, time decay, validation, batched flushes and catch-up"""
+import asyncio
+import time
+
+import pytest
+
+from ingest import (
+    ANONYMOUS_CONFIDENCE, MAX_REPORT_PRICE, PRICE, REPORT_HALF_LIFE, REPORT_SETTLE_SECONDS, STOCK, Aggregate, Report,
+    ReportIngestor
+)
+
+
+def report(**overrides) -> Report:
+    fields = dict(kind=PRICE, pharmacy_id=1, drug="metformin", value=10.0, confidence=0.9, reporter="r1")
+    return Report(**{**fields, **overrides})
+
+
+@pytest.mark.parametrize("weight", [0.0, -0.5, float("nan")])
+def test_aggregate_rejects_weightless_reports(weight):
+    aggregate = Aggregate()
+    aggregate.add(10.0, 1.0, 0.0)
+    with pytest.raises(ValueError):
+        aggregate.add(1000.0, weight, 0.0)
+    assert aggregate.mean == 10.0 and aggregate.reports == 1
+
+
+@pytest.mark.parametrize("bad", [dict(confidence=0.0), dict(confidence=-1.0), dict(confidence=1.5), dict(value=0.0),
+                                 dict(value=-5.0), dict(value=MAX_REPORT_PRICE * 10)])
+def test_submit_rejects_invalid_reports(bad):
+    ingestor = ReportIngestor(repository=None)
+    with pytest.raises(ValueError):
+        ingestor.submit(report(**bad))
+    assert ingestor.metrics["accepted"] == 0
+
+
+def test_replay_skips_stored_rows_without_weight_or_price():
+    ingestor = ReportIngestor(repository=None)
+    ingestor.replay(PRICE, [(1, "metformin", 10.0, 0.9, 0.0), (1, "metformin", 500.0, 0.0, 0.0),
+                            (1, "metformin", -3.0, 0.9, 0.0)])
+    ingestor.replay(STOCK, [(1, "metformin", 0.0, 0.9, 0.0)])
+    assert ingestor.prices[(1, "metformin")].mean == 10.0
+    assert ingestor.prices[(1, "metformin")].reports == 1
+    assert ingestor.stock_status(1, "metformin") == "out_of_stock"
+
+
+def test_aggregate_halves_older_weight_every_half_life():
+    aggregate = Aggregate()
+    aggregate.add(100.0, 1.0, 0.0)
+    aggregate.add(40.0, 1.0, REPORT_HALF_LIFE)
+    # The first report now weighs 0.5 against the second's 1.0
+    assert aggregate.mean == pytest.approx((100 * 0.5 + 40) / 1.5)
+    assert aggregate.weight == pytest.approx(1.5)
+
+
+def test_aggregate_weights_reports_by_trust():
+    aggregate = Aggregate()
+    aggregate.add(10.0, 0.9, 0.0)
+    aggregate.add(20.0, 0.3, 0.0)
+    assert aggregate.mean == pytest.approx((10 * 0.9 + 20 * 0.3) / 1.2)
+
+
+def test_late_reports_do_not_decay_newer_ones():
+    aggregate = Aggregate()
+    aggregate.add(10.0, 1.0, REPORT_HALF_LIFE)
+    aggregate.add(30.0, 1.0, 0.0)
+    assert aggregate.mean == pytest.approx(20.0)
+    assert aggregate.updated_at == REPORT_HALF_LIFE
+
+
+class MemoryRepository:
+    """Just what ReportIngestor writes and reads through; flushed price rows get the next id"""
+
+    def __init__(self):
+        self.prices = []
+        self.stock = []
+        self.stored = {PRICE: [], STOCK: []}
+        self.db = self
+        self.worker_id = "me"
+        self.drug_id = 1
+        # Calls to insert_reports that raise before writing anything, as a rolled-back transaction would
+        self.failures = 0
+
+    async def fetch(self, sql, *args):
+        if "FROM drugs" in sql:
+            return [{"id": self.drug_id, "lookup_name": "metformin"}]
+        if "FROM pharmacies" in sql:
+            return [{"id": pharmacy_id} for pharmacy_id in (1, 2, 3)]
+        return []
+
+    def store(self, kind, row_id, value, created_at, ingested_by="other", pharmacy_id=1):
+        self.stored[kind].append((row_id, pharmacy_id, "metformin", value, 0.9, created_at, ingested_by))
+
+    async def insert_prices(self, rows, ingested_by=None):
+        for row in rows:
+            self.prices.append(row)
+            row_id = max((stored[0] for stored in self.stored[PRICE]), default=0) + 1
+            self.store(PRICE, row_id, row[2], time.time(), ingested_by, pharmacy_id=row[1])
+
+    async def insert_reports(self, price_rows, stock_rows, ingested_by=None):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database unavailable")
+        if any(row[0] != self.drug_id for row in price_rows):
+            raise ValueError("foreign key constraint failed")
+        await self.insert_prices(price_rows, ingested_by)
+        self.stock.extend(stock_rows)
+
+    async def reports_after(self, kind, after_id, since):
+        return sorted(row for row in self.stored[kind] if row[0] > after_id and row[5] >= since)
+
+
+def test_flush_dedupes_per_reporter_and_notifies_subscribers():
+    repository = MemoryRepository()
+    ingestor = ReportIngestor(repository)
+    updates = []
+    ingestor.subscribe(lambda prices, stock: updates.append((prices, stock)))
+    batch = [
+        report(value=10.0, created_at=0.0),
+        report(value=12.0, created_at=1.0),
+        report(value=20.0, reporter="r2", created_at=1.0),
+        report(kind=STOCK, value=1.0, created_at=1.0),
+        report(drug="unknownium", created_at=1.0),
+    ]
+    asyncio.run(ingestor.flush(batch))
+    # r1's first price report wins, as it would across batches; the unknown drug is never written
+    assert sorted(row[2] for row in repository.prices) == [10.0, 20.0]
+    assert len(repository.stock) == 1
+    assert updates == [({(1, "metformin"): 15.0}, {(1, "metformin"): "in_stock"})]
+    # A repeat inside the dedupe window is dropped
+    asyncio.run(ingestor.flush([report(value=11.0, created_at=60.0)]))
+    assert len(repository.prices) == 2
+
+
+def test_a_lone_anonymous_price_report_does_not_set_the_price():
+    ingestor = ReportIngestor(MemoryRepository())
+    updates = []
+    ingestor.subscribe(lambda prices, stock: updates.append(prices))
+    asyncio.run(ingestor.flush([report(value=1.0, confidence=ANONYMOUS_CONFIDENCE)]))
+    asyncio.run(ingestor.flush([report(value=3.0, confidence=ANONYMOUS_CONFIDENCE, reporter="r2")]))
+    asyncio.run(ingestor.flush([report(pharmacy_id=2, value=5.0, confidence=0.75)]))
+    assert updates == [{}, {(1, "metformin"): 2.0}, {(2, "metformin"): 5.0}]
+
+
+def test_failed_flushes_are_retried_with_fresh_ids():
+    repository = MemoryRepository()
+    ingestor = ReportIngestor(repository, retry_delay=0.0)
+    asyncio.run(ingestor.flush([report(created_at=0.0)]))
+    # The drug was deleted and re-added under a new id; pharmacy 99 does not exist
+    repository.drug_id = 2
+    asyncio.run(ingestor.flush([report(reporter="r2", value=12.0), report(pharmacy_id=99, reporter="r3")]))
+    assert [row[:3] for row in repository.prices] == [(1, 1, 10.0), (2, 1, 12.0)]
+    assert ingestor.metrics["flush_retries"] == 1 and ingestor.metrics["dropped"] == 1
+    # Forgetting the ids on a catalogue change avoids the failed attempt altogether
+    repository.drug_id = 3
+    ingestor.forget_catalogue_ids()
+    asyncio.run(ingestor.flush([report(reporter="r4")]))
+    assert repository.prices[-1][0] == 3 and ingestor.metrics["flush_retries"] == 1
+
+
+def test_a_batch_that_keeps_failing_can_be_resubmitted():
+    repository = MemoryRepository()
+    ingestor = ReportIngestor(repository, retries=1, retry_delay=0.0)
+    repository.failures = 2
+    with pytest.raises(ConnectionError):
+        asyncio.run(ingestor.flush([report(created_at=0.0)]))
+    assert ingestor.metrics["dropped"] == 1
+    asyncio.run(ingestor.flush([report(created_at=1.0)]))
+    assert [row[2] for row in repository.prices] == [10.0]
+
+
+def test_catch_up_folds_only_rows_other_workers_stored():
+    repository = MemoryRepository()
+    ingestor = ReportIngestor(repository)
+    old = time.time() - 2 * REPORT_SETTLE_SECONDS
+    repository.store(PRICE, 1, 10.0, old)
+    repository.store(PRICE, 2, 20.0, old, pharmacy_id=2)
+    asyncio.run(ingestor.reload(0.0))
+    asyncio.run(ingestor.flush([report(pharmacy_id=3, value=30.0)]))
+    repository.store(PRICE, 4, 14.0, time.time())
+
+    prices, stock = asyncio.run(ingestor.catch_up(0.0))
+    # Neither the rows already read nor this worker's own flush are folded again
+    assert prices == {(1, "metformin"): pytest.approx(12.0)} and stock == {}
+    assert ingestor.prices[(3, "metformin")].reports == 1
+    assert asyncio.run(ingestor.catch_up(0.0)) == ({}, {})
+    assert asyncio.run(ingestor.applied_price_id(0.0)) == 4
+
+
+def test_catch_up_picks_up_rows_committed_out_of_id_order():
+    repository = MemoryRepository()
+    ingestor = ReportIngestor(repository)
+    now = time.time()
+    repository.store(PRICE, 1, 10.0, now - 2 * REPORT_SETTLE_SECONDS)
+    repository.store(PRICE, 3, 30.0, now, pharmacy_id=3)
+    asyncio.run(ingestor.reload(0.0))
+    # Row 2 may still commit, so the position stops before it; row 3 is remembered past it
+    assert asyncio.run(ingestor.applied_price_id(0.0)) == 1
+
+    repository.store(PRICE, 2, 20.0, now, pharmacy_id=2)
+    # Stored by another worker and not caught up on yet
+    assert asyncio.run(ingestor.applied_price_id(0.0)) == 1
+    prices, _ = asyncio.run(ingestor.catch_up(0.0))
+    assert prices == {(2, "metformin"): 20.0}
+    assert ingestor.prices[(3, "metformin")].reports == 1
+    assert asyncio.run(ingestor.applied_price_id(0.0)) == 3
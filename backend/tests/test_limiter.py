@@ -0,0 +1,90 @@
+"""AdaptiveLimiter admission, priority queueing, shedding and AIMD limit changes"""
+import asyncio
+
+from limiter import ADMIN, ANONYMOUS, USER, AdaptiveLimiter, RouteLimit
+
+
+def limiter(initial=2, queue_size=2, queue_timeout=1.0, min_limit=1, max_limit=8) -> AdaptiveLimiter:
+    return AdaptiveLimiter(RouteLimit(initial=initial, min_limit=min_limit, max_limit=max_limit,
+                                      queue_size=queue_size, queue_timeout=queue_timeout))
+
+
+def test_admits_up_to_the_limit():
+    route = limiter(initial=2)
+    assert route.try_acquire() and route.try_acquire()
+    assert not route.try_acquire()
+    route.release()
+    assert route.try_acquire()
+    assert route.in_flight == 2
+
+
+def test_freed_slots_go_to_the_best_waiter_first():
+    route = limiter(initial=1, queue_size=4)
+
+    async def scenario():
+        assert route.try_acquire()
+        order = []
+
+        async def wait(name, priority):
+            if await route.acquire(priority):
+                order.append(name)
+
+        waiters = [asyncio.create_task(wait(name, priority))
+                   for name, priority in [("anon", ANONYMOUS), ("user", USER), ("admin", ADMIN)]]
+        await asyncio.sleep(0)
+        for _ in range(3):
+            route.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*waiters)
+        return order
+
+    assert asyncio.run(scenario()) == ["admin", "user", "anon"]
+    # Each release handed its slot straight to a waiter
+    assert route.in_flight == 1
+
+
+def test_full_queue_sheds_the_lowest_priority():
+    route = limiter(initial=1, queue_size=2)
+
+    async def scenario():
+        route.try_acquire()
+        first = asyncio.create_task(route.acquire(ANONYMOUS))
+        second = asyncio.create_task(route.acquire(USER))
+        await asyncio.sleep(0)
+        # Same priority as the worst waiter: the arrival itself is shed
+        shed = await route.acquire(ANONYMOUS)
+        admin = asyncio.create_task(route.acquire(ADMIN))
+        await asyncio.sleep(0)
+        evicted = await first
+        route.release()
+        route.release()
+        return shed, evicted, await admin, await second
+
+    assert asyncio.run(scenario()) == (False, False, True, True)
+    assert route.metrics["shed"] == 2
+
+
+def test_waiters_time_out():
+    route = limiter(initial=1, queue_timeout=0.05)
+
+    async def scenario():
+        route.try_acquire()
+        return await route.acquire(USER)
+
+    assert asyncio.run(scenario()) is False
+    assert route.metrics["timeouts"] == 1
+    assert route.stats()["waiting"] == 0
+
+
+def test_limit_backs_off_on_latency_and_grows_under_load():
+    route = limiter(initial=4, max_limit=8)
+    route.in_flight = 4
+    for _ in range(20):
+        route._observe(0.01)
+    assert route.limit > 4
+    grown = route.limit
+    for _ in range(20):
+        route._observe(0.5)
+    assert route.limit < grown
+    assert route.metrics["decreases"] >= 1
+    assert route.limit >= 1
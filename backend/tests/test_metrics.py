@@ -0,0 +1,42 @@
+"""SamplingProfiler thresholds and dump files"""
+import os
+import time
+
+import pytest
+
+from metrics import SamplingProfiler
+
+
+def busy(seconds: float):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_a_threshold_must_be_positive(tmp_path):
+    profiler = SamplingProfiler(threshold_ms=0, out_dir=str(tmp_path))
+    for threshold in (None, 0, -5):
+        with pytest.raises(ValueError):
+            profiler.start(threshold)
+    assert not profiler.enabled
+
+
+def test_slow_requests_are_dumped_and_old_dumps_pruned(tmp_path):
+    profiler = SamplingProfiler(threshold_ms=20, out_dir=str(tmp_path), interval=0.001, max_files=2)
+    profiler.start()
+    try:
+        for i in range(4):
+            start = time.perf_counter()
+            busy(0.05)
+            profiler.finished(f"/api/slow/{i}", start, time.perf_counter())
+            time.sleep(0.002)
+        start = time.perf_counter()
+        profiler.finished("/api/fast", start, start + 0.001)
+    finally:
+        profiler.stop()
+    files = sorted(os.listdir(tmp_path))
+    assert profiler.dumps == 4
+    assert len(files) == 2
+    assert all(name.endswith(("api_slow_2.folded", "api_slow_3.folded")) for name in files)
+    with open(tmp_path / files[0]) as f:
+        assert "busy (test_metrics.py" in f.read()
@@ -0,0 +1,35 @@
+"""Image decoding ahead of hashing and OCR"""
+import io
+
+import pytest
+from PIL import Image
+
+from ocr import UnreadableImage, UnsupportedImage, image_dhash
+
+
+def write(tmp_path, data: bytes) -> str:
+    path = tmp_path / "upload"
+    path.write_bytes(data)
+    return str(path)
+
+
+def png_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.linear_gradient("L").rotate(-90).resize((64, 64)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_dhash_is_stable_for_the_same_image(tmp_path):
+    path = write(tmp_path, png_bytes())
+    assert image_dhash(path) == image_dhash(path) != 0
+
+
+def test_non_images_are_unsupported(tmp_path):
+    with pytest.raises(UnsupportedImage):
+        image_dhash(write(tmp_path, b"%PDF-1.4 not an image"))
+
+
+def test_truncated_images_are_unreadable(tmp_path):
+    data = png_bytes()
+    with pytest.raises(UnreadableImage):
+        image_dhash(write(tmp_path, data[:len(data) // 2]))
@@ -0,0 +1,16 @@
+"""OCR result cache: exact hits are served, near-duplicates only counted"""
+from ocr_cache import OCRResultCache
+
+RESULT = {"text": "Metformin 500mg twice daily", "confidence": 0.9, "timings": {}}
+
+
+def test_near_duplicates_are_counted_but_never_served(tmp_path):
+    cache = OCRResultCache(str(tmp_path))
+    cache.put("a" * 64, RESULT, phash=0b1011)
+    assert cache.get("a" * 64) == RESULT
+    # Another upload a few bits away, e.g. a different patient on the same letterhead
+    assert cache.get("b" * 64) is None
+    assert cache.record_miss(0b0011)
+    assert not cache.record_miss(2 ** 64 - 1)
+    assert cache.info()["hits"] == 1
+    assert (cache.info()["near_duplicates"], cache.info()["misses"]) == (1, 1)
@@ -0,0 +1,168 @@
+"""LabelCache against a local stub of the OpenFDA label endpoint"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from openfda import LabelCache
+
+
+class StubOpenFDA:
+    """Answers /drug/label.json with `warning` as the label's warning, or `status` when it is not 200"""
+
+    def __init__(self):
+        self.requests = 0
+        self.status = 200
+        self.warning = "v1"
+        self.delay = 0.0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(stub.delay)
+                body = json.dumps({"results": [{"warnings": [stub.warning]}]}).encode()
+                self.send_response(stub.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubOpenFDA()
+    yield server
+    server.close()
+
+
+def run(cache: LabelCache, scenario):
+    async def main():
+        try:
+            return await scenario()
+        finally:
+            await cache.close()
+    return asyncio.run(main())
+
+
+def test_concurrent_misses_share_one_request(stub):
+    stub.delay = 0.2
+    cache = LabelCache(base_url=stub.url)
+
+    async def scenario():
+        return await asyncio.gather(*[cache.get("Metformin") for _ in range(10)])
+
+    labels = run(cache, scenario)
+    assert stub.requests == 1
+    assert all(label["warnings"] == ["v1"] for label in labels)
+    assert cache.stats["misses"] == 10
+    assert cache.stats["coalesced"] == 9
+
+
+def test_fresh_entries_are_served_without_upstream_requests(stub):
+    cache = LabelCache(base_url=stub.url, ttl=60)
+
+    async def scenario():
+        await cache.get("metformin")
+        stub.warning = "v2"
+        return await cache.get("Metformin ")
+
+    assert run(cache, scenario)["warnings"] == ["v1"]
+    assert stub.requests == 1
+    assert cache.stats["hits"] == 1
+
+
+def test_expired_entries_are_refetched(stub):
+    cache = LabelCache(base_url=stub.url, ttl=0.05, stale_ttl=0)
+
+    async def scenario():
+        await cache.get("metformin")
+        stub.warning = "v2"
+        await asyncio.sleep(0.1)
+        return await cache.get("metformin")
+
+    assert run(cache, scenario)["warnings"] == ["v2"]
+    assert stub.requests == 2
+
+
+def test_stale_entry_is_served_while_one_refresh_runs(stub):
+    cache = LabelCache(base_url=stub.url, ttl=0.05, stale_ttl=60)
+
+    async def scenario():
+        await cache.get("metformin")
+        stub.warning = "v2"
+        stub.delay = 0.1
+        await asyncio.sleep(0.1)
+        stale = [await cache.get("metformin") for _ in range(3)]
+        stale_hits = cache.stats["stale_hits"]
+        await asyncio.sleep(0.3)
+        return stale, stale_hits, cache._entries["metformin"][0]
+
+    stale, stale_hits, refreshed = run(cache, scenario)
+    assert [label["warnings"] for label in stale] == [["v1"]] * 3
+    assert stale_hits == 3
+    assert refreshed["warnings"] == ["v2"]
+    assert stub.requests == 2
+
+
+def test_outage_keeps_stale_expiry_and_backs_off(stub):
+    cache = LabelCache(base_url=stub.url, ttl=0.05, stale_ttl=60, error_ttl=60)
+
+    async def scenario():
+        await cache.get("metformin")
+        _, expires_at = cache._entries["metformin"]
+        stub.status = 503
+        await asyncio.sleep(0.1)
+        await cache.get("metformin")
+        await asyncio.sleep(0.1)
+        labels = [await cache.get("metformin") for _ in range(5)]
+        return expires_at, labels
+
+    expires_at, labels = run(cache, scenario)
+    # The failed refresh neither re-stamps the stale entry nor is retried inside error_ttl
+    assert cache._entries["metformin"][1] == expires_at
+    assert stub.requests == 2
+    assert cache.stats["upstream_errors"] == 1
+    assert all(label["warnings"] == ["v1"] for label in labels)
+
+
+def test_outage_without_an_entry_caches_the_fallback_briefly(stub):
+    stub.status = 500
+    cache = LabelCache(base_url=stub.url, stale_ttl=0, error_ttl=0.05)
+
+    async def scenario():
+        first = await cache.get("metformin")
+        await cache.get("metformin")
+        await asyncio.sleep(0.1)
+        await cache.get("metformin")
+        return first
+
+    assert run(cache, scenario)["warnings"] == ["Consult your doctor"]
+    assert stub.requests == 2
+
+
+def test_not_found_is_a_cached_answer(stub):
+    stub.status = 404
+    cache = LabelCache(base_url=stub.url)
+
+    async def scenario():
+        await cache.get("unknownium")
+        return await cache.get("unknownium")
+
+    assert run(cache, scenario)["active_ingredient"] == ["unknownium"]
+    assert stub.requests == 1
+    assert cache.stats["upstream_errors"] == 0
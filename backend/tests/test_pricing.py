@@ -0,0 +1,103 @@
+"""PriceTable modelled prices, per-cell overrides and the bounded row cache"""
+import numpy as np
+import pytest
+
+from pricing import BRAND_MARKUP, PriceTable
+
+PHARMACIES = [
+    {"id": 1, "name": "A", "city": "Delhi", "area": "X", "lat": 28.6, "lng": 77.2, "open": True},
+    {"id": 2, "name": "B", "city": "Mumbai", "area": "Y", "lat": 19.1, "lng": 72.9, "open": True},
+    {"id": 3, "name": "C", "city": "Delhi", "area": "Z", "lat": 28.5, "lng": 77.1, "open": True},
+]
+
+
+@pytest.fixture
+def table():
+    return PriceTable(PHARMACIES, base_prices={"metformin": 100.0})
+
+
+def prices(table, drug, ids=(1, 2, 3)):
+    """pharmacy id -> generic price"""
+    ids = list(ids)
+    result = table.lookup(drug, ids)
+    return dict(zip((ids[i] for i in result.order.tolist()), result.generic.tolist()))
+
+
+def test_lookup_is_cheapest_first_with_brand_markup(table):
+    result = table.lookup("metformin", [1, 2, 3])
+    assert result.generic.tolist() == sorted(result.generic.tolist())
+    np.testing.assert_allclose(result.brand, np.round(result.generic * BRAND_MARKUP, 2))
+    np.testing.assert_allclose(result.savings, np.round(result.brand - result.generic, 2))
+
+
+def test_override_replaces_one_cell_only(table):
+    before = prices(table, "metformin")
+    table.set_price("Metformin", 2, 42.5)
+    after = prices(table, "metformin")
+    assert after[2] == 42.5
+    assert after[1] == before[1] and after[3] == before[3]
+    assert table.cheapest("metformin") == (2, 42.5)
+
+
+def test_override_survives_pharmacy_changes(table):
+    table.set_price("metformin", 1, 10.0)
+    table.update_pharmacy({**PHARMACIES[1], "city": "Chennai"})
+    table.add_pharmacy({"id": 4, "name": "D", "city": "Pune", "area": "W", "lat": 18.5, "lng": 73.9, "open": True})
+    assert prices(table, "metformin", (1, 2, 3, 4))[1] == 10.0
+
+
+def test_drop_drug_forgets_overrides_and_base_price(table):
+    modelled = prices(PriceTable(PHARMACIES), "metformin")
+    table.set_price("metformin", 1, 10.0)
+    table.drop_drug("Metformin")
+    assert prices(table, "metformin") == modelled
+
+
+def test_removed_pharmacies_are_never_priced(table):
+    table.set_price("metformin", 1, 1.0)
+    table.remove_pharmacy(1)
+    assert 1 not in prices(table, "metformin")
+    assert table.cheapest("metformin")[0] != 1
+
+
+def test_row_cache_is_bounded_by_bytes():
+    probe = PriceTable(PHARMACIES)
+    row_bytes = probe.row("x").nbytes
+    table = PriceTable(PHARMACIES, max_row_bytes=3 * row_bytes)
+    for i in range(100):
+        table.row(f"unknown-{i}")
+    assert table.stats()["rows"] == 3
+    assert table.stats()["row_bytes"] == 3 * row_bytes
+    # Least recently used rows go first
+    table.row("unknown-97")
+    table.row("fresh")
+    assert list(table._rows) == ["unknown-99", "unknown-97", "fresh"]
+
+
+def interleave(table, write):
+    """Run `write` once, as if from the event loop, while the next row is being computed"""
+    compute = table._compute_row
+
+    def racing_compute(key, columns):
+        table._compute_row = compute
+        write()
+        return compute(key, columns)
+
+    table._compute_row = racing_compute
+
+
+def test_a_row_computed_across_a_write_is_not_cached(table):
+    interleave(table, lambda: table.set_price("metformin", 2, 1.0))
+    # This read may predate the write, but the next one sees it
+    prices(table, "metformin")
+    assert prices(table, "metformin")[2] == 1.0
+
+
+def test_rows_are_read_with_the_columns_they_were_computed_against(table):
+    pharmacy = {"id": 4, "name": "D", "city": "Pune", "area": "W", "lat": 18.5, "lng": 73.9, "open": True}
+    interleave(table, lambda: table.add_pharmacy(pharmacy))
+    # Pharmacy 4 has no column in the row being computed, so it is left out rather than indexed past the end
+    assert set(prices(table, "metformin", (1, 2, 3, 4))) == {1, 2, 3}
+    assert set(prices(table, "metformin", (1, 2, 3, 4))) == {1, 2, 3, 4}
+    positions, matrix = table.matrix(["metformin", "aspirin"], [1, 2, 3, 4])
+    assert matrix.shape == (2, 4) and positions.tolist() == [0, 1, 2, 3]
@@ -0,0 +1,46 @@
+"""ResponseCache keys: per-process versions in memory, agreed versions in the shared tier"""
+from response_cache import CachedBody, MemoryStore, ResponseCache
+
+
+class DictStore:
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, entry: CachedBody):
+        self.entries[key] = entry
+
+
+def test_shared_tier_is_keyed_on_agreed_versions_not_local_counters():
+    shared = DictStore()
+    versions = {"a": (("catalogue", 1),), "b": (("catalogue", 1),)}
+    a = ResponseCache(MemoryStore(), shared, lambda: versions["a"])
+    b = ResponseCache(MemoryStore(), shared, lambda: versions["b"])
+    # Local counters drift apart, e.g. after different crowd reports landed on each worker
+    a.bump("drug:x")
+    b.bump("drug:y")
+    assert a.get_or_build(("compare", "x"), ("drug:x",), lambda: (b"from a", None)).body == b"from a"
+    assert b.get_or_build(("compare", "x"), ("drug:x",), lambda: (b"from b", None)).body == b"from a"
+    # Once the versions move, the old body is never read again
+    versions["b"] = (("catalogue", 2),)
+    b.bump("drug:x")
+    assert b.get_or_build(("compare", "x"), ("drug:x",), lambda: (b"fresh", None)).body == b"fresh"
+
+
+def test_shared_tier_is_skipped_while_versions_are_unsettled():
+    shared = DictStore()
+    versions = {"now": None}
+    cache = ResponseCache(MemoryStore(), shared, lambda: versions["now"])
+    cache.get_or_build(("nearby",), ("pharmacies",), lambda: (b"body", None))
+    assert not shared.entries
+
+    def build_during_a_reload():
+        versions["now"] = (("catalogue", 2),)
+        return b"built across a reload", None
+
+    versions["now"] = (("catalogue", 1),)
+    cache.bump("pharmacies")
+    cache.get_or_build(("nearby",), ("pharmacies",), build_during_a_reload)
+    assert not shared.entries
@@ -0,0 +1,92 @@
+"""Repository schema upgrades and transactional admin mutations on SQLite"""
+import asyncio
+
+import pytest
+
+from storage import Database, Repository, SQLiteDatabase
+
+# Tables as the first release's schema.sql created them
+OLD_SCHEMA = """
+CREATE TABLE users (id SERIAL PRIMARY KEY, email VARCHAR(255) UNIQUE NOT NULL, role VARCHAR(50) DEFAULT 'patient');
+CREATE TABLE drugs (id SERIAL PRIMARY KEY, generic_name VARCHAR(255) NOT NULL, brand_name VARCHAR(255),
+                    rxnorm_id VARCHAR(50), atc_code VARCHAR(50));
+CREATE TABLE pharmacies (id SERIAL PRIMARY KEY, name VARCHAR(255) NOT NULL, lat DECIMAL(10, 8), lng DECIMAL(11, 8));
+CREATE TABLE insurers (id SERIAL PRIMARY KEY, name VARCHAR(255) NOT NULL);
+INSERT INTO drugs (generic_name, brand_name, rxnorm_id, atc_code) VALUES ('Metformin', 'Glucophage', '6809', 'A10BA02');
+INSERT INTO pharmacies (name, lat, lng) VALUES ('CVS Pharmacy', 40.758, -73.9855);
+"""
+DRUG = {"generic": "metformin", "brand": "Glucophage", "rxnorm": "6809", "atc": "A10BA02"}
+
+
+def run(scenario):
+    async def main():
+        db = SQLiteDatabase(":memory:")
+        await db.connect()
+        try:
+            return await scenario(db, Repository(db))
+        finally:
+            await db.close()
+    return asyncio.run(main())
+
+
+def test_init_schema_upgrades_tables_from_an_older_schema():
+    async def scenario(db, repository):
+        await db.executescript(OLD_SCHEMA)
+        await repository.init_schema()
+        await repository.init_schema()
+        await repository.upsert_drug("Metformin", {**DRUG, "synonyms": ["glucophage"]})
+        await repository.upsert_insurer("aetna", "Aetna", 0.8)
+        return await repository.load_drugs(), await repository.load_pharmacies(), await db.columns("pharmacies")
+
+    drugs, pharmacies, columns = run(scenario)
+    # The existing row was backfilled, so the upsert updated it rather than adding a second metformin
+    assert list(drugs) == ["metformin"]
+    assert drugs["metformin"]["synonyms"] == ["glucophage"]
+    assert (pharmacies[0]["city"], pharmacies[0]["area"], pharmacies[0]["open"]) == ("", "", True)
+    assert {"city", "area", "is_open"} <= columns
+
+
+def test_delete_drug_removes_its_rows_and_logs_once():
+    async def scenario(db, repository):
+        await repository.init_schema()
+        await repository.upsert_drug("metformin", DRUG)
+        pharmacy_id = await repository.insert_pharmacy(
+            {"name": "A", "city": "Delhi", "area": "X", "lat": 28.6, "lng": 77.2, "open": True})
+        await repository.insert_prices([(await repository.drug_id("metformin"), pharmacy_id, 10.0, "crowd", 0.9)])
+        await repository.delete_drug("Metformin")
+        await repository.delete_drug("metformin")
+        prices = await db.fetch("SELECT id FROM prices")
+        return prices, await repository.changes_since(0, 100)
+
+    prices, changes = run(scenario)
+    assert prices == []
+    assert [(entity, key, op) for _, entity, key, op in changes] == [
+        ("drug", "metformin", "upsert"), ("pharmacy", "1", "upsert"), ("drug", "metformin", "delete")]
+
+
+def test_failed_delete_rolls_back_every_statement():
+    async def scenario(db, repository):
+        await repository.init_schema()
+        pharmacy_id = await repository.insert_pharmacy(
+            {"name": "A", "city": "Delhi", "area": "X", "lat": 28.6, "lng": 77.2, "open": True})
+        # The change log insert is the last statement, after the pharmacy row is gone
+        await db.execute("DROP TABLE change_log")
+        with pytest.raises(Exception):
+            await repository.delete_pharmacy(pharmacy_id)
+        return await repository.load_pharmacies()
+
+    assert [p["id"] for p in run(scenario)] == [1]
+
+
+def test_backends_missing_an_override_fail_when_created():
+    class NoColumns(Database):
+        async def connect(self): ...
+        async def close(self): ...
+        async def fetch(self, sql, *args): ...
+        async def execute(self, sql, *args): ...
+        async def executemany(self, sql, rows): ...
+        async def executescript(self, script): ...
+        def transaction(self): ...
+
+    with pytest.raises(TypeError, match="columns"):
+        NoColumns()
@@ -0,0 +1,43 @@
+"""Delta sync cursors, change folding and body encoding"""
+import gzip
+
+import pytest
+
+from sync import DELETE, GZIP_MIN_BYTES, UPSERT, Cursor, encode_body, fold_changes
+
+
+def test_cursor_round_trips_and_rejects_garbage():
+    assert Cursor.parse(str(Cursor(12, 345))) == Cursor(12, 345)
+    for text in ["", "12", "a.b", "-1.4", "3.-2"]:
+        with pytest.raises(ValueError):
+            Cursor.parse(text)
+
+
+def test_fold_keeps_each_entitys_last_op():
+    changes = [
+        (1, "drug", "metformin", UPSERT),
+        (2, "pharmacy", "7", UPSERT),
+        (3, "drug", "metformin", DELETE),
+        (4, "pharmacy", "7", DELETE),
+        (5, "pharmacy", "7", UPSERT),
+        (6, "drug", "lisinopril", UPSERT),
+    ]
+    delta = fold_changes(changes, [], [])
+    assert delta.drugs == {"metformin": DELETE, "lisinopril": UPSERT}
+    assert delta.pharmacies == {7: UPSERT}
+
+
+def test_fold_collects_priced_cells_of_tracked_drugs_only():
+    cells = [(1, "metformin", 3), (2, "metformin", 3), (3, "metformin", 5), (4, "omeprazole", 3)]
+    delta = fold_changes([], cells, ["metformin"])
+    assert delta.priced == {"metformin": {3, 5}}
+
+
+def test_small_bodies_are_not_compressed():
+    assert encode_body(b"{}", True) == (b"{}", None)
+    body = b"x" * GZIP_MIN_BYTES
+    encoded, encoding = encode_body(body, True)
+    assert encoding == "gzip" and gzip.decompress(encoded) == body
+    # Stable bytes, so the ETag of an unchanged payload stays the same
+    assert encode_body(body, True)[0] == encoded
+    assert encode_body(body, False) == (body, None)
@@ -0,0 +1,94 @@
+"""AppliedRows positions over id-ordered tables, and the versions a worker has settled on"""
+import asyncio
+
+from storage import Repository, SQLiteDatabase
+from versions import AppliedRows, VersionWatcher
+
+NOW = 1000.0
+SETTLED = NOW - 10
+
+
+def test_moves_over_loaded_and_own_rows_only():
+    position = AppliedRows()
+    position.loaded([1, 2])
+    rows = [(1, NOW, False), (2, NOW, False), (3, NOW, True), (4, NOW, False), (5, NOW, True)]
+    # Row 4 is another worker's, not loaded yet
+    assert position.advance(rows, SETTLED) == 3
+    position.loaded([4, 5])
+    assert position.advance(rows[3:], SETTLED) == 5
+
+
+def test_stops_at_a_recent_gap_and_skips_a_settled_one():
+    position = AppliedRows()
+    position.loaded([1, 3], through=0)
+    assert position.advance([(1, NOW, False), (3, NOW, False)], SETTLED) == 1
+    # Row 2 never showed up, and row 3 is now older than the settle time
+    assert position.advance([(3, SETTLED - 1, False)], SETTLED) == 3
+    assert position.is_loaded(2) and not position.is_loaded(4)
+
+
+def test_own_rows_wait_while_a_write_is_being_applied():
+    position = AppliedRows()
+    with position.writing():
+        assert position.advance([(1, NOW, True)], SETTLED) == 0
+    assert position.advance([(1, NOW, True)], SETTLED) == 1
+
+
+def test_a_reload_covers_everything_up_to_its_settled_position():
+    position = AppliedRows()
+    position.loaded([8, 9], through=6)
+    assert position.advance([(8, NOW, False)], SETTLED) == 6
+    position.loaded([7])
+    assert position.advance([(7, NOW, False), (8, NOW, False), (9, NOW, False)], SETTLED) == 9
+
+
+def test_settled_versions_wait_for_publishes_and_reloads():
+    async def scenario():
+        db = SQLiteDatabase(":memory:")
+        await db.connect()
+        repository = Repository(db)
+        await repository.init_schema()
+        a, b = VersionWatcher(repository, interval=60), VersionWatcher(repository, interval=60)
+        reloads = []
+
+        async def reload():
+            reloads.append(b.settled)
+
+        b.on("catalogue", reload)
+        try:
+            for watcher in (a, b):
+                await watcher.start()
+            assert a.settled == b.settled == ()
+            a.touch("catalogue")
+            assert a.settled is None
+            await a.sync()
+            assert a.settled == (("catalogue", 1),) and b.settled == ()
+            await b.sync()
+            # None while the reload ran, then the version it reloaded
+            assert reloads == [None] and b.settled == a.settled
+        finally:
+            for watcher in (a, b):
+                await watcher.stop()
+            await db.close()
+
+    asyncio.run(scenario())
+
+
+def test_without_polling_another_writer_unsettles_for_good():
+    async def scenario():
+        db = SQLiteDatabase(":memory:")
+        await db.connect()
+        repository = Repository(db)
+        await repository.init_schema()
+        watcher = VersionWatcher(repository, interval=0)
+        await watcher.snapshot()
+        watcher.touch("alerts")
+        await watcher.publish()
+        assert watcher.settled == (("alerts", 1),)
+        await repository.bump_version("alerts")
+        watcher.touch("alerts")
+        await watcher.publish()
+        assert watcher.settled is None
+        await db.close()
+
+    asyncio.run(scenario())
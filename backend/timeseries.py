@@ -0,0 +1,243 @@
+"""Compressed price history per (drug, pharmacy) and an incremental Holt forecaster over it"""
+import asyncio
+import os
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from storage import Repository
+
+FORECAST_INTERVAL = float(os.getenv("FORECAST_INTERVAL", "30"))
+FORECAST_HORIZON_DAYS = 7
+HISTORY_BATCH_SIZE = 50000
+CHUNK_SIZE = 256
+
+# Holt's linear smoothing: level, trend and mean-absolute-error weights
+ALPHA = 0.5
+BETA = 0.2
+ERROR_WEIGHT = 0.3
+# Floor on the gap between observations, so same-minute reports do not explode the trend
+MIN_STEP_DAYS = 1 / 24
+# A forecast this far (as a fraction of the level) from the level is a trend
+TREND_THRESHOLD = 0.02
+DAY = 86400.0
+
+STABLE, DROPPING, RISING = 0, -1, 1
+TREND_LABELS = {STABLE: "stable", DROPPING: "dropping", RISING: "rising"}
+BUY_ADVICE = {STABLE: "Now", DROPPING: f"In {FORECAST_HORIZON_DAYS} days", RISING: "Now"}
+
+Key = Tuple[str, int]
+
+
+def _narrow(deltas: np.ndarray) -> np.ndarray:
+    """Smallest signed integer dtype that holds every delta"""
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if not len(deltas) or (deltas.min() >= info.min and deltas.max() <= info.max):
+            return deltas.astype(dtype)
+    return deltas
+
+
+class Chunk(NamedTuple):
+    """Sealed run of points: first value plus narrowed deltas, for seconds and paise"""
+    first_time: int
+    first_price: int
+    time_deltas: np.ndarray
+    price_deltas: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return 16 + self.time_deltas.nbytes + self.price_deltas.nbytes
+
+
+class Series:
+    """
+    Append-only (time, price) points. Points accumulate in an open tail
+    and are sealed into delta-encoded columnar chunks of CHUNK_SIZE.
+    Prices move by a few rupees and reports arrive seconds to hours
+    apart, so most deltas fit in one or two bytes instead of eight.
+    """
+
+    __slots__ = ("chunks", "times", "prices")
+
+    def __init__(self):
+        self.chunks: List[Chunk] = []
+        self.times: List[int] = []
+        self.prices: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.chunks) * CHUNK_SIZE + len(self.times)
+
+    @property
+    def last_time(self) -> Optional[int]:
+        if self.times:
+            return self.times[-1]
+        if self.chunks:
+            chunk = self.chunks[-1]
+            return chunk.first_time + int(chunk.time_deltas.sum())
+        return None
+
+    def append(self, at: float, price: float):
+        last = self.last_time
+        # Append-only: a late point is stamped with the latest time seen
+        self.times.append(max(int(at), last) if last is not None else int(at))
+        self.prices.append(int(round(price * 100)))
+        if len(self.times) == CHUNK_SIZE:
+            times = np.array(self.times, dtype=np.int64)
+            prices = np.array(self.prices, dtype=np.int64)
+            self.chunks.append(Chunk(
+                int(times[0]), int(prices[0]), _narrow(np.diff(times)), _narrow(np.diff(prices))
+            ))
+            self.times = []
+            self.prices = []
+
+    def decode(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(epoch seconds, rupees) of every point, oldest first"""
+        times = []
+        prices = []
+        for chunk in self.chunks:
+            times.append(np.concatenate([[chunk.first_time], chunk.first_time + np.cumsum(chunk.time_deltas, dtype=np.int64)]))
+            prices.append(np.concatenate([[chunk.first_price], chunk.first_price + np.cumsum(chunk.price_deltas, dtype=np.int64)]))
+        times.append(np.array(self.times, dtype=np.int64))
+        prices.append(np.array(self.prices, dtype=np.int64))
+        return np.concatenate(times), np.concatenate(prices) / 100
+
+    @property
+    def nbytes(self) -> int:
+        return sum(chunk.nbytes for chunk in self.chunks) + 16 * len(self.times)
+
+
+class HoltState:
+    """Level, per-day trend and smoothed absolute error of one series, updated in O(1) per point"""
+
+    __slots__ = ("level", "trend", "error", "last_time", "count")
+
+    def __init__(self):
+        self.level = 0.0
+        self.trend = 0.0
+        self.error = 0.0
+        self.last_time = 0.0
+        self.count = 0
+
+    def update(self, at: float, price: float):
+        if not self.count:
+            self.level = price
+            self.last_time = at
+            self.count = 1
+            return
+        step = max((at - self.last_time) / DAY, MIN_STEP_DAYS)
+        expected = self.level + self.trend * step
+        previous = self.level
+        self.level = ALPHA * price + (1 - ALPHA) * expected
+        self.trend = BETA * (self.level - previous) / step + (1 - BETA) * self.trend
+        self.error = ERROR_WEIGHT * abs(price - expected) + (1 - ERROR_WEIGHT) * self.error
+        self.last_time = max(self.last_time, at)
+        self.count += 1
+
+    def forecast(self, horizon_days: float = FORECAST_HORIZON_DAYS) -> Tuple[float, int, float]:
+        """(predicted price, trend code, confidence in [0, 1])"""
+        predicted = max(0.0, self.level + self.trend * horizon_days)
+        change = (predicted - self.level) / self.level if self.level else 0.0
+        trend = DROPPING if change < -TREND_THRESHOLD else RISING if change > TREND_THRESHOLD else STABLE
+        # Fit quality, discounted while the series is still short
+        fit = max(0.0, 1 - self.error / self.level) if self.level else 0.0
+        confidence = fit * self.count / (self.count + 5)
+        return round(predicted, 2), trend, round(confidence, 2)
+
+
+class PriceForecaster:
+    """
+    The prices table is the durable observation log. A background task
+    reads rows past the last id it has seen, appends them to the in-memory
+    history and folds them into each touched series' Holt state. It then
+    publishes fresh forecasts into `forecasts`, keyed by drug and then by
+    pharmacy. Requests only index that mapping.
+
+    Each worker tails the table independently, so in multi-worker mode
+    every worker forecasts from the same observations.
+    """
+
+    def __init__(self, repository: Repository, interval: float = FORECAST_INTERVAL):
+        self.repository = repository
+        self.interval = interval
+        self.history: Dict[Key, Series] = {}
+        self.states: Dict[Key, HoltState] = {}
+        self.forecasts: Dict[str, Dict[int, Tuple[float, int, float]]] = {}
+        self._last_id = 0
+        self._subscribers: List[Callable[[Set[str]], None]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.metrics = {"refreshes": 0, "points": 0, "failures": 0, "last_refresh_ms": 0.0}
+
+    def subscribe(self, callback: Callable[[Set[str]], None]):
+        """callback(drugs) after forecasts for those drugs change"""
+        self._subscribers.append(callback)
+
+    def series(self, drug: str, pharmacy_id: int) -> Optional[Series]:
+        return self.history.get((drug, pharmacy_id))
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Signalled rather than cancelled, since wait_for can swallow a cancel
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        # The first pass replays the whole history, so it runs here rather than holding up startup
+        while not self._stopping:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.metrics["failures"] += 1
+                print(f"Forecast refresh failed: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def refresh(self):
+        start = time.perf_counter()
+        touched: Set[Key] = set()
+        while True:
+            rows = await self.repository.price_observations(self._last_id, HISTORY_BATCH_SIZE)
+            for row_id, drug, pharmacy_id, price, at in rows:
+                key = (drug, pharmacy_id)
+                series = self.history.get(key)
+                if series is None:
+                    series = self.history[key] = Series()
+                    self.states[key] = HoltState()
+                series.append(at, price)
+                self.states[key].update(at, price)
+                touched.add(key)
+                self._last_id = row_id
+            self.metrics["points"] += len(rows)
+            if len(rows) < HISTORY_BATCH_SIZE:
+                break
+            # Yield between batches so a large backlog does not stall requests
+            await asyncio.sleep(0)
+        if touched:
+            for drug, pharmacy_id in touched:
+                self.forecasts.setdefault(drug, {})[pharmacy_id] = self.states[(drug, pharmacy_id)].forecast()
+            drugs = {drug for drug, _ in touched}
+            for callback in self._subscribers:
+                callback(drugs)
+        self.metrics["refreshes"] += 1
+        self.metrics["last_refresh_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    def stats(self) -> dict:
+        return {
+            "series": len(self.history),
+            "history_bytes": sum(series.nbytes for series in self.history.values()),
+            "last_id": self._last_id,
+            **self.metrics
+        }
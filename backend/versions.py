@@ -0,0 +1,205 @@
+"""Versioned invalidation of per-worker in-memory state across processes"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from storage import Repository
+
+WORKERS = int(os.getenv("WORKERS", "1"))
+# A single process owns all its state, so polling is only on by default with workers
+SYNC_INTERVAL = float(os.getenv("SYNC_INTERVAL", "1.0" if WORKERS > 1 else "0"))
+
+
+class AppliedRows:
+    """
+    How far into an id-ordered table (change_log, prices) this worker's
+    memory reaches, so a sync cursor never passes a row it has not applied.
+    SERIAL ids are handed out at insert but become visible at commit, so a
+    row can show up behind one already read, and a lagging worker has not
+    taken in rows other workers committed long ago.
+
+    `through` only moves over rows this worker applied: rows a reload read
+    (`loaded`) and rows it wrote itself, unless one of its own writes is
+    still being applied (`writing`). A missing id is skipped once a later
+    row is older than the settle time; an id that long unseen was rolled
+    back or deleted.
+    """
+
+    def __init__(self):
+        self.through = 0
+        self._loaded: Set[int] = set()
+        self._writing = 0
+
+    def loaded(self, ids: Iterable[int], through: int = 0):
+        """A reload read `ids`, and every row up to `through` if given"""
+        self.through = max(self.through, through)
+        self._loaded.update(row_id for row_id in ids if row_id > self.through)
+
+    def is_loaded(self, row_id: int) -> bool:
+        return row_id <= self.through or row_id in self._loaded
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """Around a write of this worker's own rows and the update of its memory that follows"""
+        self._writing += 1
+        try:
+            yield
+        finally:
+            self._writing -= 1
+
+    def advance(self, rows: Iterable[Tuple[int, float, bool]], settled_before: float) -> int:
+        """Move past (id, created_at, own) rows read beyond `through`, in id order; returns `through`"""
+        for row_id, created_at, own in rows:
+            if row_id != self.through + 1 and created_at >= settled_before:
+                break
+            if not (row_id in self._loaded or (own and not self._writing)):
+                break
+            self.through = row_id
+        self._loaded = {row_id for row_id in self._loaded if row_id > self.through}
+        return self.through
+
+
+class VersionWatcher:
+    """
+    Each worker keeps its own in-memory catalogue, price table and rule
+    tables, while the database stays the source of truth. A worker that
+    changes something `touch`es the scope. Its background task bumps that
+    scope's counter in `data_versions` and then polls every counter. Any
+    scope moved by another worker is reloaded through its handler, in the
+    order the handlers were registered.
+
+    A worker does not reload its own changes. It knows the version it
+    last saw, so if its bump lands exactly one higher, nobody else wrote
+    in between. With an interval of 0 nothing is polled, but touched
+    scopes are still bumped straight away, since the catalogue snapshot
+    (see snapshot.py) is keyed on the "catalogue" version.
+
+    `settled` is the versions this worker's memory reflects, for keys
+    shared with other workers. It is None while a change of its own is
+    unpublished, a reload is running or has failed, or, without polling,
+    once another process has written, since nothing here reloads that.
+    """
+
+    def __init__(self, repository: Repository, interval: float = SYNC_INTERVAL):
+        self.repository = repository
+        self.interval = interval
+        self._handlers: List[Tuple[str, Callable[[], Awaitable[None]]]] = []
+        self._known: Optional[Dict[str, int]] = None
+        self._pending: Set[str] = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._diverged = False
+        self.settled: Optional[Tuple[Tuple[str, int], ...]] = None
+        self.metrics = {"polls": 0, "bumps": 0, "reloads": 0, "failures": 0, "last_reload_ms": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def on(self, scope: str, handler: Callable[[], Awaitable[None]]):
+        self._handlers.append((scope, handler))
+
+    def touch(self, *scopes: str):
+        """Mark scopes changed by this worker; written on the next poll, or at once when not polling"""
+        self.settled = None
+        self._pending.update(scopes)
+        if not self.enabled and self._wake is not None:
+            self._wake.set()
+
+    async def snapshot(self):
+        """Record current versions as seen, before loading the state they cover"""
+        self._known = await self.repository.load_versions()
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            if self._known is None:
+                await self.snapshot()
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            self._settle()
+
+    async def stop(self):
+        if self._task is not None:
+            # Signalled rather than cancelled, since wait_for can swallow a cancel
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+            await self._publish()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval if self.enabled else None)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                break
+            try:
+                await (self.sync() if self.enabled else self.publish())
+            except Exception as e:
+                self.metrics["failures"] += 1
+                print(f"Version sync failed: {e}")
+
+    def _settle(self):
+        if self._pending or self._diverged or -1 in self._known.values():
+            self.settled = None
+        else:
+            self.settled = tuple(sorted(self._known.items()))
+
+    async def publish(self):
+        """Bump pending scopes without polling; changes from other processes are not reloaded"""
+        if await self._publish():
+            self._diverged = True
+        self._settle()
+
+    async def _publish(self) -> Set[str]:
+        """Bump every pending scope; returns those someone else also moved"""
+        stale = set()
+        pending, self._pending = self._pending, set()
+        try:
+            for scope in sorted(pending):
+                version = await self.repository.bump_version(scope)
+                pending.discard(scope)
+                if version != self._known.get(scope, 0) + 1:
+                    stale.add(scope)
+                self._known[scope] = version
+                self.metrics["bumps"] += 1
+        finally:
+            # Scopes a failed pass did not bump are retried on the next one
+            self._pending.update(pending)
+        return stale
+
+    async def sync(self):
+        stale = await self._publish()
+        for scope, version in (await self.repository.load_versions()).items():
+            if version != self._known.get(scope, 0):
+                stale.add(scope)
+                self._known[scope] = version
+        self.metrics["polls"] += 1
+        if not stale:
+            self._settle()
+            return
+        self.settled = None
+        start = time.perf_counter()
+        for scope, handler in self._handlers:
+            if scope not in stale:
+                continue
+            try:
+                await handler()
+                self.metrics["reloads"] += 1
+            except Exception as e:
+                # Forget the version so the next poll retries this scope
+                self._known[scope] = -1
+                self.metrics["failures"] += 1
+                print(f"Reloading {scope} failed: {e}")
+        self.metrics["last_reload_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        self._settle()
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "workers": WORKERS, "pid": os.getpid(), **self.metrics}
@@ -18,21 +18,28 @@ export default function Admin() {
   useEffect(() => {
     const email = localStorage.getItem('medfinder_user')
     const role = localStorage.getItem('medfinder_role')
+    const token = localStorage.getItem('medfinder_token')
     
-    if (!email || role !== 'admin') {
+    if (!email || !token || role !== 'admin') {
       router.push('/login')
       return
     }
     
     setUserEmail(email)
-    loadStats(email)
+    loadStats(token)
   }, [router])
 
-  const loadStats = (email: string) => {
+  const loadStats = (token: string) => {
     fetch('http://localhost:8000/api/admin/stats', {
-      headers: { 'X-User-Email': email }
+      headers: { 'Authorization': `Bearer ${token}` }
     })
-      .then(res => res.json())
+      .then(res => {
+        if (res.status === 401) {
+          localStorage.clear()
+          router.push('/login')
+        }
+        return res.json()
+      })
       .then(data => setStats(data.data))
       .catch(err => console.error(err))
   }
@@ -44,7 +51,7 @@ export default function Admin() {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
-        'X-User-Email': userEmail
+        'Authorization': `Bearer ${localStorage.getItem('medfinder_token')}`
       },
       body: JSON.stringify(newMedicine)
     })
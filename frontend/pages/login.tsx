@@ -31,6 +31,7 @@ export default function Login() {
         localStorage.setItem('medfinder_user', data.data.email)
         localStorage.setItem('medfinder_role', data.data.role)
         localStorage.setItem('medfinder_name', data.data.name)
+        localStorage.setItem('medfinder_token', data.data.access_token)
         
         if (data.data.role === 'admin') {
           router.push('/admin')